@@ -0,0 +1,139 @@
+import os
+import json
+import shutil
+import hashlib
+import zipfile
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Set, Tuple
+
+import render_ir
+
+# Bump when generated papers change for the same questions so cached artifacts are rebuilt
+ARTIFACT_VERSION = 2
+
+# Question (and joined material) columns a generated paper is rendered from
+RENDER_FIELDS = ('id', 'type', 'content_html', 'options_html', 'answer_html', 'images',
+                 'material_id', 'material_content', 'material_images')
+
+def content_version(questions: List[dict]) -> str:
+    """Hash of everything the paper is rendered from, in paper order."""
+    # The IR version too: papers are rendered from the stored IR, not the HTML itself
+    h = hashlib.sha1(f"v{ARTIFACT_VERSION}.ir{render_ir.IR_VERSION}".encode("ascii"))
+    for q in questions:
+        h.update(json.dumps([q.get(k) for k in RENDER_FIELDS], ensure_ascii=False, default=str).encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+class _ZipSink:
+    """Write-only target for ZipFile that hands out what was written so far."""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def zip_chunks(members: Iterable[Tuple[str, bytes]]) -> Iterator[bytes]:
+    """
+    A zip of (name, data) members as a stream of chunks, for a streaming
+    response. Members are pulled lazily: the next one is only produced after
+    the previous one was handed out, so at most one is held in memory.
+    """
+    sink = _ZipSink()
+    # The sink cannot seek, so ZipFile writes sizes after each member (data descriptors)
+    with zipfile.ZipFile(sink, 'w') as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+            yield sink.take()
+    yield sink.take() # Central directory
+
+def write_zip(path: str, members: Iterable[Tuple[str, bytes]]):
+    with zipfile.ZipFile(path, 'w') as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+
+class ArtifactCache:
+    """
+    Built files keyed by (key, version), stored at <root>/<key>/<version>/<name>.
+    Only the latest version of a key is kept on disk.
+
+    Requests for the same key are coalesced: the first one builds while the
+    others wait on the key's lock and then return the finished file. Builds
+    write to a temporary name that is renamed into place when complete, so a
+    half-written file is never served.
+
+    Keys can be tagged (question ids for papers) so an edit to one question
+    drops every cached artifact that contains it. Tags are per process; with
+    several server processes an edit made in another one only leaves the
+    stale file behind, which its version no longer matches.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._locks: Dict[str, threading.Lock] = {}
+        self._tags: Dict[str, Set] = {} # key -> tags of its cached artifact
+        self._lock = threading.Lock()
+
+    def path_for(self, key: str, version: str, name: str) -> str:
+        return os.path.join(self.root, key, version, name)
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _remember(self, key: str, tags: Iterable):
+        with self._lock:
+            self._tags[key] = set(tags)
+
+    def get_or_build(self, key: str, version: str, name: str, build: Callable[[str], None],
+                     tags: Iterable = ()) -> str:
+        """Path of the cached artifact; on a miss build(path) writes it."""
+        path = self.path_for(key, version, name)
+        if not os.path.exists(path):
+            with self._key_lock(key):
+                # Built by the request we were waiting on
+                if not os.path.exists(path):
+                    self._build(key, path, build)
+        # Also after a restart, when the file was found on disk
+        self._remember(key, tags)
+        return path
+
+    def _build(self, key: str, path: str, build: Callable[[str], None]):
+        # Older versions of this key are stale now (the current one may be building in another process)
+        key_dir = os.path.join(self.root, key)
+        version_dir = os.path.dirname(path)
+        if os.path.isdir(key_dir):
+            for name in os.listdir(key_dir):
+                if os.path.join(key_dir, name) != version_dir:
+                    shutil.rmtree(os.path.join(key_dir, name), ignore_errors=True)
+        os.makedirs(version_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            build(tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def invalidate(self, key: str):
+        with self._key_lock(key):
+            # Files still being downloaded may not be removable (Windows); the version check skips them anyway
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+        with self._lock:
+            self._tags.pop(key, None)
+
+    def invalidate_tag(self, tag) -> List[str]:
+        """Drop every cached artifact tagged with `tag`; returns the keys dropped."""
+        with self._lock:
+            keys = [key for key, tags in self._tags.items() if tag in tags]
+        for key in keys:
+            self.invalidate(key)
+        return keys
@@ -0,0 +1,10 @@
+"""
+Benchmarks for the import pipeline and paper generation.
+
+    python -m bench.parser                      # run, print, write bench/results/parser.json
+    python -m bench.parser --compare bench/results/parser.json
+    python -m bench.generator                   # same for generation, bench/results/generator.json
+
+Papers and question rows are generated locally (see corpus.py, pool.py);
+nothing here touches reservoir.db, media/ or uploads/.
+"""
@@ -0,0 +1,142 @@
+"""
+Synthetic 解析-style exam papers.
+
+Each paper mimics what the importer sees in the wild: part headers
+("第一部分 常识判断"), numbered questions with A-D options, 【答案】/【解析】
+blocks with filler lines, material groups under 资料分析 and optional
+tables / images. Output is deterministic for a given spec.
+"""
+import io
+import os
+import random
+from dataclasses import dataclass, asdict
+from typing import List
+
+from docx import Document
+from docx.shared import Inches
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+PARTS = ["常识判断", "言语理解与表达", "数量关系", "判断推理", "资料分析"]
+CN_NUMS = "一二三四五六七八九十"
+
+FILLER = ("某市统计局数据显示，全年实现地区生产总值同比增长，其中第三产业增加值占比进一步提高，"
+          "居民人均可支配收入稳步增长，消费市场持续回暖。")
+
+
+@dataclass
+class CorpusSpec:
+    name: str
+    questions: int = 60
+    table_every: int = 0       # Every Nth question gets a small table (0 = none)
+    images: int = 0            # Images spread evenly over the questions
+    material_groups: int = 0   # 资料分析 groups of 5 questions sharing a material
+    seed: int = 0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+# Default corpus: size sweep plus one paper per feature
+DEFAULT_SPECS = [
+    CorpusSpec("small", questions=20),
+    CorpusSpec("medium", questions=120, table_every=10, images=10, material_groups=2),
+    CorpusSpec("large", questions=400, table_every=10, images=40, material_groups=8),
+    CorpusSpec("tables", questions=120, table_every=2),
+    CorpusSpec("images", questions=120, images=120),
+    CorpusSpec("materials", questions=120, material_groups=20),
+]
+
+QUICK_SPECS = [
+    CorpusSpec("small", questions=20),
+    CorpusSpec("medium", questions=120, table_every=10, images=10, material_groups=2),
+]
+
+
+def _png(rng: random.Random, w: int, h: int) -> io.BytesIO:
+    buf = io.BytesIO()
+    color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    Image.new("RGB", (w, h), color).save(buf, "PNG")
+    buf.seek(0)
+    return buf
+
+
+def _image_slots(spec: CorpusSpec) -> set:
+    if not spec.images or Image is None:
+        return set()
+    step = max(1, spec.questions // spec.images)
+    return set(range(1, spec.questions + 1, step)[:spec.images])
+
+
+def _add_question(doc, rng, num, with_table, with_image):
+    p = doc.add_paragraph(f"{num}. 根据上述内容，下列说法正确的是第{num}题（ ）")
+    if with_image:
+        p.add_run().add_picture(_png(rng, rng.choice((320, 640, 1200)), rng.choice((160, 400))),
+                                width=Inches(2))
+    if with_table:
+        t = doc.add_table(rows=3, cols=3)
+        for r in range(3):
+            for c in range(3):
+                t.cell(r, c).text = "项目" if r == 0 else str(rng.randint(10, 9999))
+    if rng.random() < 0.5:
+        doc.add_paragraph("A. 选项甲  B. 选项乙  C. 选项丙  D. 选项丁")
+    else:
+        for letter in "ABCD":
+            doc.add_paragraph(f"{letter}. 选项{letter}{num}")
+    answer = rng.choice("ABCD")
+    if rng.random() < 0.3:
+        # Answer marker in the middle of a paragraph (exercises the split path)
+        doc.add_paragraph(f"本题考查综合分析。正确答案：{answer}，{FILLER[:30]}")
+    else:
+        doc.add_paragraph(f"【答案】{answer} 【解析】第一步，{FILLER}")
+        doc.add_paragraph(f"第二步，{FILLER[:40]}")
+    doc.add_paragraph(f"故本题选{answer}。")
+
+
+def build_paper(spec: CorpusSpec, path: str) -> str:
+    rng = random.Random(spec.seed)
+    doc = Document()
+    doc.add_paragraph(f"合成试卷 {spec.name} 解析")
+
+    images = _image_slots(spec)
+    material_qs = spec.material_groups * 5
+    plain_qs = max(0, spec.questions - material_qs)
+    per_part = max(1, -(-plain_qs // (len(PARTS) - 1)))
+
+    num = 1
+    for i, part in enumerate(PARTS[:-1]):
+        if num > plain_qs:
+            break
+        doc.add_paragraph(f"第{CN_NUMS[i]}部分 {part}")
+        doc.add_paragraph(f"（共{per_part}题，参考时限10分钟）")
+        for _ in range(per_part):
+            if num > plain_qs:
+                break
+            _add_question(doc, rng, num,
+                          with_table=bool(spec.table_every) and num % spec.table_every == 0,
+                          with_image=num in images)
+            num += 1
+
+    if spec.material_groups:
+        doc.add_paragraph(f"第{CN_NUMS[len(PARTS) - 1]}部分 {PARTS[-1]}")
+        for _ in range(spec.material_groups):
+            doc.add_paragraph("根据以下材料，回答下列问题。")
+            doc.add_paragraph(FILLER * 2)
+            t = doc.add_table(rows=4, cols=4)
+            for r in range(4):
+                for c in range(4):
+                    t.cell(r, c).text = str(rng.randint(100, 99999))
+            for _ in range(5):
+                _add_question(doc, rng, num, with_table=False, with_image=num in images)
+                num += 1
+
+    doc.save(path)
+    return path
+
+
+def build_corpus(specs: List[CorpusSpec], out_dir: str) -> List[str]:
+    os.makedirs(out_dir, exist_ok=True)
+    return [build_paper(spec, os.path.join(out_dir, f"{spec.name}.docx")) for spec in specs]
@@ -0,0 +1,154 @@
+"""
+Generator benchmark.
+
+Times paper generation on synthetic question rows (see pool.py), per
+stage, with the output size and tracemalloc peak memory:
+
+    docx          PaperBuilder.build_paper + saving both documents, rows
+                  with stored render IR and image sizes (current imports)
+    docx_legacy   the same for rows saved before render IR / image sizes:
+                  HTML is parsed and every image probed
+    docx_embed    docx with images resampled for their print size
+                  (embed_images, warm cache)
+    html          paper_html.PaperHtml.render
+
+Stage times are self times; "other" is whatever no stage covers (the
+python-docx paragraph and run building).
+
+    python -m bench.generator [--quick] [--repeat 3] [--out bench/results/generator.json]
+    python -m bench.generator --compare bench/results/generator.json --threshold 0.2
+
+--compare exits with status 1 when any timing or peak memory regresses
+past the threshold.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import docx.document
+import docx.text.run
+
+import generator as generator_module
+import render_ir
+from embed_images import EmbedImages
+from generator import PaperBuilder
+from paper_html import PaperHtml
+from parsing import derivatives
+
+from .pool import DEFAULT_SPECS, QUICK_SPECS, build_rows
+from . import stages
+
+DEFAULT_OUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "generator.json")
+
+# Each target: (object, attribute, stage name, drain generator)
+DOCX_STAGES = [
+    (render_ir, "question_ir", "parse_html", False),
+    (render_ir, "material_ir", "parse_html", False),
+    (generator_module, "new_document", "template", False),
+    (PaperBuilder, "_image_size", "image_probe", False),
+    (EmbedImages, "fit", "resample", False),
+    (docx.text.run.Run, "add_picture", "add_picture", False),
+    (docx.document.Document, "save", "save", False),
+]
+
+HTML_STAGES = [
+    (render_ir, "question_ir", "parse_html", False),
+    (render_ir, "material_ir", "parse_html", False),
+]
+
+
+def _docx_run(builder: PaperBuilder, rows: list, sizes: dict):
+    def run():
+        # Fresh row dicts: the builder sorts and annotates them
+        docs = builder.build_paper([dict(q) for q in rows], "Paper_bench.docx", paper_uuid="bench")
+        sizes["bytes"] = sum(len(generator_module.docx_bytes(doc)) for _, doc in docs)
+    return run
+
+
+def _html_run(rows: list, image_meta: dict, sizes: dict):
+    def run():
+        sizes["bytes"] = len(PaperHtml(image_meta).render([dict(q) for q in rows], paper_uuid="bench").encode("utf-8"))
+    return run
+
+
+def bench_case(spec, work_dir: str, repeat: int, memory: bool) -> dict:
+    media_dir = os.path.join(work_dir, "media")
+    rows, image_meta = build_rows(spec, media_dir)
+    legacy_rows, _ = build_rows(spec, media_dir, legacy=True)
+    embed = EmbedImages(os.path.join(work_dir, "embed"))
+
+    targets = {
+        "docx": (lambda s: _docx_run(PaperBuilder(media_dir, image_meta=image_meta), rows, s), DOCX_STAGES),
+        "docx_legacy": (lambda s: _docx_run(PaperBuilder(media_dir), legacy_rows, s), DOCX_STAGES),
+        "docx_embed": (lambda s: _docx_run(PaperBuilder(media_dir, image_meta=image_meta, embed=embed), rows, s),
+                       DOCX_STAGES),
+        "html": (lambda s: _html_run(rows, image_meta, s), HTML_STAGES),
+    }
+
+    results = {}
+    for name, (make, stage_targets) in targets.items():
+        sizes = {}
+        run = make(sizes)
+        run()  # Warm-up: imports, base template, resample cache
+        r = stages.time_stages(run, stage_targets, repeat=repeat)
+        if memory:
+            r["peak_bytes"] = stages.peak_memory(run)
+        r["output_bytes"] = sizes["bytes"]
+        results[name] = r
+    shutil.rmtree(media_dir, ignore_errors=True)
+    return results
+
+
+def run(specs, repeat: int = 3, memory: bool = True) -> dict:
+    # Papers are built from media/ files only; no derivative work is wanted here
+    derivatives.PIPELINE.enabled = False
+
+    work_dir = tempfile.mkdtemp(prefix="bench_gen_")
+    results = {"env": stages.environment(), "specs": {}, "cases": {}}
+    try:
+        for spec in specs:
+            results["specs"][spec.name] = spec.to_dict()
+            results["cases"][spec.name] = bench_case(spec, work_dir, repeat, memory)
+            print(f"  {spec.name}: done", file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark paper generation (DOCX and HTML).")
+    parser.add_argument("--quick", action="store_true", help="Small papers only")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case (median is kept)")
+    parser.add_argument("--out", help=f"Where to write the JSON results (default {DEFAULT_OUT}, "
+                                      "not written when comparing unless given)")
+    parser.add_argument("--compare", metavar="BASELINE", help="Baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown (0.2 = 20%%)")
+    parser.add_argument("--min-ms", type=float, default=2.0, help="Ignore regressions smaller than this")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc run")
+    args = parser.parse_args(argv)
+
+    # Read the baseline first: --out may point at the same file
+    baseline = stages.load_results(args.compare) if args.compare else None
+
+    results = run(QUICK_SPECS if args.quick else DEFAULT_SPECS, repeat=args.repeat, memory=not args.no_memory)
+    print(stages.format_table(results))
+    out = args.out or (None if baseline is not None else DEFAULT_OUT)
+    if out:
+        stages.write_results(out, results)
+        print(f"Results written to {out}")
+
+    if baseline is not None:
+        problems = stages.compare(results, baseline, threshold=args.threshold, min_ms=args.min_ms)
+        if problems:
+            print("Regressions:")
+            for line in problems:
+                print("  " + line)
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
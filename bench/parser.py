@@ -0,0 +1,161 @@
+"""
+Parser benchmark.
+
+Times QuestionExtractor.extract_from_file (writing images and in preview
+mode), util/complete_converter.clean_docx_block and the fused
+pipeline.convert_paper (both in one parse) on the synthetic corpus, per
+stage, and records tracemalloc peak memory.
+Stage times are self times; "other" is whatever no stage covers.
+Peak memory only counts Python allocations (lxml's own heap is not traced).
+
+    python -m bench.parser [--quick] [--repeat 3] [--out bench/results/parser.json]
+    python -m bench.parser --compare bench/results/parser.json --threshold 0.2
+
+--compare exits with status 1 when any timing or peak memory regresses
+past the threshold.
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+import docx.document
+
+import extractor as extractor_module
+import pipeline
+from extractor import QuestionExtractor
+from parsing import core, derivatives, preprocessor
+from parsing.postprocessor import PostProcessor
+from parsing.rules import RULES
+from util import complete_converter
+
+from .corpus import DEFAULT_SPECS, QUICK_SPECS, build_paper
+from . import stages
+
+DEFAULT_OUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "parser.json")
+
+# Each target: (object, attribute, stage name, drain generator)
+EXTRACT_STAGES = [
+    (extractor_module, "Document", "load", False),
+    (preprocessor, "iter_block_items", "blocks", True),
+    (RULES, "classify", "classify", False),
+    (core, "process_buffer_as_question", "question", False),
+    (PostProcessor, "block_to_html", "html", False),
+    (PostProcessor, "_save_image_from_blip", "image_extract", False),
+    (PostProcessor, "_probe_image", "image_probe", False),
+]
+
+CONVERT_STAGES = [
+    (complete_converter, "Document", "load", False),
+    (complete_converter, "iter_block_items", "blocks", True),
+    (RULES, "classify", "classify", False),
+    (complete_converter, "apply_delete", "delete", False),
+    (complete_converter, "has_image", "has_image", False),
+    (docx.document.Document, "save", "save", False),
+]
+
+PIPELINE_STAGES = [
+    (pipeline, "Document", "load", False),
+    (preprocessor, "iter_block_items", "blocks", True),
+    (RULES, "classify", "classify", False),
+    (core, "process_buffer_as_question", "question", False),
+    (PostProcessor, "block_to_html", "html", False),
+    (pipeline, "clean_document", "clean", False),
+    (docx.document.Document, "save", "save", False),
+]
+
+
+def _quiet(fn):
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn()
+    return run
+
+
+def bench_paper(path: str, work_dir: str, repeat: int, memory: bool) -> dict:
+    media_dir = os.path.join(work_dir, "media")
+    out_docx = os.path.join(work_dir, "converted.docx")
+    extractor = QuestionExtractor(media_dir)
+
+    runs = {
+        "extract": (lambda: extractor.extract_from_file(path), EXTRACT_STAGES),
+        "extract_preview": (lambda: extractor.extract_from_file(path, preview_key="bench"), EXTRACT_STAGES),
+        "convert": (_quiet(lambda: complete_converter.clean_docx_block(path, out_docx)), CONVERT_STAGES),
+        "convert_extract": (lambda: pipeline.convert_paper(path, out_docx, extractor, preview_key="bench"),
+                            PIPELINE_STAGES),
+    }
+
+    results = {}
+    for name, (run, targets) in runs.items():
+        run()  # Warm-up: imports, regex caches, lxml
+        r = stages.time_stages(run, targets, repeat=repeat)
+        if memory:
+            r["peak_bytes"] = stages.peak_memory(run)
+        results[name] = r
+        shutil.rmtree(media_dir, ignore_errors=True)
+    r = results["extract"]
+    r["questions"] = len(extractor.extract_from_file(path, preview_key="bench"))
+    return results
+
+
+def run(specs, repeat: int = 3, memory: bool = True, keep: str = None) -> dict:
+    # Derivative generation runs on background threads and would compete
+    # with the timed work; its submit cost is negligible next to extraction.
+    derivatives.PIPELINE.enabled = False
+
+    corpus_dir = keep or tempfile.mkdtemp(prefix="bench_corpus_")
+    work_dir = tempfile.mkdtemp(prefix="bench_work_")
+    results = {"env": stages.environment(), "specs": {}, "cases": {}}
+    try:
+        for spec in specs:
+            path = build_paper(spec, os.path.join(corpus_dir, f"{spec.name}.docx"))
+            results["specs"][spec.name] = dict(spec.to_dict(), bytes=os.path.getsize(path))
+            results["cases"][spec.name] = bench_paper(path, work_dir, repeat, memory)
+            print(f"  {spec.name}: done", file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if not keep:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the DOCX import pipeline.")
+    parser.add_argument("--quick", action="store_true", help="Small corpus only")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case (median is kept)")
+    parser.add_argument("--out", help=f"Where to write the JSON results (default {DEFAULT_OUT}, "
+                                      "not written when comparing unless given)")
+    parser.add_argument("--compare", metavar="BASELINE", help="Baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown (0.2 = 20%%)")
+    parser.add_argument("--min-ms", type=float, default=2.0, help="Ignore regressions smaller than this")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc run")
+    parser.add_argument("--keep-corpus", metavar="DIR", help="Write the generated papers here and keep them")
+    args = parser.parse_args(argv)
+
+    # Read the baseline first: --out may point at the same file
+    baseline = stages.load_results(args.compare) if args.compare else None
+
+    results = run(QUICK_SPECS if args.quick else DEFAULT_SPECS, repeat=args.repeat,
+                  memory=not args.no_memory, keep=args.keep_corpus)
+    print(stages.format_table(results))
+    out = args.out or (None if baseline is not None else DEFAULT_OUT)
+    if out:
+        stages.write_results(out, results)
+        print(f"Results written to {out}")
+
+    if baseline is not None:
+        problems = stages.compare(results, baseline, threshold=args.threshold, min_ms=args.min_ms)
+        if problems:
+            print("Regressions:")
+            for line in problems:
+                print("  " + line)
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
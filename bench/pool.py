@@ -0,0 +1,144 @@
+"""
+Synthetic question rows for the generator benchmark.
+
+Rows look like what load_paper_questions / get_standard_exam_questions
+return (stored HTML, image lists, joined material), in four shapes: plain
+text questions, questions with inline formula images, 图形 questions with
+a large figure, and 资料 groups whose material has a table and a chart.
+Images are written to a media directory; output is deterministic for a
+given spec.
+"""
+import os
+import random
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Tuple
+
+from PIL import Image, ImageDraw
+
+import render_ir
+
+TEXT_TYPES = ["常识", "言语", "数量", "定义", "逻辑"]
+
+FILLER = ("某市统计局数据显示，全年实现地区生产总值同比增长，其中第三产业增加值占比进一步提高，"
+          "居民人均可支配收入稳步增长，消费市场持续回暖。")
+
+
+@dataclass
+class PoolSpec:
+    name: str
+    questions: int = 100
+    formula_every: int = 0     # Every Nth text question gets inline formula images (0 = none)
+    figures: int = 0           # 图形 questions with a large figure
+    material_groups: int = 0   # 资料 groups of 5 questions sharing a material (table + chart)
+    seed: int = 0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+# Size sweep (mixed shapes) plus one paper per shape
+DEFAULT_SPECS = [
+    PoolSpec("mixed_20", questions=20, formula_every=4, figures=2, material_groups=1),
+    PoolSpec("mixed_100", questions=100, formula_every=4, figures=10, material_groups=4),
+    PoolSpec("mixed_300", questions=300, formula_every=4, figures=30, material_groups=12),
+    PoolSpec("mixed_1000", questions=1000, formula_every=4, figures=100, material_groups=40),
+    PoolSpec("text", questions=120),
+    PoolSpec("formulas", questions=120, formula_every=1),
+    PoolSpec("figures", questions=120, figures=120),
+    PoolSpec("materials", questions=120, material_groups=24),
+]
+
+QUICK_SPECS = [
+    PoolSpec("mixed_20", questions=20, formula_every=4, figures=2, material_groups=1),
+    PoolSpec("mixed_100", questions=100, formula_every=4, figures=10, material_groups=4),
+]
+
+
+class _Images:
+    """Distinct PNGs (Word dedupes identical ones) with their sizes, like image_meta."""
+    def __init__(self, media_dir: str, rng: random.Random):
+        self.media_dir = media_dir
+        self.rng = rng
+        self.meta: Dict[str, dict] = {}
+        os.makedirs(media_dir, exist_ok=True)
+
+    def new(self, w: int, h: int) -> str:
+        name = f"bench_{len(self.meta):05d}.png"
+        img = Image.new("RGB", (w, h), "white")
+        draw = ImageDraw.Draw(img)
+        for _ in range(12):
+            points = [(self.rng.randrange(w), self.rng.randrange(h)) for _ in range(2)]
+            draw.line(points, fill=(self.rng.randrange(200), self.rng.randrange(200), 255), width=3)
+        img.save(os.path.join(self.media_dir, name), "PNG")
+        self.meta[name] = {"filename": name, "width": w, "height": h}
+        return name
+
+    def html(self, name: str, sized: bool = True) -> str:
+        meta = self.meta[name]
+        dims = f' width="{meta["width"]}" height="{meta["height"]}"' if sized else ""
+        return f'<div class="img-container"><img src="/media/{name}"{dims} class="question-img" loading="lazy" /></div>'
+
+
+def _options(num: int) -> str:
+    return "".join(f"<p>{letter}. 选项{letter}{num}，{FILLER[:12]}</p>" for letter in "ABCD")
+
+
+def _answer(rng: random.Random) -> str:
+    letter = rng.choice("ABCD")
+    return (f"<p>【答案】{letter} 【解析】第一步，{FILLER}</p><p>第二步，{FILLER[:40]}</p>"
+            f"<p>故本题选{letter}。</p>")
+
+
+def build_rows(spec: PoolSpec, media_dir: str, legacy: bool = False) -> Tuple[List[dict], Dict[str, dict]]:
+    """
+    (rows, image_meta) for a paper of spec.questions questions.
+    legacy=True gives rows as saved before render IR and stored image
+    sizes (no render_ir columns, no width/height on the tags).
+    """
+    rng = random.Random(spec.seed)
+    images = _Images(media_dir, rng)
+    rows = []
+
+    def add(q_type, content, images_used, material=None, material_images=(), material_id=None):
+        num = len(rows) + 1
+        q = {
+            "id": num, "original_num": num, "type": q_type,
+            "content_html": content, "options_html": _options(num), "answer_html": _answer(rng),
+            "images": list(images_used), "material_id": material_id,
+            "material_content": material, "material_images": list(material_images),
+        }
+        if not legacy:
+            q["render_ir"] = render_ir.dumps(render_ir.question_ir(
+                q["content_html"], q["options_html"], q["answer_html"], images.meta))
+            if material:
+                q["material_render_ir"] = render_ir.dumps(render_ir.material_ir(material, images.meta))
+        rows.append(q)
+
+    material_qs = spec.material_groups * 5
+    figures = min(spec.figures, spec.questions - material_qs)
+    text_qs = spec.questions - material_qs - figures
+
+    for i in range(text_qs):
+        stem = f"<p>第{i + 1}题：{FILLER[:rng.randint(20, len(FILLER))]}（ ）</p>"
+        used = []
+        if spec.formula_every and i % spec.formula_every == 0:
+            # Formula images: small, shown at text height
+            used = [images.new(rng.choice((80, 120, 200)), rng.choice((40, 60, 90))) for _ in range(2)]
+            stem += "".join(images.html(name, sized=not legacy) for name in used)
+        add(TEXT_TYPES[i % len(TEXT_TYPES)], stem, used)
+
+    for i in range(figures):
+        figure = images.new(900, 700)
+        add("图形", f"<p>从所给的四个选项中，选择最合适的一个填入问号处（图形{i + 1}）</p>"
+                   + images.html(figure, sized=not legacy), [figure])
+
+    for g in range(spec.material_groups):
+        chart = images.new(1600, 900)
+        cells = "".join("<tr>" + "".join(f"<td>{rng.randint(100, 99999)}</td>" for _ in range(4)) + "</tr>"
+                        for _ in range(4))
+        material = (f"<p>根据以下材料，回答下列问题。</p><p>{FILLER * 2}</p><table>{cells}</table>"
+                    + images.html(chart, sized=not legacy))
+        for _ in range(5):
+            add("资料", f"<p>{FILLER[:30]}，下列说法正确的是（ ）</p>", [],
+                material=material, material_images=[chart], material_id=g + 1)
+    return rows, images.meta
@@ -0,0 +1,156 @@
+"""
+Stage timing, peak memory and baseline comparison shared by the benchmarks.
+"""
+import gc
+import json
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from parsing.profiling import Profile
+
+
+class StageTimer(Profile):
+    """
+    Profile whose stages are attached from outside by wrapping functions,
+    so code without profiling hooks (the converters) can be measured too.
+    """
+    def wrap(self, stage: str, fn: Callable, consume: bool = False) -> Callable:
+        """Timed version of fn. consume=True drains a returned generator inside the stage."""
+        def timed(*args, **kwargs):
+            self.start(stage)
+            try:
+                result = fn(*args, **kwargs)
+                return list(result) if consume else result
+            finally:
+                self.stop()
+        return timed
+
+    @contextmanager
+    def patched(self, targets: List[Tuple[object, str, str, bool]]):
+        """Temporarily replace obj.attr with a timed wrapper for each (obj, attr, stage, consume)."""
+        restore = []
+        for obj, attr, stage, consume in targets:
+            # Classes and modules hold the attribute; instances get a shadowing one
+            owned = isinstance(obj, type) or attr in getattr(obj, "__dict__", {})
+            original = getattr(obj, attr)
+            restore.append((obj, attr, original, owned))
+            setattr(obj, attr, self.wrap(stage, original, consume))
+        try:
+            yield self
+        finally:
+            for obj, attr, original, owned in reversed(restore):
+                if owned:
+                    setattr(obj, attr, original)
+                else:
+                    delattr(obj, attr)
+
+
+def time_stages(run: Callable[[], object], targets, repeat: int = 3) -> dict:
+    """
+    Run `run` `repeat` times with `targets` instrumented.
+    Returns median wall time and median self time per stage, in ms.
+    """
+    walls, per_stage, calls = [], {}, {}
+    for _ in range(repeat):
+        gc.collect()
+        timer = StageTimer()
+        with timer.patched(targets):
+            start = time.perf_counter()
+            run()
+            walls.append(time.perf_counter() - start)
+        accounted = sum(timer.totals.values())
+        timer.totals["other"] = max(0.0, walls[-1] - accounted)
+        for stage, t in timer.totals.items():
+            per_stage.setdefault(stage, []).append(t)
+        calls = timer.calls
+    return {
+        "wall_ms": round(statistics.median(walls) * 1000, 3),
+        "stages_ms": {k: round(statistics.median(v) * 1000, 3) for k, v in sorted(per_stage.items())},
+        "calls": dict(sorted(calls.items())),
+    }
+
+
+def peak_memory(run: Callable[[], object]) -> int:
+    """Peak traced Python allocation (bytes) of one uninstrumented run."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+# --- Results / baselines ---
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def write_results(path: str, results: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+def load_results(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(current: dict, baseline: dict, threshold: float = 0.2,
+            min_ms: float = 2.0, memory_threshold: Optional[float] = None) -> List[str]:
+    """
+    Regressions of `current` against `baseline` as printable lines.
+    A timing regresses when it is more than `threshold` (fraction) slower
+    and at least `min_ms` slower, so tiny stages do not flap on noise.
+    """
+    memory_threshold = threshold if memory_threshold is None else memory_threshold
+    problems = []
+    for case, targets in current.get("cases", {}).items():
+        base_targets = baseline.get("cases", {}).get(case)
+        if not base_targets:
+            continue
+        for target, cur in targets.items():
+            base = base_targets.get(target)
+            if not base:
+                continue
+            checks = [("wall", cur["wall_ms"], base["wall_ms"])]
+            checks += [(f"stage {s}", ms, base["stages_ms"][s])
+                       for s, ms in cur["stages_ms"].items() if s in base.get("stages_ms", {})]
+            for label, now, before in checks:
+                if now - before >= min_ms and now > before * (1 + threshold):
+                    problems.append(f"{case}/{target} {label}: {before:.1f} -> {now:.1f} ms "
+                                    f"(+{(now / before - 1) * 100 if before else 100:.0f}%)")
+            if cur.get("peak_bytes") and base.get("peak_bytes"):
+                now, before = cur["peak_bytes"], base["peak_bytes"]
+                if now > before * (1 + memory_threshold):
+                    problems.append(f"{case}/{target} peak memory: {before / 1e6:.1f} -> {now / 1e6:.1f} MB")
+            if cur.get("output_bytes") and base.get("output_bytes"):
+                now, before = cur["output_bytes"], base["output_bytes"]
+                if now > before * (1 + memory_threshold):
+                    problems.append(f"{case}/{target} output size: {before / 1e6:.2f} -> {now / 1e6:.2f} MB")
+    return problems
+
+
+def format_table(results: dict) -> str:
+    lines = []
+    for case, targets in results.get("cases", {}).items():
+        for target, r in targets.items():
+            stages = ", ".join(f"{k} {v:.1f}" for k, v in
+                               sorted(r["stages_ms"].items(), key=lambda kv: -kv[1]))
+            peak = f"{r['peak_bytes'] / 1e6:.1f} MB" if r.get("peak_bytes") else "-"
+            out = f"  out {r['output_bytes'] / 1e6:>7.2f} MB" if r.get("output_bytes") else ""
+            lines.append(f"{case:<10} {target:<16} {r['wall_ms']:>9.1f} ms  peak {peak:>9}{out}  [{stages}]")
+    return "\n".join(lines)
@@ -1,21 +1,48 @@
+import re
 import sqlite3
 import json
 from datetime import datetime
 from typing import List, Dict, Optional
 
+import metrics
+
+# Bump whenever init_db changes (new table, column, index or trigger). Databases whose
+# PRAGMA user_version matches skip the schema checks at startup.
+SCHEMA_VERSION = 1
+# Seconds a connection waits for another one's write lock (server workers share the file)
+BUSY_TIMEOUT = 30
+# Stored images referenced by HTML (materials saved before their images column was filled)
+MEDIA_SRC_PATTERN = re.compile(r'<img src="/media/([^"/]+)"')
+
+# Per-method timings on /metrics, "db" in Server-Timing (not the connection helper or startup schema work)
+@metrics.timed_methods("db", exclude=("get_connection", "init_db"))
 class DatabaseManager:
     def __init__(self, db_path: str = "reservoir.db"):
         self.db_path = db_path
         self.init_db()
 
     def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT)
         conn.row_factory = sqlite3.Row
         return conn
 
     def init_db(self):
         conn = self.get_connection()
         cursor = conn.cursor()
+        try:
+            # Readers no longer block on a writer (or the other way round). Stored in the file.
+            cursor.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError as e:
+            print(f"Could not enable WAL: {e}")
+        if cursor.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+            conn.close()
+            return
+        # Workers starting together: one sets the schema up, the others wait and find it current
+        cursor.execute("BEGIN IMMEDIATE")
+        if cursor.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+            conn.rollback()
+            conn.close()
+            return
         
         # Sources
         cursor.execute('''
@@ -33,7 +60,9 @@ class DatabaseManager:
                 source_id INTEGER,
                 content_html TEXT,
                 images TEXT, -- JSON List
-                type TEXT
+                type TEXT,
+                fingerprint TEXT, -- Content hash of the material blocks
+                render_ir TEXT -- Pre-parsed generator input (render_ir.py)
             )
         ''')
         
@@ -49,6 +78,8 @@ class DatabaseManager:
                 options_html TEXT, -- Separated Options
                 answer_html TEXT, -- Analysis + Answer
                 images TEXT, -- JSON List
+                fingerprint TEXT, -- Content hash of the source blocks (incremental re-import)
+                render_ir TEXT, -- Pre-parsed generator input (render_ir.py)
                 FOREIGN KEY(source_id) REFERENCES sources(id),
                 FOREIGN KEY(material_id) REFERENCES materials(id)
             )
@@ -99,9 +130,89 @@ class DatabaseManager:
             )
         ''')
         
+        # Image Meta (Captured at extraction, so generation never probes files)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS image_meta (
+                filename TEXT PRIMARY KEY,
+                width INTEGER,
+                height INTEGER,
+                format TEXT,
+                bytes INTEGER
+            )
+        ''')
+        
+        # Columns added after the first release
+        self._ensure_column(cursor, "questions", "fingerprint", "TEXT")
+        self._ensure_column(cursor, "materials", "fingerprint", "TEXT")
+        self._ensure_column(cursor, "questions", "render_ir", "TEXT")
+        self._ensure_column(cursor, "materials", "render_ir", "TEXT")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_questions_source_num ON questions(source_id, original_num)")
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        
         conn.commit()
         conn.close()
 
+    def _ensure_column(self, cursor, table: str, column: str, decl: str):
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+    def get_source_id(self, filename: str) -> Optional[int]:
+        conn = self.get_connection()
+        c = conn.cursor()
+        c.execute("SELECT id FROM sources WHERE filename=?", (filename,))
+        row = c.fetchone()
+        conn.close()
+        return row['id'] if row else None
+
+    def get_source_questions(self, source_id: int) -> Dict[int, dict]:
+        """
+        original_num -> {id, fingerprint, images, material_id, material_fingerprint}
+        for every stored question of a source (what a re-import diffs against).
+        """
+        conn = self.get_connection()
+        c = conn.cursor()
+        c.execute('''
+            SELECT q.id, q.original_num, q.fingerprint, q.images, q.material_id,
+                   m.fingerprint as material_fingerprint
+            FROM questions q
+            LEFT JOIN materials m ON q.material_id = m.id
+            WHERE q.source_id=?
+        ''', (source_id,))
+        result = {}
+        for row in c.fetchall():
+            item = dict(row)
+            try:
+                item['images'] = json.loads(item['images']) if item['images'] else []
+            except:
+                item['images'] = []
+            result[item.pop('original_num')] = item
+        conn.close()
+        return result
+
+    def delete_orphan_materials(self, source_id: int) -> List[str]:
+        """Delete materials of a source no question uses any more; returns their image files."""
+        conn = self.get_connection()
+        c = conn.cursor()
+        c.execute('''
+            SELECT id, images, content_html FROM materials WHERE source_id=? AND id NOT IN
+            (SELECT material_id FROM questions WHERE material_id IS NOT NULL)
+        ''', (source_id,))
+        images = []
+        ids = []
+        for row in c.fetchall():
+            ids.append(row['id'])
+            try:
+                row_images = json.loads(row['images']) if row['images'] else []
+            except ValueError:
+                row_images = []
+            images.extend(row_images or MEDIA_SRC_PATTERN.findall(row['content_html'] or ''))
+        if ids:
+            c.execute(f"DELETE FROM materials WHERE id IN ({','.join('?' * len(ids))})", ids)
+        conn.commit()
+        conn.close()
+        return images
+
     def add_source(self, filename: str) -> int:
         conn = self.get_connection()
         c = conn.cursor()
@@ -124,20 +235,22 @@ class DatabaseManager:
         conn.close()
         return sid
 
-    def add_material(self, source_id: int, content: str, images: List[str] = [], type: str = "data_analysis") -> int:
+    def add_material(self, source_id: int, content: str, images: List[str] = [], type: str = "data_analysis",
+                     fingerprint: Optional[str] = None, render_ir: Optional[str] = None) -> int:
         # Check duplicate? (Simple check by content hash or just text matching if needed, 
         # but here we allow dupes if from different imports or relying on source_id)
         conn = self.get_connection()
         c = conn.cursor()
-        c.execute("INSERT INTO materials (source_id, content_html, images, type) VALUES (?, ?, ?, ?)",
-                  (source_id, content, json.dumps(images), type))
+        c.execute("INSERT INTO materials (source_id, content_html, images, type, fingerprint, render_ir) VALUES (?, ?, ?, ?, ?, ?)",
+                  (source_id, content, json.dumps(images), type, fingerprint, render_ir))
         mid = c.lastrowid
         conn.commit()
         conn.close()
         return mid
 
     def add_question(self, source_id: int, original_num: int, content: str, options: str,
-                     answer: str, images: List[str], type: str, material_id: Optional[int] = None) -> (int, bool):
+                     answer: str, images: List[str], type: str, material_id: Optional[int] = None,
+                     fingerprint: Optional[str] = None, render_ir: Optional[str] = None) -> (int, bool):
         conn = self.get_connection()
         c = conn.cursor()
         
@@ -146,29 +259,23 @@ class DatabaseManager:
         exist = c.fetchone()
         if exist:
             qid = exist['id']
-            # Update content
+            # Update content. Review stats are left alone here: a repeated mistake
+            # is counted by record_repeat_mistakes (confirm_save imports only,
+            # a re-import just refreshes the text).
             c.execute('''
                 UPDATE questions 
-                SET content_html=?, options_html=?, answer_html=?, images=?, type=?, material_id=?
+                SET content_html=?, options_html=?, answer_html=?, images=?, type=?, material_id=?, fingerprint=?, render_ir=?
                 WHERE id=?
-            ''', (content, options, answer, json.dumps(images), type, material_id, qid))
-            
-            # Increment Mistake Count (Repetition)
-            # Ensure it bumps back to at least 2 (New) even if it was at 1.
-            c.execute('''
-                UPDATE review_stats 
-                SET mistake_count = MAX(mistake_count + 1, 2)
-                WHERE question_id = ?
-            ''', (qid,))
+            ''', (content, options, answer, json.dumps(images), type, material_id, fingerprint, render_ir, qid))
             
             conn.commit()
             conn.close()
             return qid, False # Not new
             
         c.execute('''
-            INSERT INTO questions (source_id, material_id, original_num, type, content_html, options_html, answer_html, images)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (source_id, material_id, original_num, type, content, options, answer, json.dumps(images)))
+            INSERT INTO questions (source_id, material_id, original_num, type, content_html, options_html, answer_html, images, fingerprint, render_ir)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (source_id, material_id, original_num, type, content, options, answer, json.dumps(images), fingerprint, render_ir))
         
         qid = c.lastrowid
         
@@ -181,14 +288,114 @@ class DatabaseManager:
         conn.close()
         return qid, True # New
 
-    def update_question_text(self, qid: int, content: str, options: str, answer: str):
+    def unreferenced_images(self, images: List[str]) -> List[str]:
+        """
+        The images no question or material uses any more. One stored file can
+        back several questions (Word keeps a repeated picture once).
+        """
+        if not images: return []
+        conn = self.get_connection()
+        c = conn.cursor()
+        unused = []
+        for name in dict.fromkeys(images):
+            c.execute('''
+                SELECT 1 FROM questions WHERE instr(images, ?) > 0
+                UNION ALL
+                SELECT 1 FROM materials WHERE instr(images, ?) > 0 OR instr(content_html, ?) > 0
+                LIMIT 1
+            ''', (json.dumps(name), json.dumps(name), f'/media/{name}"'))
+            if c.fetchone() is None:
+                unused.append(name)
+        conn.close()
+        return unused
+
+    def record_repeat_mistakes(self, qids: List[int]):
+        """Questions imported again as mistakes: bump them back to at least 2 (New)."""
+        if not qids: return
+        conn = self.get_connection()
+        c = conn.cursor()
+        c.executemany('''
+            UPDATE review_stats 
+            SET mistake_count = MAX(mistake_count + 1, 2)
+            WHERE question_id = ?
+        ''', [(qid,) for qid in qids])
+        conn.commit()
+        conn.close()
+
+    def add_image_meta(self, meta: Dict[str, dict]):
+        """
+        Upsert image dimensions. meta: {filename: {width, height, format, bytes}}
+        """
+        if not meta: return
+        conn = self.get_connection()
+        c = conn.cursor()
+        c.executemany('''
+            INSERT OR REPLACE INTO image_meta (filename, width, height, format, bytes)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(f, m.get('width'), m.get('height'), m.get('format'), m.get('bytes')) for f, m in meta.items()])
+        conn.commit()
+        conn.close()
+
+    def get_image_meta(self, filenames: List[str]) -> Dict[str, dict]:
+        if not filenames: return {}
+        conn = self.get_connection()
+        c = conn.cursor()
+        result = {}
+        names = list(set(filenames))
+        # Stay under SQLite's host parameter limit
+        for i in range(0, len(names), 500):
+            chunk = names[i:i + 500]
+            c.execute(f"SELECT * FROM image_meta WHERE filename IN ({','.join(['?'] * len(chunk))})", chunk)
+            for row in c.fetchall():
+                result[row['filename']] = dict(row)
+        conn.close()
+        return result
+
+    def delete_image_meta(self, filenames: List[str]):
+        if not filenames: return
+        conn = self.get_connection()
+        c = conn.cursor()
+        c.executemany("DELETE FROM image_meta WHERE filename=?", [(f,) for f in filenames])
+        conn.commit()
+        conn.close()
+
+    def update_question_text(self, qid: int, content: str, options: str, answer: str,
+                             render_ir: Optional[str] = None):
         conn = self.get_connection()
         c = conn.cursor()
         c.execute('''
             UPDATE questions 
-            SET content_html=?, options_html=?, answer_html=?
+            SET content_html=?, options_html=?, answer_html=?, render_ir=?
             WHERE id=?
-        ''', (content, options, answer, qid))
+        ''', (content, options, answer, render_ir, qid))
+        conn.commit()
+        conn.close()
+
+    # --- Render IR backfill (rows saved before it existed, or with an older IR version) ---
+
+    def get_stale_render_ir(self, table: str, version: int, limit: int = 200) -> List[dict]:
+        """Rows of `questions` or `materials` whose render_ir is missing or not `version`."""
+        columns = "id, content_html" if table == "materials" else "id, content_html, options_html, answer_html"
+        conn = self.get_connection()
+        c = conn.cursor()
+        c.execute(f'''
+            SELECT {columns} FROM {table}
+            WHERE render_ir IS NULL OR json_extract(render_ir, '$.v') IS NOT ?
+            LIMIT ?
+        ''', (version, limit))
+        rows = [dict(row) for row in c.fetchall()]
+        conn.close()
+        return rows
+
+    def set_render_ir(self, table: str, version: int, items: List[tuple]):
+        """items: (id, render_ir). Rows that got a current IR meanwhile (an edit) are left alone."""
+        if not items: return
+        conn = self.get_connection()
+        c = conn.cursor()
+        c.executemany(f'''
+            UPDATE {table} SET render_ir=?
+            WHERE id=? AND (render_ir IS NULL OR json_extract(render_ir, '$.v') IS NOT ?)
+        ''', [(ir, rid, version) for rid, ir in items])
         conn.commit()
         conn.close()
 
@@ -254,7 +461,7 @@ class DatabaseManager:
         c = conn.cursor()
         
         query = '''
-            SELECT q.*, m.content_html as material_content, m.images as material_images
+            SELECT q.*, m.content_html as material_content, m.images as material_images, m.render_ir as material_render_ir
             FROM review_stats r
             JOIN questions q ON r.question_id = q.id
             LEFT JOIN materials m ON q.material_id = m.id
@@ -285,6 +492,22 @@ class DatabaseManager:
         conn.close()
         return questions
 
+    def _standard_composition(self, count: int = 135) -> List[tuple]:
+        """(type, needed) per module of the standard exam, scaled to `count` (see get_standard_exam_questions)."""
+        SCALE = count / 135.0
+        return [
+            ("常识", int(15 * SCALE)),
+            ("言语", int(30 * SCALE)),
+            ("数量", int(15 * SCALE)),
+            ("资料", int(20 * SCALE)),
+            ("政治理论", int(20 * SCALE)),
+            # Judyment Subtypes
+            ("图形", int(10 * SCALE)),
+            ("定义", int(10 * SCALE)),
+            ("类比", int(5 * SCALE)),
+            ("逻辑", int(10 * SCALE)),
+        ]
+
     def get_standard_exam_questions(self, count: int = 135):
         """
         Fetch questions respecting the standard composition (2026 Format):
@@ -386,20 +609,7 @@ class DatabaseManager:
         I will stick to 135 total.
         
         """
-        SCALE = count / 135.0
-        
-        composition = [
-            ("常识", int(15 * SCALE)),
-            ("言语", int(30 * SCALE)),
-            ("数量", int(15 * SCALE)),
-            ("资料", int(20 * SCALE)),
-            ("政治理论", int(20 * SCALE)),
-            # Judyment Subtypes
-            ("图形", int(10 * SCALE)),
-            ("定义", int(10 * SCALE)),
-            ("类比", int(5 * SCALE)),
-            ("逻辑", int(10 * SCALE)),
-        ]
+        composition = self._standard_composition(count)
         
         all_questions = []
         conn = self.get_connection()
@@ -418,7 +628,7 @@ class DatabaseManager:
             # Select with limit
             # Also join materials
             query = '''
-                SELECT q.*, m.content_html as material_content, m.images as material_images
+                SELECT q.*, m.content_html as material_content, m.images as material_images, m.render_ir as material_render_ir
                 FROM review_stats r
                 JOIN questions q ON r.question_id = q.id
                 LEFT JOIN materials m ON q.material_id = m.id
@@ -444,6 +654,50 @@ class DatabaseManager:
         
         return all_questions
 
+    def draw_papers(self, papers: int, count: int = 135, type_filter: List[str] = None,
+                    overlap: float = 0.0) -> List[List[dict]]:
+        """
+        Questions for several papers from one pass over the pool.
+        Each bucket (a module of the standard composition, or the type
+        filter with `count` questions) is read once in the usual priority
+        order (most mistakes first, random among equals) and cut into
+        consecutive windows, one per paper. `overlap` is the fraction of a
+        paper's questions it shares with the next one (0 = disjoint); when
+        the pool runs out, the later papers get fewer questions.
+        """
+        if type_filter:
+            buckets = [(f"q.type IN ({','.join(['?'] * len(type_filter))})", list(type_filter), count)]
+        else:
+            buckets = [("q.type LIKE ?", [f"%{type_key}%"], needed)
+                       for type_key, needed in self._standard_composition(count)]
+        overlap = min(max(overlap, 0.0), 1.0)
+
+        result = [[] for _ in range(papers)]
+        conn = self.get_connection()
+        c = conn.cursor()
+        for clause, params, needed in buckets:
+            if needed <= 0: continue
+            stride = needed - int(round(needed * overlap))
+            c.execute(f'''
+                SELECT q.*, m.content_html as material_content, m.images as material_images, m.render_ir as material_render_ir
+                FROM review_stats r
+                JOIN questions q ON r.question_id = q.id
+                LEFT JOIN materials m ON q.material_id = m.id
+                WHERE r.status = 'pool' AND {clause}
+                ORDER BY r.mistake_count DESC, RANDOM() LIMIT ?
+            ''', params + [stride * (papers - 1) + needed])
+            rows = []
+            for row in c.fetchall():
+                q = dict(row)
+                if q.get('images'): q['images'] = json.loads(q['images'])
+                if q.get('material_images'): q['material_images'] = json.loads(q['material_images'])
+                rows.append(q)
+            for i in range(papers):
+                # Copies: papers are built concurrently and the builders annotate their rows
+                result[i].extend(dict(q) for q in rows[i * stride:i * stride + needed])
+        conn.close()
+        return result
+
     def wipe_database(self):
         """
         Wipe all data from tables but keep the schema.
@@ -564,6 +818,14 @@ class DatabaseManager:
                 print("Added time_used column to exam_records.")
             except sqlite3.OperationalError:
                 pass # Already exists
+
+            # Migration 3: Block fingerprints for incremental re-import
+            self._ensure_column(c, "questions", "fingerprint", "TEXT")
+            self._ensure_column(c, "materials", "fingerprint", "TEXT")
+
+            # Migration 4: Pre-parsed render IR for generation
+            self._ensure_column(c, "questions", "render_ir", "TEXT")
+            self._ensure_column(c, "materials", "render_ir", "TEXT")
             
             conn.commit()
             print("Migration checks completed.")
@@ -611,6 +873,16 @@ class DatabaseManager:
         conn.commit()
         conn.close()
 
+    def record_generated_papers(self, papers: List[tuple]):
+        """papers: (uuid, question_ids) each, recorded in one transaction."""
+        conn = self.get_connection()
+        c = conn.cursor()
+        now = datetime.now().isoformat()
+        c.executemany("INSERT INTO generated_papers (uuid, created_at, question_ids) VALUES (?, ?, ?)",
+                      [(uuid, now, json.dumps(qids)) for uuid, qids in papers])
+        conn.commit()
+        conn.close()
+
     def get_generated_paper_qids(self, uuid: str) -> List[int]:
         conn = self.get_connection()
         c = conn.cursor()
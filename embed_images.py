@@ -0,0 +1,112 @@
+"""
+Print-size copies of images for generated DOCX papers.
+
+PaperBuilder shows most images at a fixed size (text height inline, 4cm
+for 图形, at most 5.5in wide for charts) but Word keeps every pixel of the
+embedded file. Before embedding, an image is resampled to just enough
+pixels for that size at `dpi`; the copy is cached under
+<cache_dir>/<sha1 of the source>-<w>x<h>.<ext> and reused by every later
+paper. Images already small enough, and formats PIL cannot resample, are
+embedded as they are.
+"""
+import os
+import math
+import hashlib
+import threading
+from typing import Dict, Optional, Tuple
+
+from parsing import derivatives
+from parsing.derivatives import RASTER_EXTS
+
+DEFAULT_DPI = 200
+# Resample only when the original has clearly more pixels than needed
+RESAMPLE_MARGIN = 1.25
+JPEG_QUALITY = 85
+
+
+class EmbedImages:
+    def __init__(self, cache_dir: str, dpi: int = DEFAULT_DPI):
+        self.cache_dir = cache_dir
+        self.dpi = dpi
+        self._digests: Dict[tuple, str] = {} # (path, mtime, size) -> sha1
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        # PIL is imported with the first paper, not at startup
+        return self.dpi > 0 and derivatives.load_pil()
+
+    def fit(self, path: str, size: Optional[Tuple[int, int]] = None,
+            width_in: float = None, height_in: float = None) -> str:
+        """
+        Path of the image to embed for a print width or height (inches):
+        a cached downscaled copy, or `path` itself. `size` is the source's
+        pixel size when already known.
+        """
+        if not self.enabled or not (width_in or height_in):
+            return path
+        ext = path.rsplit('.', 1)[-1].lower()
+        if ext not in RASTER_EXTS:
+            return path
+        from PIL import Image
+        try:
+            if not size:
+                with Image.open(path) as img:
+                    size = img.size
+            w, h = size
+            if width_in:
+                target_w = math.ceil(width_in * self.dpi)
+                target_h = max(1, round(h * target_w / w))
+            else:
+                target_h = math.ceil(height_in * self.dpi)
+                target_w = max(1, round(w * target_h / h))
+            if w <= target_w * RESAMPLE_MARGIN:
+                return path
+
+            # Photos stay JPEG; everything else becomes PNG (keeps transparency, and Word reads it)
+            out_ext = 'jpg' if ext in ('jpg', 'jpeg') else 'png'
+            out = os.path.join(self.cache_dir, f"{self._digest(path)}-{target_w}x{target_h}.{out_ext}")
+            if not os.path.exists(out):
+                self._resample(path, out, (target_w, target_h))
+            # Fewer pixels can still mean more bytes (antialiased line art as PNG)
+            return out if os.path.getsize(out) < os.path.getsize(path) else path
+        except Exception as e:
+            print(f"Embed resample failed for {path}: {e}")
+            return path
+
+    def _digest(self, path: str) -> str:
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            digest = self._digests.get(key)
+        if digest is None:
+            h = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            with self._lock:
+                self._digests[key] = digest
+        return digest
+
+    def _resample(self, path: str, out: str, target: Tuple[int, int]):
+        from PIL import Image
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Concurrent builds may resample the same image; the rename makes that harmless
+        tmp = f"{out}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            with Image.open(path) as img:
+                if out.endswith('.jpg'):
+                    img = img.convert('RGB')
+                    img.resize(target, Image.LANCZOS).save(tmp, 'JPEG', quality=JPEG_QUALITY)
+                else:
+                    # Palette / bilevel images resize badly (nearest only); resample in full colour
+                    if img.mode == '1':
+                        img = img.convert('L')
+                    elif img.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+                        img = img.convert('RGBA' if 'transparency' in img.info or img.mode == 'PA' else 'RGB')
+                    img.resize(target, Image.LANCZOS).save(tmp, 'PNG')
+            os.replace(tmp, out)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
@@ -1,5 +1,4 @@
 import os
-import re
 from typing import List, Dict, Optional
 from docx import Document
 # from docx.document import Document as _Document # Not strictly needed if only passing to preprocessor
@@ -9,123 +8,196 @@ from docx.table import Table
 from parsing import preprocessor
 from parsing import core
 from parsing.postprocessor import PostProcessor, FORCE_DELETE_LINES
+from parsing.rules import RULES
+from parsing import profiling
+from parsing.fingerprint import Fingerprinter
+import metrics
+
+PROGRESS_EVERY = 16 # Blocks between progress callbacks
+
+class ExtractionContext:
+    """
+    Parse state of one extraction: the document, its post processor and
+    fingerprinter, the current module and material. Created per call, so a
+    QuestionExtractor holds no state between (or during) extractions and
+    one instance can serve concurrent requests.
+    """
+    def __init__(self, doc, post_processor: PostProcessor, profile, skip_images=False, sub_dir=None):
+        self.doc = doc
+        self.post_processor = post_processor
+        self.fingerprinter = Fingerprinter(doc)
+        self.profile = profile
+        self.skip_images = skip_images
+        self.sub_dir = sub_dir
+
+        self.current_type = "Unknown"
+        self.reset_material()
+
+    def reset_material(self):
+        self.current_material_content = ""
+        self.current_material_images = []
+        self.current_material_blocks = [] # Rendered on first use by a question
+        self._material_rendered = False
+        self._material_fp = None
+
+    def add_material(self, blocks):
+        self.current_material_blocks.extend(blocks)
+        self._material_rendered = False
+        self._material_fp = None
+
+    def render_material(self):
+        # Material HTML (and its images) is produced only once a question needs it
+        if not self._material_rendered:
+            self.current_material_content = ""
+            self.current_material_images = []
+            for b in self.current_material_blocks:
+                h, imgs = self.post_processor.block_to_html(self.doc, b, skip_images=self.skip_images, sub_dir=self.sub_dir)
+                self.current_material_content += h
+                self.current_material_images.extend(imgs)
+            self._material_rendered = True
+
+    def material_fingerprint(self):
+        if not self.current_material_blocks:
+            return None
+        if self._material_fp is None:
+            self._material_fp = self.fingerprinter.blocks(self.current_material_blocks)
+        return self._material_fp
 
 class QuestionExtractor:
     def __init__(self, media_dir: str):
         self.media_dir = media_dir
-        self.post_processor = PostProcessor(media_dir)
-        
-        # Current State
-        self.current_material_id = None
-        self.current_material_content = ""
-        self.current_type = "Unknown"
+        # No parse state here (see ExtractionContext): one instance is shared by concurrent requests
         
         # Expose Patterns for main loop usage
         self.Q_PATTERN = preprocessor.Q_PATTERN
         self.HEADER_PATTERN = preprocessor.HEADER_PATTERN
         self.IGNORE_PATTERN = preprocessor.IGNORE_PATTERN
         self.FORCE_DELETE_LINES = FORCE_DELETE_LINES
+        self.rules = RULES
 
-    def extract_from_file(self, docx_path: str, target_ids: List[int] = None, skip_images: bool = False, sub_dir: str = None) -> List[Dict]:
+    @metrics.timed("parse")
+    def extract_from_file(self, docx_path: str, target_ids: List[int] = None, skip_images: bool = False, sub_dir: str = None, preview_key: str = None, profile=None, known_fingerprints: Dict[int, str] = None, progress=None) -> List[Dict]:
         """
         Main Entry: Parse file and return list of Question Dicts.
         If target_ids is None, return all.
+        With preview_key, images are not written; they are referenced as
+        "<preview_key>/<rId>" for the /preview route instead.
+        Without a profile one is created (and logged to profiling.PROFILES)
+        only when profiling is enabled.
+        Every question carries a content "fingerprint". Questions whose
+        fingerprint matches known_fingerprints[num] are not rendered; they come
+        back as {"original_num", "type", "fingerprint", "unchanged": True}.
+        progress(done, total) is called every few blocks; an exception it
+        raises (job cancellation) aborts the extraction.
+        """
+        mode = "preview" if preview_key else "save"
+        return self._run(docx_path, f"{os.path.basename(docx_path)} ({mode})", target_ids, skip_images,
+                         sub_dir, preview_key, profile, known_fingerprints, progress)
+
+    @metrics.timed("parse")
+    def extract_from_document(self, doc, label: str = "document", target_ids: List[int] = None, skip_images: bool = False, sub_dir: str = None, preview_key: str = None, profile=None, known_fingerprints: Dict[int, str] = None, progress=None) -> List[Dict]:
         """
-        doc = Document(docx_path)
-        blocks = list(preprocessor.iter_block_items(doc))
+        extract_from_file for an already loaded Document, so a caller that
+        also rewrites the paper parses it only once. The document is only
+        read; it is safe to modify once this returns.
+        """
+        return self._run(doc, label, target_ids, skip_images, sub_dir, preview_key, profile, known_fingerprints, progress)
+
+    def _run(self, source, label, target_ids, skip_images, sub_dir, preview_key, profile, known_fingerprints, progress=None) -> List[Dict]:
+        owns_profile = profile is None
+        if owns_profile:
+            profile = profiling.new_profile(label)
+        try:
+            return self._extract(source, target_ids, skip_images, sub_dir, preview_key, known_fingerprints or {},
+                                 profile, progress)
+        finally:
+            if owns_profile and profile.enabled:
+                profiling.PROFILES.add(profile)
+
+    def _extract(self, source, target_ids, skip_images, sub_dir, preview_key, known_fingerprints, profile,
+                 progress=None) -> List[Dict]:
+        if isinstance(source, str):
+            with profile.stage("load"):
+                doc = Document(source)
+        else:
+            doc = source
+        with profile.stage("blocks"):
+            blocks = list(preprocessor.iter_block_items(doc))
+        profile.count("blocks", len(blocks))
+        # Fresh per call: type, material, image meta and preview mode never leak between files
+        ctx = ExtractionContext(doc, PostProcessor(self.media_dir, preview_key=preview_key, profile=profile),
+                                profile, skip_images=skip_images, sub_dir=sub_dir)
+        
+        def emit(buffer, q_num):
+            # Questions outside target_ids are never rendered (no HTML, no image writes)
+            if target_ids is None or q_num in target_ids:
+                extracted_questions.append(self._build_question(ctx, buffer, q_num,
+                                                                known_fp=known_fingerprints.get(q_num)))
         
         extracted_questions = []
         buffer = []
         last_q_num = 0 
         current_q_num = 0
         
-        for block in blocks:
+        for i, block in enumerate(blocks):
+            if progress and i % PROGRESS_EVERY == 0:
+                progress(i, len(blocks))
             text = ""
             if isinstance(block, Paragraph):
                 text = block.text.strip()
             elif isinstance(block, Table):
                  pass
 
+            with profile.stage("classify"):
+                line = self.rules.classify(text)
+
             # 1. Check Header (Material / Type Change)
-            if self.HEADER_PATTERN.match(text):
+            if line.header:
                 if buffer and current_q_num > 0:
                     # Delegate to core
-                    q = core.process_buffer_as_question(
-                        doc, buffer, current_q_num, self.post_processor, 
-                        self.current_type, self.current_material_content, 
-                        skip_images=skip_images, sub_dir=sub_dir
-                    )
-                    if target_ids is None or current_q_num in target_ids:
-                         extracted_questions.append(q)
-                    
+                    emit(buffer, current_q_num)
                     buffer = []
                 
-                # Identify Type
-                is_material_header = text.strip().startswith("根据") or text.strip().startswith("阅读")
-                if not is_material_header:
-                    if "常识" in text: self.current_type = "常识"
-                    elif "言语" in text: self.current_type = "言语"
-                    elif "数量" in text: self.current_type = "数量"
-                    elif "资料" in text: self.current_type = "资料"
-                    elif "判断" in text: self.current_type = "判断" 
-                    elif "政治" in text: self.current_type = "政治理论" 
-                    
-                    if "图形" in text and "推理" in text: self.current_type = "图形"
-                    elif "定义" in text and "判断" in text: self.current_type = "定义"
-                    elif "类比" in text and "推理" in text: self.current_type = "类比"
-                    elif "逻辑" in text and "判断" in text: self.current_type = "逻辑"
+                # Identify Type (only part/section headers name a module)
+                if line.module:
+                    ctx.current_type = line.module
                 
                 # Material Handling
                 if current_q_num > 0:
                     last_q_num = current_q_num
                 
                 current_q_num = 0
-                self.current_material_content = "" 
+                ctx.reset_material()
                 
-                if "根据" in text or "材料" in text or "阅读" in text:
-                     h, _ = self.post_processor.block_to_html(doc, block, skip_images=skip_images, sub_dir=sub_dir)
-                     self.current_material_content += h
+                if line.material_cue:
+                     ctx.current_material_blocks.append(block)
                 
                 continue
 
             # 2. Check Question Start
-            match = self.Q_PATTERN.match(text)
             is_new_q = False
             found_num = 0
             
-            if match:
-                try:
-                    nums = re.findall(r'\d+', text)
-                    if nums:
-                        found_num = int(nums[0])
-                        # Sanity Check
-                        if found_num < 500: # Years like 2016 filtered
-                            if current_q_num == 0:
-                                # Check against LAST q_num if current is 0
-                                if last_q_num == 0:
-                                    is_new_q = True # Start of file
-                                elif (found_num == last_q_num + 1) or (found_num > last_q_num and found_num - last_q_num < 20):
-                                     is_new_q = True
-                            elif (found_num == current_q_num + 1) or (found_num > current_q_num and found_num - current_q_num < 20):
-                                is_new_q = True
-                except:
-                    pass
+            if line.q_num is not None:
+                found_num = line.q_num
+                # Sanity Check
+                if found_num < 500: # Years like 2016 filtered
+                    if current_q_num == 0:
+                        # Check against LAST q_num if current is 0
+                        if last_q_num == 0:
+                            is_new_q = True # Start of file
+                        elif (found_num == last_q_num + 1) or (found_num > last_q_num and found_num - last_q_num < 20):
+                             is_new_q = True
+                    elif (found_num == current_q_num + 1) or (found_num > current_q_num and found_num - current_q_num < 20):
+                        is_new_q = True
             
             if is_new_q:
                 # Process previous
                 if buffer:
                     if current_q_num > 0:
-                        q = core.process_buffer_as_question(
-                            doc, buffer, current_q_num, self.post_processor, 
-                            self.current_type, self.current_material_content, 
-                            skip_images=skip_images, sub_dir=sub_dir
-                        )
-                        if target_ids is None or current_q_num in target_ids:
-                            extracted_questions.append(q)
+                        emit(buffer, current_q_num)
                     else:
-                        for b in buffer:
-                            h, imgs = self.post_processor.block_to_html(doc, b, skip_images=skip_images, sub_dir=sub_dir)
-                            self.current_material_content += h
+                        ctx.add_material(buffer)
                 
                 # Start new
                 current_q_num = found_num
@@ -134,30 +206,46 @@ class QuestionExtractor:
             else:
                 if current_q_num > 0:
                     should_skip = False
-                    if isinstance(block, Paragraph) and text in self.FORCE_DELETE_LINES:
+                    if isinstance(block, Paragraph) and line.drop_line:
                         should_skip = True
                     
                     if not should_skip:
                         buffer.append(block)
                 else:
                     # check ignore
-                    if self.IGNORE_PATTERN.match(text):
+                    if line.ignore:
                         continue
                         
-                    h, imgs = self.post_processor.block_to_html(doc, block, skip_images=skip_images, sub_dir=sub_dir)
-                    if text or imgs:
-                        self.current_material_content += h
+                    # Text-less blocks only count when they carry an image
+                    if text or ctx.post_processor.has_images(doc, block):
+                        ctx.add_material([block])
 
         if buffer and current_q_num > 0:
+            emit(buffer, current_q_num)
+        
+        profile.count("questions", len(extracted_questions))
+        return extracted_questions
+
+    def _build_question(self, ctx: ExtractionContext, buffer, q_num, known_fp=None) -> Dict:
+        with ctx.profile.stage("fingerprint"):
+            material_fp = ctx.material_fingerprint()
+            fp = ctx.fingerprinter.question(q_num, ctx.current_type, material_fp, buffer)
+        if known_fp == fp:
+            ctx.profile.count("unchanged")
+            return {"original_num": q_num, "type": ctx.current_type, "fingerprint": fp, "unchanged": True}
+        
+        ctx.render_material()
+        with ctx.profile.stage("question"):
             q = core.process_buffer_as_question(
-                doc, buffer, current_q_num, self.post_processor, 
-                self.current_type, self.current_material_content, 
-                skip_images=skip_images, sub_dir=sub_dir
+                ctx.doc, buffer, q_num, ctx.post_processor, 
+                ctx.current_type, ctx.current_material_content, 
+                skip_images=ctx.skip_images, sub_dir=ctx.sub_dir, profile=ctx.profile
             )
-            if target_ids is None or current_q_num in target_ids:
-                extracted_questions.append(q)
-                
-        return extracted_questions
+        q["fingerprint"] = fp
+        q["material_fingerprint"] = material_fp
+        # Dimensions travel with the question so /confirm_save can persist them
+        q["image_meta"] = ctx.post_processor.meta_for(q["images"] + ctx.current_material_images)
+        return q
 
 if __name__ == "__main__":
     extractor = QuestionExtractor(media_dir="media")
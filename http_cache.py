@@ -0,0 +1,215 @@
+"""
+HTTP caching and compression.
+
+- Media files are written once under a random name and never changed, so
+  browsers may keep them for a year without asking again.
+- Pages and /static assets are revalidated on every use (ETag /
+  Last-Modified, answered with 304 when unchanged).
+- JSON listings get an ETag of their body, so an unchanged listing costs a
+  304 instead of the whole payload.
+- Text responses (HTML, JSON, CSS, JS) above COMPRESS_MIN_BYTES are sent
+  with brotli when the client accepts it and the brotli package is
+  installed, else gzip. Images, zips and DOCX are already compressed and
+  pass through untouched.
+"""
+import os
+import zlib
+import hashlib
+from email.utils import parsedate
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5 # Close to gzip -6 in speed, noticeably smaller
+THREAD_MIN_BYTES = 256 * 1024 # Bigger bodies are compressed off the event loop
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml",
+                      "image/svg+xml")
+SKIP_TYPES = ("text/event-stream",)
+
+def not_modified(response_headers, request_headers) -> bool:
+    """Same rules as StaticFiles: If-None-Match first, else If-Modified-Since."""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match:
+        etag = response_headers.get("etag", "").removeprefix("W/")
+        if if_none_match.strip() == "*":
+            return True
+        return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    since = parsedate(request_headers.get("if-modified-since", ""))
+    modified = parsedate(response_headers.get("last-modified", ""))
+    return since is not None and modified is not None and since >= modified
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles with a Cache-Control header on every file it serves."""
+    def __init__(self, *args, cache_control: str = REVALIDATE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers["Cache-Control"] = self.cache_control
+        return response
+
+def file_response(path: str, request: Request, cache_control: str = REVALIDATE, **kwargs) -> Response:
+    """FileResponse for a route (e.g. a page at /), with 304s like /static."""
+    response = FileResponse(path, stat_result=os.stat(path), **kwargs)
+    response.headers["Cache-Control"] = cache_control
+    if not_modified(response.headers, request.headers):
+        return NotModifiedResponse(response.headers)
+    return response
+
+def json_response(data, request: Request) -> Response:
+    """JSON whose ETag is a hash of the body; 304 when the client has it."""
+    response = JSONResponse(data)
+    response.headers["ETag"] = f'"{hashlib.sha1(response.body).hexdigest()}"'
+    response.headers["Cache-Control"] = "private, no-cache"
+    if not_modified(response.headers, request.headers):
+        return NotModifiedResponse(response.headers)
+    return response
+
+def accepted_encoding(accept_encoding: str) -> Optional[str]:
+    """"br" or "gzip" (in that order of preference) if the client takes it."""
+    codings = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        codings.add(name.strip())
+    if brotli is not None and "br" in codings:
+        return "br"
+    if "gzip" in codings or "*" in codings:
+        return "gzip"
+    return None
+
+def compressible(headers: Headers) -> bool:
+    media_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+    return media_type.startswith(COMPRESSIBLE_TYPES) and not media_type.startswith(SKIP_TYPES)
+
+class _Gzip:
+    def __init__(self):
+        self._z = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) # 31: gzip container
+
+    def compress(self, data: bytes) -> bytes:
+        return self._z.compress(data)
+
+    def finish(self) -> bytes:
+        return self._z.flush()
+
+class _Brotli:
+    def __init__(self):
+        self._c = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.process(data)
+
+    def finish(self) -> bytes:
+        return self._c.finish()
+
+class CompressionMiddleware:
+    """
+    Compresses text responses (see module docstring). Partial (206),
+    bodiless and already encoded responses pass through. A compressed
+    response gets a weak ETag, which the 304 checks above still match.
+    """
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = accepted_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        await _Responder(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+class _Responder:
+    def __init__(self, app, encoding: Optional[str], minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send = None
+        self.start = None # Held back until the first body chunk decides
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.on_send)
+
+    async def on_send(self, message):
+        kind = message["type"]
+        if self.passthrough:
+            await self.send(message)
+        elif kind == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            if (message["status"] in (204, 206, 304) or "content-encoding" in headers
+                    or not compressible(headers)):
+                self.passthrough = True
+                await self.send(message)
+            else:
+                # Caches must not hand a compressed copy to a client that did not ask for it
+                MutableHeaders(raw=message["headers"]).add_vary_header("Accept-Encoding")
+                self.start = message
+                if self.encoding is None:
+                    self.passthrough = True
+                    await self.send(message)
+        elif kind != "http.response.body":
+            # e.g. http.response.pathsend: nothing to compress in place
+            self.passthrough = True
+            await self.send(self.start)
+            await self.send(message)
+        elif self.compressor is None:
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self.send(self.start)
+                await self.send(message)
+                return
+            self.compressor = _Brotli() if self.encoding == "br" else _Gzip()
+            headers = MutableHeaders(raw=self.start["headers"])
+            headers["Content-Encoding"] = self.encoding
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+            data = await self._compress(body, final=not more_body)
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(data))
+            await self.send(self.start)
+            await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+        else:
+            more_body = message.get("more_body", False)
+            data = await self._compress(message.get("body", b""), final=not more_body)
+            await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+    async def _compress(self, body: bytes, final: bool) -> bytes:
+        def work():
+            data = self.compressor.compress(body)
+            return data + self.compressor.finish() if final else data
+        if len(body) >= THREAD_MIN_BYTES:
+            return await run_in_threadpool(work)
+        return work()
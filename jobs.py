@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import uuid
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+SAVE_INTERVAL = 0.5 # Seconds between progress writes of a shared job
+CANCEL_POLL = 0.2 # Seconds between looks for a cancel request from another process
+
+class JobCancelled(BaseException):
+    # BaseException (like asyncio.CancelledError) so the endpoints' generic
+    # `except Exception` error handling does not turn a cancel into a failure
+    pass
+
+class Job:
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.progress = 0.0 # 0..100
+        self.message = ""
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.file: Optional[str] = None # File result on disk, served by the API
+        self.content: Optional[bytes] = None # ... or bytes from the work, moved to a file when it finishes
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self._cancel = threading.Event()
+        self._shared_dir: Optional[str] = None # Set by a shared JobQueue
+        self._saved = 0.0
+        self._polled = 0.0
+        self._spilled = False # self.file was written by the queue (from content) and is removed with the job
+
+    @property
+    def cancel_requested(self) -> bool:
+        if not self._cancel.is_set() and self._shared_dir:
+            # DELETE /jobs/{id} may have reached another server process
+            now = time.time()
+            if now - self._polled >= CANCEL_POLL:
+                self._polled = now
+                if os.path.exists(os.path.join(self._shared_dir, f"{self.id}.cancel")):
+                    self._cancel.set()
+        return self._cancel.is_set()
+
+    def check(self):
+        """Called by the work at safe points; stops it once cancellation was requested."""
+        if self.cancel_requested:
+            raise JobCancelled()
+
+    def report(self, done: float, total: float, message: Optional[str] = None):
+        """Progress callback handed to the work: done/total units, also a cancellation point."""
+        self.check()
+        if total:
+            self.progress = round(min(100.0, done * 100.0 / total), 1)
+        if message is not None:
+            self.message = message
+        self.save()
+
+    def save(self, force: bool = False):
+        """Write the job's state for other server processes (shared queues only)."""
+        if not self._shared_dir:
+            return
+        now = time.time()
+        if not force and now - self._saved < SAVE_INTERVAL:
+            return
+        self._saved = now
+        state = self.to_dict(with_result=True)
+        state["file"] = self.file
+        path = os.path.join(self._shared_dir, f"{self.id}.json")
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False, default=str)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"Failed to save job {self.id}: {e}")
+
+    @classmethod
+    def load(cls, path: str) -> Optional["Job"]:
+        """Snapshot of a job run by another server process, from its saved state."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        job = cls(state["kind"])
+        for key in ("id", "status", "progress", "message", "error", "created", "started", "finished",
+                    "result", "file"):
+            setattr(job, key, state.get(key))
+        return job
+
+    def to_dict(self, with_result: bool = False) -> dict:
+        d = {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if with_result and self.status == DONE:
+            d["result"] = self.result
+        return d
+
+class JobQueue:
+    """
+    In-process background jobs on a bounded thread pool.
+    fn(job, *args) runs on a worker; it reports progress through
+    job.report(done, total) and is stopped at its next report/check after
+    cancel(). Finished jobs are kept `retention` seconds (and at most
+    `max_finished` of them) so clients can fetch the result. A result
+    handed over as job.content is written to <id>.bin (in a temporary
+    directory) rather than kept in memory, and removed with the job.
+
+    With `shared_dir` (several server processes), each job's state is also
+    written to <shared_dir>/<id>.json and <id>.bin goes there too, so any
+    process can report it and serve its file; cancel() of another
+    process's job leaves <id>.cancel, which the owner's next check()
+    picks up.
+    """
+    def __init__(self, workers: int = 2, retention: float = 600, max_finished: int = 100,
+                 shared_dir: Optional[str] = None):
+        self.retention = retention
+        self.max_finished = max_finished
+        self.shared_dir = shared_dir
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._spill_dir: Optional[str] = shared_dir # Created on first use when not shared
+
+    def submit(self, kind: str, fn: Callable, *args, **kwargs) -> Job:
+        job = Job(kind)
+        job._shared_dir = self.shared_dir
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        job.save(force=True)
+        self._pool.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job: Job, fn: Callable, args, kwargs):
+        if job.cancel_requested:
+            job.status = CANCELLED
+            job.finished = time.time()
+            job.save(force=True)
+            return
+        job.status = RUNNING
+        job.started = time.time()
+        job.save(force=True)
+        try:
+            job.result = fn(job, *args, **kwargs)
+            if job.content is not None:
+                # Results can be large (batch zips): keep them on disk, where other processes can serve them too
+                job.file = self._write_content(job)
+                job._spilled = True
+                job.content = None
+            job.progress = 100.0
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            job.error = getattr(e, "detail", None) or str(e)
+            job.status = FAILED
+        finally:
+            job.finished = time.time()
+            job.save(force=True)
+
+    def _write_content(self, job: Job) -> str:
+        with self._lock:
+            if self._spill_dir is None:
+                self._spill_dir = tempfile.mkdtemp(prefix="mistake-reservoir-jobs-")
+        path = os.path.join(self._spill_dir, f"{job.id}.bin")
+        with open(path + ".part", "wb") as f:
+            f.write(job.content)
+        os.replace(path + ".part", path)
+        return path
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.shared_dir and self._is_job_id(job_id):
+            job = Job.load(os.path.join(self.shared_dir, f"{job_id}.json"))
+        return job
+
+    def _is_job_id(self, value: str) -> bool:
+        return len(value) == 32 and all(c in "0123456789abcdef" for c in value)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            job = self.get(job_id)
+            if job and job.status not in FINISHED:
+                # Run by another process: it stops at its next check()
+                open(os.path.join(self.shared_dir, f"{job_id}.cancel"), "w").close()
+            return job
+        if job.status not in FINISHED:
+            job._cancel.set()
+            if job.status == QUEUED:
+                # Never started: report it right away; the worker skips it
+                job.status = CANCELLED
+                job.finished = time.time()
+                job.save(force=True)
+        return job
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            self._prune()
+            found = dict(self._jobs)
+        if self.shared_dir:
+            for name in os.listdir(self.shared_dir):
+                job_id = name[:-5]
+                if name.endswith(".json") and job_id not in found:
+                    job = Job.load(os.path.join(self.shared_dir, name))
+                    if job:
+                        found[job_id] = job
+        return sorted(found.values(), key=lambda j: j.created, reverse=True)
+
+    def _prune(self):
+        now = time.time()
+        finished = [j for j in self._jobs.values() if j.status in FINISHED]
+        finished.sort(key=lambda j: j.finished or 0)
+        excess = len(finished) - self.max_finished
+        for i, job in enumerate(finished):
+            if i < excess or now - (job.finished or now) > self.retention:
+                del self._jobs[job.id]
+                self._remove_spilled(job)
+        if self.shared_dir:
+            self._prune_shared(now)
+
+    def _prune_shared(self, now: float):
+        # Finished jobs of every process, and jobs of a process that died, once untouched for `retention`
+        for name in os.listdir(self.shared_dir):
+            job_id = name.split(".", 1)[0]
+            if job_id in self._jobs:
+                continue
+            path = os.path.join(self.shared_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.retention:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _remove_spilled(self, job: Job):
+        if job._spilled and job.file:
+            try:
+                os.remove(job.file)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        # Only this process's jobs: those listed from shared_dir belong to processes still running
+        with self._lock:
+            own = list(self._jobs)
+        for job_id in own:
+            self.cancel(job_id)
+        self._pool.shutdown(wait=False)
+        if self._spill_dir and not self.shared_dir:
+            # Results of this process only; shared ones stay for the other processes until pruned
+            import shutil
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
@@ -1,36 +1,46 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Body
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
-import shutil
+import startup # First, so --profile-startup can time the imports below
+from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Request
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, StreamingResponse, Response
+import json
 import os
-import uvicorn
+import re
 from datetime import datetime
+from urllib.parse import quote
 from typing import List, Optional, Dict
 from pydantic import BaseModel
 
-from extractor import QuestionExtractor
+# python-docx, bs4 and PIL are slow to import: extractor, pipeline, generator and the
+# converter are imported where they are used, so the server binds without them
 from database import DatabaseManager
+from parsing import derivatives, docx_zip, profiling
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.concurrency import run_in_threadpool
+from uploads import UploadStore, UploadTooLarge, OffsetMismatch
+from process_lock import file_lock
+import artifacts
+import http_cache
+import jobs
+import metrics
+import render_ir
+from embed_images import EmbedImages, DEFAULT_DPI
 
 from contextlib import asynccontextmanager
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Clean temp dir
-    temp_dir = os.path.join(MEDIA_DIR, "temp")
-    if os.path.exists(temp_dir):
-        try:
-            shutil.rmtree(temp_dir)
-            os.makedirs(temp_dir)
-            print("Cleaned media/temp directory.")
-        except Exception as e:
-            print(f"Failed to clean temp dir: {e}")
-    else:
-        os.makedirs(temp_dir)
-    
+    # Startup: rows saved before the render IR existed (or with an older one) get it in the background
+    threading.Thread(target=backfill_render_ir, daemon=True, name="render-ir-backfill").start()
+
     yield
-    # Shutdown logic if any
+    # Shutdown: drop queued derivative work and background jobs
+    derivatives.PIPELINE.shutdown(wait=False)
+    job_queue.shutdown()
 
 app = FastAPI(lifespan=lifespan)
+# gzip / brotli for HTML and JSON; images and zips pass through
+app.add_middleware(http_cache.CompressionMiddleware)
+# Outermost: request latency on /metrics and a Server-Timing header on every response
+app.add_middleware(metrics.MetricsMiddleware)
 
 # ... imports
 # Config
@@ -42,7 +52,34 @@ import webbrowser
 # Config
 import sys
 
+def parse_args(argv=None):
+    # Defaults come from the environment, so a service can be configured without flags
+    import argparse
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description="MistakeReservoir Server")
+    parser.add_argument("--t", action="store_true", help="Enter terminal debug mode (no server)")
+    parser.add_argument("--port", type=int, default=int(env("MISTAKE_RESERVOIR_PORT", 8000)),
+                        help="Starting port number (the exact port with --headless)")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Print import and init times once the server listens (also saved to startup_profile.txt)")
+    parser.add_argument("--headless", action="store_true",
+                        default=env("MISTAKE_RESERVOIR_HEADLESS", "") not in ("", "0"),
+                        help="Server only: no tray icon, no browser")
+    parser.add_argument("--host", default=env("MISTAKE_RESERVOIR_HOST", "127.0.0.1"),
+                        help="Interface to listen on with --headless (0.0.0.0 for the whole network)")
+    parser.add_argument("--workers", type=int, default=int(env("MISTAKE_RESERVOIR_WORKERS", 1)),
+                        help="Server processes with --headless")
+    parser.add_argument("--data-dir", default=env("MISTAKE_RESERVOIR_DATA_DIR"),
+                        help="Where the database, media, uploads and caches live")
+    return parser.parse_args(argv)
 
+if __name__ == "__main__":
+    # Needed before the data paths below. uvicorn workers import this module afresh
+    # (as "main", without our argv), so what shapes module state goes through the environment.
+    ARGS = parse_args()
+    if ARGS.data_dir:
+        os.environ["MISTAKE_RESERVOIR_DATA_DIR"] = os.path.abspath(ARGS.data_dir)
+    os.environ["MISTAKE_RESERVOIR_WORKERS"] = str(ARGS.workers if ARGS.headless else 1)
 
 if getattr(sys, 'frozen', False):
     # Running as compiled exe
@@ -54,17 +91,71 @@ else:
     # Running as script
     ASSET_DIR = os.path.dirname(os.path.abspath(__file__))
     DATA_DIR = ASSET_DIR
+DATA_DIR = os.environ.get("MISTAKE_RESERVOIR_DATA_DIR") or DATA_DIR
+# Server processes sharing DATA_DIR. State other processes must see (jobs, upload
+# sessions) is kept on disk then; the database copes through WAL and its busy timeout.
+WORKERS = max(1, int(os.environ.get("MISTAKE_RESERVOIR_WORKERS", 1)))
 
 # Mutable User Data (External)
 MEDIA_DIR = os.path.join(DATA_DIR, "media")
 UPLOAD_DIR = os.path.join(DATA_DIR, "uploads")
+CONVERTED_DIR = os.path.join(DATA_DIR, "converted") # Question-only papers, by upload sha256
 
 if not os.path.exists(UPLOAD_DIR): os.makedirs(UPLOAD_DIR)
+if not os.path.exists(CONVERTED_DIR): os.makedirs(CONVERTED_DIR)
 if not os.path.exists(MEDIA_DIR): os.makedirs(MEDIA_DIR)
+startup.mark("imports")
 
 # Init Components
 db = DatabaseManager(os.path.join(DATA_DIR, "reservoir.db"))
-extractor = QuestionExtractor(MEDIA_DIR)
+startup.mark("database")
+# Stateless between calls (parse state lives in a per-call ExtractionContext): shared by all
+# requests and jobs. Created by get_extractor() on first use, which imports python-docx.
+extractor = None
+_extractor_lock = threading.Lock()
+# Uploads are stored by content sha256; the digest doubles as the preview key
+upload_store = UploadStore(UPLOAD_DIR)
+UPLOAD_CHUNK_LIMIT = 8 * 1024 * 1024 # Max bytes per PUT /upload/{id}
+# Paper zips are built in memory and streamed. With the cache on they are also
+# kept on disk, keyed by paper uuid + content version of its questions, which
+# coalesces repeated downloads and enables Range requests.
+PAPER_CACHE = os.environ.get("MISTAKE_RESERVOIR_PAPER_CACHE", "") not in ("", "0")
+paper_cache = artifacts.ArtifactCache(os.path.join(DATA_DIR, "cache", "papers")) if PAPER_CACHE else None
+# Print-size image copies embedded in generated DOCX papers (0 embeds the originals)
+embed_images = EmbedImages(os.path.join(DATA_DIR, "cache", "embed"),
+                           dpi=int(os.environ.get("MISTAKE_RESERVOIR_EMBED_DPI", DEFAULT_DPI)))
+# Long-running work (?background=true on /generate, /analyze_file, /extract_preview)
+job_queue = jobs.JobQueue(workers=2, shared_dir=os.path.join(DATA_DIR, "cache", "jobs") if WORKERS > 1 else None)
+startup.mark("components")
+
+def get_extractor():
+    global extractor
+    if extractor is None:
+        with _extractor_lock:
+            if extractor is None:
+                from extractor import QuestionExtractor
+                extractor = QuestionExtractor(MEDIA_DIR)
+    return extractor
+
+# Preview images are served from the upload by /preview instead of being written
+# to media/; the preview key is the upload's content sha256.
+PREVIEW_REF_PATTERN = re.compile(r'^[0-9a-f]{64}/[\w\-]+$')
+PREVIEW_IMG_PATTERN = re.compile(r'<div class="img-container"><img src="/preview/([0-9a-f]{64}/[\w\-]+)"[^>]*/></div>')
+
+def register_preview_source(file_path: str) -> str:
+    upload_hash = docx_zip.file_digest(file_path)
+    # Legacy by-name uploads get a by-digest link too, so every server process can find them
+    upload_store.adopt(file_path, upload_hash)
+    return upload_hash
+
+def preview_source(upload_hash: str) -> Optional[str]:
+    return upload_store.resolve(file_id=upload_hash)
+
+def resolve_upload(filename: Optional[str], file_id: Optional[str]) -> str:
+    file_path = upload_store.resolve(file_id=file_id, filename=filename)
+    if not file_path:
+        raise HTTPException(status_code=404, detail="File not found")
+    return file_path
 
 
 # ... existing imports ...
@@ -73,8 +164,46 @@ class GenerateRequest(BaseModel):
     total_count: int
     types: List[str] = [] # e.g. ["常识", "言语"]
 
+def start_job(kind: str, fn, *args):
+    """202 with the job handle; poll GET /jobs/{id} for progress and the result."""
+    job = job_queue.submit(kind, fn, *args)
+    return JSONResponse(status_code=202, content=job.to_dict(), headers={"Location": f"/jobs/{job.id}"})
+
+@app.get("/jobs")
+def list_jobs():
+    return [job.to_dict() for job in job_queue.list()]
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict(with_result=True)
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    job = job_queue.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/file")
+def get_job_file(job_id: str):
+    job = job_queue.get(job_id)
+    if not job or job.status != jobs.DONE:
+        raise HTTPException(status_code=404, detail="No file for this job")
+    filename = (job.result or {}).get("filename")
+    if not job.file or not os.path.exists(job.file):
+        raise HTTPException(status_code=404, detail="No file for this job")
+    return FileResponse(job.file, filename=filename or os.path.basename(job.file))
+
 @app.post("/generate")
-async def generate_paper(req: GenerateRequest):
+def generate_paper(req: GenerateRequest, background: bool = False):
+    if background:
+        return start_job("generate", run_generate, req)
+    return paper_response(run_generate(None, req))
+
+def run_generate(job: Optional[jobs.Job], req: GenerateRequest) -> dict:
     # 1. Get Questions
     if not req.types:
         questions = db.get_standard_exam_questions()
@@ -84,33 +213,163 @@ async def generate_paper(req: GenerateRequest):
     if not questions:
         raise HTTPException(status_code=404, detail="No questions found matching criteria")
 
-    # 2. Generate UUID & Record
+    # 2. Generate UUID; qids are kept in paper order, like /generate_batch records them
     import uuid
     paper_uuid = str(uuid.uuid4())
+    render_ir.sort_questions(questions)
     qids = [q['id'] for q in questions]
-    db.record_generated_paper(paper_uuid, qids)
 
     # 3. Generate Doc
-    generated_files = create_paper_files(questions, paper_uuid)
-    
-    # Zip them
-    import zipfile
     zip_filename = f"Paper_{datetime.now().strftime('%Y%m%d%H%M%S')}.zip"
-    zip_path = os.path.join("media/temp", zip_filename)
-    
-    with zipfile.ZipFile(zip_path, 'w') as zf:
-        for fpath in generated_files:
-            if os.path.exists(fpath):
-                zf.write(fpath, os.path.basename(fpath))
-                
-    return FileResponse(zip_path, filename=zip_filename)
+    progress = job.report if job else None
+    if paper_cache:
+        # Same rows as /api/paper/{uuid}/download reads, so the download hits this entry
+        result = {"path": cached_paper_zip(paper_uuid, load_paper_questions(paper_uuid, qids), progress)}
+    else:
+        result = {"papers": build_paper(questions, paper_uuid, progress)}
+    result.update(filename=zip_filename, paper_uuid=paper_uuid)
+
+    if job:
+        if "path" in result:
+            job.file = result["path"]
+        else:
+            job.content = b"".join(artifacts.zip_chunks(paper_members(result["papers"])))
+        result = {"filename": zip_filename, "paper_uuid": paper_uuid, "download": f"/jobs/{job.id}/file"}
+
+    # 4. Record it once built: a failed or cancelled build leaves no paper in the history
+    db.record_generated_paper(paper_uuid, qids)
+    return result
+
+BATCH_MAX_PAPERS = 31
+BATCH_WORKERS = min(4, os.cpu_count() or 1)
+
+class BatchGenerateRequest(BaseModel):
+    papers: int # Number of papers
+    total_count: int = 135 # Questions per paper when filtering by type (like /generate)
+    types: List[str] = []
+    overlap: float = 0.0 # Fraction of questions a paper shares with the next (0 = disjoint)
+
+@app.post("/generate_batch")
+def generate_batch(req: BatchGenerateRequest, background: bool = False):
+    """Several papers in one archive, a folder per paper (Paper_<n>_<uuid prefix>/) with both documents."""
+    if not 1 <= req.papers <= BATCH_MAX_PAPERS:
+        raise HTTPException(status_code=400, detail=f"papers must be between 1 and {BATCH_MAX_PAPERS}")
+    if not 0.0 <= req.overlap <= 1.0:
+        raise HTTPException(status_code=400, detail="overlap must be between 0 and 1")
+    if background:
+        return start_job("generate_batch", run_generate_batch, req)
+    result = run_generate_batch(None, req)
+    return paper_response(result, headers={"X-Papers-Built": str(result["papers_built"])})
+
+def run_generate_batch(job: Optional[jobs.Job], req: BatchGenerateRequest) -> dict:
+    # 1. One pass over the pool for all papers
+    if req.types:
+        sets = db.draw_papers(req.papers, count=req.total_count, type_filter=req.types, overlap=req.overlap)
+    else:
+        sets = db.draw_papers(req.papers, overlap=req.overlap)
+    # A short pool leaves the last papers empty: those are not built (papers_built says how many were)
+    sets = [questions for questions in sets if questions]
+    if not sets:
+        raise HTTPException(status_code=404, detail="No questions found matching criteria")
 
-def create_paper_files(questions, paper_uuid):
+    # 2. Build (in paper order, which is also the order the qids are recorded in)
+    import uuid
+    uuids = [str(uuid.uuid4()) for _ in sets]
+    for questions in sets:
+        render_ir.sort_questions(questions)
+    built = build_papers(sets, uuids, progress=job.report if job else None)
+    members = []
+    for i, (paper_uuid, files) in enumerate(zip(uuids, built)):
+        members.extend((f"Paper_{i + 1:02d}_{paper_uuid[:8]}/{name}", data) for name, data in files)
+
+    zip_filename = f"Papers_{datetime.now().strftime('%Y%m%d%H%M%S')}.zip"
+    result = {"members": members, "filename": zip_filename, "paper_uuids": uuids, "papers_built": len(uuids)}
+    if job:
+        job.content = b"".join(artifacts.zip_chunks(members))
+        result = {"filename": zip_filename, "paper_uuids": uuids, "papers_built": len(uuids),
+                  "download": f"/jobs/{job.id}/file"}
+
+    # 3. Record them together, once all were built
+    db.record_generated_papers([(u, [q['id'] for q in questions]) for u, questions in zip(uuids, sets)])
+    return result
+
+def build_papers(sets, uuids, progress=None) -> List[list]:
+    """
+    [(file name, DOCX bytes)] per paper, built on a thread pool. The workers
+    share one PaperBuilder: the styled template, image sizes, resampled
+    images and image bytes are loaded once for the whole batch.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    generator = paper_builder([q for questions in sets for q in questions], share_images=True)
+    done = [0] * len(sets)
+    total = sum(len(questions) * 2 for questions in sets)
+
+    def build(i):
+        def report(n, _):
+            done[i] = n
+            if progress: progress(sum(done), total)
+        return list(paper_members(build_paper(sets[i], uuids[i], report, generator=generator)))
+
+    pool = ThreadPoolExecutor(max_workers=min(BATCH_WORKERS, len(sets)), thread_name_prefix="paper")
+    try:
+        # Each in the request's context: their render time shows up in its Server-Timing
+        futures = [pool.submit(metrics.in_request_context(build), i) for i in range(len(sets))]
+        return [future.result() for future in futures]
+    finally:
+        # A failure or cancel drops the papers not started yet
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def paper_members(papers):
+    """(file name, DOCX bytes) per document, each saved only when it is needed."""
+    from generator import docx_bytes
+    for name, doc in papers:
+        yield name, docx_bytes(doc)
+
+def paper_response(result: dict, headers: Dict[str, str] = None):
+    """The paper zip: the cached file, or streamed from memory as the documents are saved."""
+    if "path" in result:
+        return FileResponse(result["path"], filename=result["filename"], headers=headers)
+    headers = dict(headers or {}, **{"Content-Disposition": f'attachment; filename="{result["filename"]}"'})
+    return StreamingResponse(artifacts.zip_chunks(result_members(result)),
+                             media_type="application/zip", headers=headers)
+
+def result_members(result: dict):
+    # Batches come with their documents already saved
+    return result["members"] if "members" in result else paper_members(result["papers"])
+
+def cached_paper_zip(paper_uuid, questions, progress=None) -> str:
+    """Path of the paper zip in the artifact cache, built once per content version."""
+    version = artifacts.content_version(questions)
+    build = lambda path: artifacts.write_zip(path, paper_members(build_paper(questions, paper_uuid, progress)))
+    # Concurrent requests wait for the same build
+    return paper_cache.get_or_build(paper_uuid, version, f"Paper_{paper_uuid}.zip", build,
+                                    tags=[q['id'] for q in questions])
+
+def invalidate_papers(qid: int):
+    """Drop cached papers containing question `qid` (it was edited or removed)."""
+    if paper_cache:
+        paper_cache.invalidate_tag(qid)
+
+def paper_image_meta(questions) -> Dict[str, dict]:
+    # Stored dimensions let the renderers size images without opening them
+    names = []
+    for q in questions:
+        for key in ('images', 'material_images'):
+            val = q.get(key)
+            if isinstance(val, str):
+                try: val = json.loads(val)
+                except: val = []
+            names.extend(val or [])
+    return db.get_image_meta(names)
+
+def paper_builder(questions, share_images=False):
     from generator import PaperBuilder
-    generator = PaperBuilder(MEDIA_DIR)
-    filename_base = f"Paper_{paper_uuid}.docx"
-    output_path_base = os.path.join(MEDIA_DIR, "temp", filename_base)
-    os.makedirs(os.path.join(MEDIA_DIR, "temp"), exist_ok=True)
+    return PaperBuilder(MEDIA_DIR, image_meta=paper_image_meta(questions), embed=embed_images,
+                        share_images=share_images)
+
+def build_paper(questions, paper_uuid, progress=None, generator=None):
+    """[(file name, Document)] of the question paper and answer key, built in memory."""
+    generator = generator or paper_builder(questions)
     
     # Process images for docx
     for q in questions:
@@ -128,27 +387,28 @@ def create_paper_files(questions, paper_uuid):
                 q['images_abs'] = [os.path.join(MEDIA_DIR, img) for img in imgs]
             except: pass
 
-    return generator.create_paper(questions, output_path_base, paper_uuid=paper_uuid)
+    return generator.build_paper(questions, f"Paper_{paper_uuid}.docx", paper_uuid=paper_uuid, progress=progress)
 
 @app.get("/api/papers")
 def get_paper_history():
     return db.get_all_generated_papers()
 
-@app.get("/api/paper/{uuid}/download")
-def download_paper(uuid: str):
-    # 1. Get QIDs
-    qids = db.get_generated_paper_qids(uuid)
+@metrics.timed("db")
+def load_paper_questions(uuid: str, qids: Optional[List[int]] = None) -> List[dict]:
+    """Questions of a generated paper in paper order, numbered 1..n (`qids` for one not recorded yet)."""
+    if qids is None:
+        qids = db.get_generated_paper_qids(uuid)
     if not qids:
-        raise HTTPException(status_code=404, detail="Paper not found")
+        return []
 
-    # 2. Fetch Questions (Reusing logic from analyze_file but need a helper or direct query)
     import sqlite3
     conn = db.get_connection()
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
     
     query = f'''
-        SELECT q.*, s.filename as source_filename, m.content_html as material_content, m.images as material_images
+        SELECT q.*, s.filename as source_filename, m.content_html as material_content, m.images as material_images,
+               m.render_ir as material_render_ir
         FROM questions q
         LEFT JOIN sources s ON q.source_id = s.id
         LEFT JOIN materials m ON q.material_id = m.id
@@ -178,35 +438,104 @@ def download_paper(uuid: str):
             q['original_num'] = i + 1
             q['num'] = i + 1
             sorted_questions.append(q)
+    return sorted_questions
 
-    # 3. Generate
-    generated_files = create_paper_files(sorted_questions, uuid)
-    
-    # 4. Zip
-    import zipfile
-    zip_filename = f"Paper_{uuid}.zip"
-    zip_path = os.path.join(MEDIA_DIR, "temp", zip_filename)
-    
-    with zipfile.ZipFile(zip_path, 'w') as zf:
-        for fpath in generated_files:
-            if os.path.exists(fpath):
-                zf.write(fpath, os.path.basename(fpath))
-                
-    return FileResponse(zip_path, filename=zip_filename)
+@app.get("/api/paper/{uuid}/download")
+def download_paper(uuid: str, request: Request):
+    questions = load_paper_questions(uuid)
+    if not questions:
+        raise HTTPException(status_code=404, detail="Paper not found")
+
+    # The paper only changes when one of its questions is edited
+    version = artifacts.content_version(questions)
+    etag = f'"{version}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    if paper_cache:
+        # FileResponse answers Range / If-Range requests against this ETag
+        result = {"path": cached_paper_zip(uuid, questions)}
+    else:
+        result = {"papers": build_paper(questions, uuid)}
+    return paper_response(dict(result, filename=f"Paper_{uuid}.zip"), headers)
+
+@app.get("/api/paper/{uuid}/html")
+def view_paper(uuid: str, request: Request):
+    """The paper as one printable HTML page (questions, then the answer key)."""
+    questions = load_paper_questions(uuid)
+    if not questions:
+        raise HTTPException(status_code=404, detail="Paper not found")
+
+    version = artifacts.content_version(questions)
+    etag = f'"{version}-html"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    def render():
+        from paper_html import PaperHtml
+        return PaperHtml(paper_image_meta(questions)).render(questions, paper_uuid=uuid)
+
+    if paper_cache:
+        def build(path):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(render())
+        path = paper_cache.get_or_build(f"{uuid}-html", version, "paper.html", build,
+                                        tags=[q['id'] for q in questions])
+        return FileResponse(path, media_type="text/html; charset=utf-8", headers=headers)
+    return HTMLResponse(render(), headers=headers)
+
+class MediaFiles(http_cache.CachedStaticFiles):
+    """
+    Serves /media. Files there are written once under a random name, so they are
+    cached as immutable. A derivative that is still being generated falls back to
+    its original, which must not be cached under the derivative's URL.
+    """
+    async def get_response(self, path: str, scope):
+        try:
+            return await super().get_response(path, scope)
+        except StarletteHTTPException as e:
+            if e.status_code != 404:
+                raise
+            original = derivatives.original_for(os.path.join(MEDIA_DIR, path))
+            if not original:
+                raise
+            return FileResponse(original, headers={"Cache-Control": "no-store"})
 
 # Mount Static
-app.mount("/static", StaticFiles(directory=os.path.join(ASSET_DIR, "static")), name="static")
-app.mount("/media", StaticFiles(directory=MEDIA_DIR), name="media")
+app.mount("/static", http_cache.CachedStaticFiles(directory=os.path.join(ASSET_DIR, "static")), name="static")
+app.mount("/media", MediaFiles(directory=MEDIA_DIR, cache_control=http_cache.IMMUTABLE), name="media")
 
 # Models
 class AnalyzeRequest(BaseModel):
-    filename: str
+    filename: Optional[str] = None
+    file_id: Optional[str] = None # Content sha256 from /upload
+    profile: bool = False # Profile this request even if profiling is off
+
+class ProfilingToggle(BaseModel):
+    enabled: bool
 
 class ExtractRequest(BaseModel):
-    filename: str
+    filename: Optional[str] = None
+    file_id: Optional[str] = None
     ranges: Optional[str] = None
     ids: Optional[List[int]] = None
 
+class UploadInitRequest(BaseModel):
+    filename: str
+    size: Optional[int] = None
+    sha256: Optional[str] = None # Lets a known file skip the transfer entirely
+    upload_id: Optional[str] = None # Resume an interrupted upload
+
+class ReimportRequest(BaseModel):
+    filename: str # Source name the questions were imported under
+    file_id: Optional[str] = None # Updated document (defaults to the upload named `filename`)
+
+class ConvertRequest(BaseModel):
+    filename: Optional[str] = None
+    file_id: Optional[str] = None
+
 class SaveRequest(BaseModel):
     source_filename: str
     questions: List[dict]
@@ -223,7 +552,9 @@ class UpdateRequest(BaseModel):
 @app.post("/api/question/update")
 def update_question(req: UpdateRequest):
     try:
-        db.update_question_text(req.id, req.content_html, req.options_html, req.answer_html)
+        ir = question_render_ir(req.content_html, req.options_html, req.answer_html)
+        db.update_question_text(req.id, req.content_html, req.options_html, req.answer_html, render_ir=ir)
+        invalidate_papers(req.id)
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -249,17 +580,12 @@ def delete_question(qid: int):
             except: pass
         conn.close()
 
-        # Delete FileSystem Images
-        for img in images_to_delete:
-            p = os.path.join(MEDIA_DIR, img)
-            if os.path.exists(p):
-                try:
-                    os.remove(p)
-                except Exception as ex:
-                    print(f"Failed to delete {p}: {ex}")
-
         # Delete DB Record
         db.delete_question(qid)
+        invalidate_papers(qid)
+
+        # Delete FileSystem Images (and their derivatives) no other question still uses
+        remove_media_files(db.unreferenced_images(images_to_delete))
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -273,15 +599,83 @@ def get_exam_stats():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/")
-def read_root():
-    return FileResponse(os.path.join(ASSET_DIR, "static/index.html"))
+def read_root(request: Request):
+    return http_cache.file_response(os.path.join(ASSET_DIR, "static/index.html"), request)
+
+def upload_result(filename: str, digest: str, duplicate: bool) -> dict:
+    # A known digest comes back with its analysis, so the client can skip /analyze_file
+    return {
+        "filename": filename,
+        "file_id": digest,
+        "duplicate": duplicate,
+        "analysis": upload_store.load_analysis(digest) if duplicate else None
+    }
+
+def upload_error(e: Exception):
+    if isinstance(e, OffsetMismatch):
+        return JSONResponse(status_code=409, content={"message": str(e), "offset": e.offset})
+    return JSONResponse(status_code=413, content={"message": str(e)})
 
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    return {"filename": file.filename}
+    # Single-shot upload, streamed through an upload session so the digest
+    # is computed while writing and identical files are stored once
+    filename = os.path.basename(file.filename)
+    try:
+        session = upload_store.start(filename)
+        while True:
+            chunk = await file.read(1024 * 1024)
+            if not chunk: break
+            await run_in_threadpool(upload_store.append, session, session.offset, chunk)
+        digest, duplicate = await run_in_threadpool(upload_store.complete, session)
+    except (UploadTooLarge, OffsetMismatch) as e:
+        return upload_error(e)
+    return upload_result(filename, digest, duplicate)
+
+@app.post("/upload/init")
+def upload_init(req: UploadInitRequest):
+    filename = os.path.basename(req.filename)
+    if req.sha256 and upload_store.exists(req.sha256.lower()):
+        return {"status": "complete", **upload_result(filename, req.sha256.lower(), True)}
+    try:
+        session = upload_store.start(filename, req.size, req.upload_id)
+    except UploadTooLarge as e:
+        return upload_error(e)
+    return {"status": "pending", "upload_id": session.upload_id, "offset": session.offset}
+
+@app.get("/upload/{upload_id}")
+def upload_status(upload_id: str):
+    session = upload_store.get(upload_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"upload_id": upload_id, "offset": session.offset, "size": session.size}
+
+@app.put("/upload/{upload_id}")
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    session = upload_store.get(upload_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    body = bytearray()
+    async for part in request.stream():
+        body += part
+        if len(body) > UPLOAD_CHUNK_LIMIT:
+            return JSONResponse(status_code=413, content={"message": "Chunk too large"})
+    try:
+        new_offset = await run_in_threadpool(upload_store.append, session, offset, bytes(body))
+    except (UploadTooLarge, OffsetMismatch) as e:
+        return upload_error(e)
+    return {"upload_id": upload_id, "offset": new_offset}
+
+@app.post("/upload/{upload_id}/complete")
+async def upload_complete(upload_id: str):
+    session = upload_store.get(upload_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    try:
+        digest, duplicate = await run_in_threadpool(upload_store.complete, session)
+    except OffsetMismatch as e:
+        return upload_error(e)
+    return upload_result(session.filename, digest, duplicate)
 
 def parse_ranges(range_str: str) -> List[int]:
     if not range_str: return []
@@ -302,21 +696,56 @@ def parse_ranges(range_str: str) -> List[int]:
             except: pass
     return sorted(list(ids))
 
+PROFILES_IN_RESPONSE = 5 # Recent extraction profiles attached to /analyze_file
+
+def with_profiles(result: dict, forced: bool = False) -> dict:
+    if not (profiling.ENABLED or forced):
+        return result
+    return dict(result, profiles=profiling.PROFILES.recent(PROFILES_IN_RESPONSE))
+
+@app.get("/debug/profiles")
+def get_profiles():
+    return {"enabled": profiling.ENABLED, "profiles": profiling.PROFILES.all()}
+
+@app.post("/debug/profiles")
+def toggle_profiles(req: ProfilingToggle):
+    # Per process: with --workers N only the worker answering this request changes
+    profiling.ENABLED = req.enabled
+    return {"enabled": profiling.ENABLED}
+
+@app.delete("/debug/profiles")
+def clear_profiles():
+    profiling.PROFILES.clear()
+    return {"status": "success"}
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text format: request latency, in-flight requests, db / parse / render timings."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.post("/analyze_file")
-def analyze_file(req: AnalyzeRequest):
-    file_path = os.path.join(UPLOAD_DIR, req.filename)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
+def analyze_file(req: AnalyzeRequest, background: bool = False):
+    if background:
+        return start_job("analyze", run_analyze, req)
+    return run_analyze(None, req)
+
+def run_analyze(job: Optional[jobs.Job], req: AnalyzeRequest):
+    file_path = resolve_upload(req.filename, req.file_id)
+    upload_hash = docx_zip.file_digest(file_path)
+
+    # Same bytes were analyzed before: return the stored result without parsing.
+    # Only import results are cached; review papers depend on the database.
+    # An explicit profile request re-runs the extraction so there is something to measure.
+    cached = None if req.profile else upload_store.load_analysis(upload_hash)
+    if cached is not None:
+        return with_profiles(cached)
 
     # --- 1. Detect Paper ID (Review Mode) ---
     paper_uuid = None
     try:
         from docx import Document as DocxDocument
-        doc = DocxDocument(file_path)
-        if len(doc.paragraphs) > 0:
-            first_para = doc.paragraphs[0].text.strip()
-            if first_para.startswith("Paper ID: "):
-                paper_uuid = first_para.replace("Paper ID: ", "").strip()
+        from pipeline import generated_paper_id
+        paper_uuid = generated_paper_id(DocxDocument(file_path))
     except Exception as e:
         print(f"Error checking Paper ID: {e}")
         # Continue to standard extraction if fails (might be PDF or other format)
@@ -325,11 +754,10 @@ def analyze_file(req: AnalyzeRequest):
         # --- REVIEW MODE (Manual Selection) ---
         # Instead of auto-processing, we fetch the questions and return them to the FE
         # so the user can SELECT which ones they got wrong.
+        qids = db.get_generated_paper_qids(paper_uuid)
+        if not qids:
+            raise HTTPException(status_code=404, detail=f"Paper ID {paper_uuid} not found locally.")
         try:
-            qids = db.get_generated_paper_qids(paper_uuid)
-            if not qids:
-                 return JSONResponse(status_code=404, content={"message": f"Paper ID {paper_uuid} not found locally."})
-
             # Fetch existing questions
             # We want them to look like "imported" questions but with IDs preserved
             import sqlite3
@@ -389,14 +817,19 @@ def analyze_file(req: AnalyzeRequest):
 
     # --- 2. Standard Extraction Mode (Import) ---
     try:
-        from extractor import QuestionExtractor
-        extractor = QuestionExtractor(MEDIA_DIR)
-        questions = extractor.extract_from_file(file_path)
+        # Structure only: images stay in the DOCX (no writes)
+        profile = profiling.new_profile(f"{req.filename or os.path.basename(file_path)} (analyze)", force=req.profile)
+        questions = get_extractor().extract_from_file(file_path, preview_key=register_preview_source(file_path),
+                                                profile=profile, progress=job.report if job else None)
+        if profile.enabled:
+            profiling.PROFILES.add(profile)
         
-        return {
+        result = {
             "type": "import",
             "data": questions
         }
+        upload_store.save_analysis(upload_hash, result)
+        return with_profiles(result, req.profile)
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -404,10 +837,13 @@ def analyze_file(req: AnalyzeRequest):
         
 
 @app.post("/extract_preview")
-def extract_preview(req: ExtractRequest):
-    file_path = os.path.join(UPLOAD_DIR, req.filename)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
+def extract_preview(req: ExtractRequest, background: bool = False):
+    if background:
+        return start_job("extract_preview", run_extract_preview, req)
+    return run_extract_preview(None, req)
+
+def run_extract_preview(job: Optional[jobs.Job], req: ExtractRequest) -> dict:
+    file_path = resolve_upload(req.filename, req.file_id)
     
     target_ids = []
     if req.ids:
@@ -416,8 +852,10 @@ def extract_preview(req: ExtractRequest):
         target_ids = parse_ranges(req.ranges)
     
     try:
-        # Use temp dir for preview images to prevent zombie files
-        questions = extractor.extract_from_file(file_path, target_ids if target_ids else None, sub_dir="temp")
+        # Images are served from the upload by /preview; nothing is written until /confirm_save.
+        questions = get_extractor().extract_from_file(
+            file_path, target_ids if target_ids else None,
+            preview_key=register_preview_source(file_path), progress=job.report if job else None)
         
         if (req.ids is not None) and len(req.ids) == 0:
              questions = []
@@ -429,12 +867,228 @@ def extract_preview(req: ExtractRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/convert_paper")
+def convert_paper(req: ConvertRequest):
+    """
+    One parse of a 解析 paper: the import analysis (same shape as /analyze_file,
+    and cached for it), its answer key and a question-only copy to download.
+    """
+    file_path = resolve_upload(req.filename, req.file_id)
+    upload_hash = register_preview_source(file_path)
+    try:
+        import pipeline
+        from util.complete_converter import output_path_for
+        result = pipeline.convert_paper(file_path, os.path.join(CONVERTED_DIR, f"{upload_hash}.docx"),
+                                        get_extractor(), preview_key=upload_hash)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
 
+    analysis = {"type": "import", "data": result["questions"]}
+    if not result["paper_id"]:
+        # A generated paper is analyzed in review mode, which must not be answered from the cache
+        upload_store.save_analysis(upload_hash, analysis)
+    name = os.path.basename(output_path_for(req.filename or os.path.basename(file_path)))
+    return {
+        **analysis,
+        "answers": {str(k): v for k, v in sorted(result["answers"].items())},
+        "download": f"/converted/{upload_hash}?name={quote(name)}",
+    }
+
+@app.get("/converted/{upload_hash}")
+def download_converted(upload_hash: str, name: Optional[str] = None):
+    if not re.fullmatch(r'[0-9a-f]{64}', upload_hash):
+        raise HTTPException(status_code=404, detail="Not found")
+    path = os.path.join(CONVERTED_DIR, f"{upload_hash}.docx")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Converted paper not found")
+    return FileResponse(path, filename=os.path.basename(name or "题目版.docx"),
+                        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+
+
+@app.get("/preview/{upload_hash}/{rel_id}")
+def preview_image(upload_hash: str, rel_id: str):
+    file_path = preview_source(upload_hash)
+    if not file_path or not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="Preview source not found")
+    member = docx_zip.image_member(file_path, rel_id)
+    if not member:
+        raise HTTPException(status_code=404, detail="Image not found")
+    # Content-addressed by upload hash, so the browser may keep it
+    return StreamingResponse(docx_zip.iter_image(file_path, member),
+                             media_type=docx_zip.content_type_for(member),
+                             headers={"Cache-Control": "private, max-age=86400, immutable"})
+
+
+def remove_media_files(images: List[str]):
+    """Delete stored images, their derivatives and their meta rows."""
+    for img in images:
+        for name in [img] + derivatives.PIPELINE.related_files(img):
+            p = os.path.join(MEDIA_DIR, name)
+            if os.path.exists(p):
+                try:
+                    os.remove(p)
+                except Exception as ex:
+                    print(f"Failed to delete {p}: {ex}")
+    db.delete_image_meta(images)
+
+def question_render_ir(content, options, answer, image_meta=None) -> str:
+    """Stored render IR of a question; sizes of images not in image_meta come from the database."""
+    ir = render_ir.question_ir(content, options, answer, image_meta)
+    missing = render_ir.unsized_images(ir)
+    if missing:
+        ir = render_ir.question_ir(content, options, answer, {**db.get_image_meta(missing), **(image_meta or {})})
+    return render_ir.dumps(ir)
+
+def material_render_ir(content, image_meta=None) -> str:
+    ir = render_ir.material_ir(content, image_meta)
+    missing = render_ir.unsized_images(ir)
+    if missing:
+        ir = render_ir.material_ir(content, {**db.get_image_meta(missing), **(image_meta or {})})
+    return render_ir.dumps(ir)
+
+def backfill_render_ir(batch: int = 200):
+    # Every server worker starts this; the lock runs them one after another, and
+    # the later ones find nothing stale left
+    os.makedirs(os.path.join(DATA_DIR, "cache"), exist_ok=True)
+    with file_lock(os.path.join(DATA_DIR, "cache", "render_ir_backfill.lock")):
+        _backfill_render_ir(batch)
+
+def _backfill_render_ir(batch: int):
+    version = render_ir.IR_VERSION
+    total = 0
+    try:
+        for table in ("questions", "materials"):
+            while True:
+                rows = db.get_stale_render_ir(table, version, limit=batch)
+                if not rows: break
+                if table == "questions":
+                    items = [(r['id'], question_render_ir(r['content_html'], r['options_html'], r['answer_html']))
+                             for r in rows]
+                else:
+                    items = [(r['id'], material_render_ir(r['content_html'])) for r in rows]
+                db.set_render_ir(table, version, items)
+                total += len(items)
+                if len(rows) < batch: break
+    except Exception as e:
+        print(f"Render IR backfill stopped: {e}")
+    if total:
+        print(f"Stored render IR for {total} rows.")
+
+def import_questions(sid: int, questions: List[dict], fallback_source: str, count_repeats: bool = True) -> dict:
+    """
+    Store extracted questions under source `sid`.
+    Questions whose fingerprint matches the stored row are skipped entirely
+    (no image writes, no UPDATE); changed ones are re-materialized and
+    updated in place, and their old images released. With `count_repeats`
+    (a confirm_save import) every question already stored counts as a
+    repeated mistake; a re-import leaves review stats untouched.
+    """
+    new_count = updated_count = unchanged_count = 0
+    repeated = [] # qids of questions that were already stored
+    stored = db.get_source_questions(sid)
+    material_map = {} # fingerprint (or content hash) -> mid
+    
+    # Preview images live inside the uploaded DOCX until a question is saved.
+    # Write them now (once per image), with derivatives and stored dimensions.
+    from parsing.postprocessor import PostProcessor
+    post_processor = PostProcessor(MEDIA_DIR)
+    materialized = {} # "<hash>/<rId>" -> filename
+
+    def materialize(ref):
+        if ref not in materialized:
+            upload_hash, rel_id = ref.split('/', 1)
+            src = preview_source(upload_hash) or fallback_source
+            materialized[ref] = post_processor.materialize(src, rel_id) if os.path.exists(src) else None
+        return materialized[ref]
+
+    def materialize_html(html):
+        if not html: return html
+        def repl(m):
+            fname = materialize(m.group(1))
+            return post_processor.img_html(fname) if fname else ''
+        return PREVIEW_IMG_PATTERN.sub(repl, html)
+
+    released = []
+    for q in questions:
+        prev = stored.get(q['original_num'])
+        fingerprint = q.get('fingerprint')
+        if prev and fingerprint and prev['fingerprint'] == fingerprint:
+            unchanged_count += 1
+            repeated.append(prev['id'])
+            continue
+
+        # Write the images this question actually uses
+        q['content_html'] = materialize_html(q['content_html'])
+        q['options_html'] = materialize_html(q['options_html'])
+        q['answer_html'] = materialize_html(q['answer_html'])
+        q_images = []
+        for img in q.get('images', []):
+            if PREVIEW_REF_PATTERN.match(img):
+                img = materialize(img)
+            if img:
+                q_images.append(img)
+
+        # Material handling
+        mid = None
+        mat_content = q.get('material_content')
+        if mat_content:
+            mat_fp = q.get('material_fingerprint')
+            mat_key = mat_fp or hash(mat_content)
+            if mat_key in material_map:
+                mid = material_map[mat_key]
+            elif prev and mat_fp and prev['material_fingerprint'] == mat_fp:
+                # Same material as the stored row: keep it, no re-render
+                mid = prev['material_id']
+            else:
+                mat_images = [materialize(ref) for ref in PREVIEW_IMG_PATTERN.findall(mat_content)]
+                mat_html = materialize_html(mat_content)
+                mid = db.add_material(sid, mat_html, images=[img for img in mat_images if img],
+                                      type=q['type'], fingerprint=mat_fp,
+                                      render_ir=material_render_ir(mat_html, post_processor.image_meta))
+            material_map[mat_key] = mid
+        
+        # Check for missing keys or defaults
+        q_type = q.get('type', 'Unknown')
+
+        qid, is_new = db.add_question(
+            source_id=sid,
+            original_num=q['original_num'],
+            content=q['content_html'],
+            options=q['options_html'],
+            answer=q['answer_html'], 
+            images=q_images,
+            type=q_type,
+            material_id=mid,
+            fingerprint=fingerprint,
+            render_ir=question_render_ir(q['content_html'], q['options_html'], q['answer_html'],
+                                         post_processor.image_meta)
+        )
+        
+        if is_new:
+            new_count += 1
+        else:
+            updated_count += 1
+            repeated.append(qid)
+            invalidate_papers(qid)
+            released.extend(img for img in (prev or {}).get('images', []) if img not in q_images)
+
+    db.add_image_meta(post_processor.image_meta)
+    if count_repeats:
+        db.record_repeat_mistakes(repeated)
+    if updated_count:
+        released += db.delete_orphan_materials(sid)
+        # Only files no other row still shows (repeated pictures share one file)
+        remove_media_files(db.unreferenced_images(released))
+    return {"new_count": new_count, "updated_count": updated_count, "unchanged_count": unchanged_count}
 
 @app.post("/confirm_save")
 def confirm_save(req: SaveRequest):
     new_count = 0
     repeat_count = 0
+    updated_count = 0
+    unchanged_count = 0
     count = 0
     
     # 1. Review Mode Branch
@@ -454,73 +1108,12 @@ def confirm_save(req: SaveRequest):
             sid = db.add_source(req.source_filename)
             
             # 2. Add Questions & Materials
-            material_map = {} # content_hash -> mid
-            
-            # Helper to move file if exists
-            def move_from_temp(filename):
-                src = os.path.join(MEDIA_DIR, "temp", filename)
-                dst = os.path.join(MEDIA_DIR, filename)
-                if os.path.join(MEDIA_DIR, "temp") in src and os.path.exists(src):
-                    try:
-                        shutil.move(src, dst)
-                    except Exception as e:
-                        print(f"Error moving {filename}: {e}")
-
-            # Helper to fix HTML
-            def fix_html_paths(html):
-                if not html: return html
-                return html.replace("/media/temp/", "/media/")
-
-            for q in req.questions:
-                # Move physical files
-                if q.get('images'):
-                    for img in q['images']:
-                        move_from_temp(img)
-                
-                # Update HTML
-                q['content_html'] = fix_html_paths(q['content_html'])
-                q['options_html'] = fix_html_paths(q['options_html'])
-                q['answer_html'] = fix_html_paths(q['answer_html'])
-
-                # Material handling
-                mid = None
-                mat_content = q.get('material_content')
-                if mat_content:
-                    import re
-                    mat_temp_imgs = re.findall(r'/media/temp/([\w\-\.]+\.\w+)', mat_content)
-                    for img in mat_temp_imgs:
-                        move_from_temp(img)
-                    
-                    mat_content = fix_html_paths(mat_content)
-                    
-                    mat_hash = hash(mat_content)
-                    if mat_hash in material_map:
-                        mid = material_map[mat_hash]
-                    else:
-                        mid = db.add_material(sid, mat_content, type=q['type'])
-                        material_map[mat_hash] = mid
-                
-                # Check for missing keys or defaults
-                q_type = q.get('type', 'Unknown')
-                q_images = q.get('images', [])
-
-                qid, is_new = db.add_question(
-                    source_id=sid,
-                    original_num=q['original_num'],
-                    content=q['content_html'],
-                    options=q['options_html'],
-                    answer=q['answer_html'], 
-                    images=q_images,
-                    type=q_type,
-                    material_id=mid
-                )
-                
-                if is_new:
-                    new_count += 1
-                else:
-                    repeat_count += 1
-                    
-                count += 1
+            result = import_questions(sid, req.questions, os.path.join(UPLOAD_DIR, req.source_filename))
+            new_count = result["new_count"]
+            updated_count = result["updated_count"]
+            unchanged_count = result["unchanged_count"]
+            repeat_count = updated_count + unchanged_count
+            count = len(req.questions)
         except Exception as e:
             import traceback
             traceback.print_exc()
@@ -603,23 +1196,56 @@ def confirm_save(req: SaveRequest):
 
         # Non-blocking, still return success for saving
 
-    return {"status": "success", "saved_count": count, "new_count": new_count, "repeat_count": repeat_count}
+    return {"status": "success", "saved_count": count, "new_count": new_count, "repeat_count": repeat_count,
+            "updated_count": updated_count, "unchanged_count": unchanged_count}
 
 
 
+@app.post("/api/source/reimport")
+def reimport_source(req: ReimportRequest):
+    """
+    Refresh the stored questions of a source from an updated document.
+    Only questions whose blocks changed are rendered, get new images and
+    are updated; everything else (rows, images, review stats) is untouched.
+    """
+    sid = db.get_source_id(req.filename)
+    if sid is None:
+        raise HTTPException(status_code=404, detail="Source not imported yet")
+    file_path = resolve_upload(req.filename, req.file_id)
+    stored = db.get_source_questions(sid)
+    known = {num: row['fingerprint'] for num, row in stored.items() if row['fingerprint']}
+    try:
+        questions = get_extractor().extract_from_file(file_path, target_ids=list(stored),
+                                                preview_key=register_preview_source(file_path),
+                                                known_fingerprints=known)
+        changed = [q for q in questions if not q.get('unchanged')]
+        result = import_questions(sid, changed, file_path, count_repeats=False)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+    result["unchanged_count"] += len(questions) - len(changed)
+    # Stored questions the new document no longer has (left as they are)
+    result["missing"] = sorted(set(stored) - {q['original_num'] for q in questions})
+    return {"status": "success", **result}
+
+
 @app.get("/pool_status")
 def pool_status():
     return db.get_pool_status()
 
 
 @app.get("/api/questions")
-def get_all_questions():
+def get_all_questions(request: Request):
     questions = db.get_all_questions()
-    return {"count": len(questions), "questions": questions}
+    # Revisits of /browse get a 304 while nothing changed
+    return http_cache.json_response({"count": len(questions), "questions": questions}, request)
 
 @app.get("/browse")
-def browse_page():
-    return FileResponse(os.path.join(ASSET_DIR, "static/browse.html"))
+def browse_page(request: Request):
+    return http_cache.file_response(os.path.join(ASSET_DIR, "static/browse.html"), request)
+
+startup.mark("routes")
 
 # To run: uvicorn main:app --reload
 def find_available_port(start_port, max_port=65535):
@@ -634,14 +1260,24 @@ def find_available_port(start_port, max_port=65535):
     return None
 
 # System Tray & Server Startup
-def run_server(port):
+def run_server(port, ready: threading.Event = None, host: str = "127.0.0.1", log_level: str = "error"):
     # Redirect streams for no-console mode
     if sys.stdout is None: sys.stdout = open(os.devnull, "w")
     if sys.stderr is None: sys.stderr = open(os.devnull, "w")
     if sys.stdin is None: sys.stdin = open(os.devnull, "r")
     
     try:
-        uvicorn.run(app, host="127.0.0.1", port=port, log_level="error")
+        import uvicorn
+        startup.mark("uvicorn import")
+        server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level=log_level))
+        if ready is not None:
+            # Tell the main thread as soon as the socket listens (uvicorn sets .started)
+            def watch():
+                while not server.started and not server.should_exit:
+                    time.sleep(0.02)
+                ready.set()
+            threading.Thread(target=watch, daemon=True).start()
+        server.run()
     except Exception as e:
         # Minimal fail-safe error log
         if getattr(sys, 'frozen', False):
@@ -650,6 +1286,27 @@ def run_server(port):
                      f.write(f"Startup Failed: {str(e)}\n")
              except: pass
 
+def run_headless(args):
+    """Serve without tray or browser, on args.host:args.port, in args.workers processes."""
+    workers = max(1, args.workers)
+    if workers > 1 and getattr(sys, 'frozen', False):
+        # Workers re-import main.py, which the onefile build does not ship as a module
+        print("Several workers need the Python sources; the executable runs one.")
+        workers = 1
+    print(f"Serving http://{args.host}:{args.port} ({workers} worker{'s' if workers > 1 else ''}, data in {DATA_DIR})")
+    if workers == 1:
+        ready = threading.Event()
+        def report():
+            ready.wait()
+            startup.mark("server start")
+            startup.report(DATA_DIR)
+        threading.Thread(target=report, daemon=True).start()
+        run_server(args.port, ready, host=args.host, log_level="info")
+        return
+    import uvicorn
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=workers, log_level="info",
+                app_dir=os.path.dirname(os.path.abspath(__file__)))
+
 def setup_tray(url):
     try:
         import pystray
@@ -682,29 +1339,28 @@ def setup_tray(url):
     return icon
 
 if __name__ == "__main__":
-    import argparse
     import threading
     import webbrowser
     import time
     import sys
     import os
     
-    # Simple CLI Args
-    parser = argparse.ArgumentParser(description="MistakeReservoir Server")
-    parser.add_argument("--t", action="store_true", help="Enter terminal debug mode (no server)")
-    parser.add_argument("--port", type=int, default=8000, help="Starting port number")
-    args = parser.parse_args()
+    args = ARGS
     
     # Debug Mode
     if args.t:
         print("Entering Terminal Debug Mode...")
-        print("Variables available: app, db, extractor, etc.")
+        print("Variables available: app, db, get_extractor(), etc.")
         import code
         context = globals().copy()
         context.update(locals())
         code.interact(local=context, banner="MistakeReservoir Debug Shell")
         sys.exit(0)
 
+    if args.headless:
+        run_headless(args)
+        sys.exit(0)
+
     # Server Mode
     port = find_available_port(args.port)
     if not port:
@@ -715,12 +1371,15 @@ if __name__ == "__main__":
     print(f"Starting server on port {port}...")
     
     # Strat Server in Thread
-    server_thread = threading.Thread(target=run_server, args=(port,), daemon=True)
+    server_ready = threading.Event()
+    server_thread = threading.Thread(target=run_server, args=(port, server_ready), daemon=True)
     server_thread.start()
     
-    # Open Browser
+    # Open Browser once the server accepts connections
     def open_browser():
-        time.sleep(1.5)
+        server_ready.wait(timeout=15)
+        startup.mark("server start")
+        startup.report(DATA_DIR)
         webbrowser.open(url)
     threading.Thread(target=open_browser, daemon=True).start()
     
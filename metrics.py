@@ -0,0 +1,222 @@
+"""
+Prometheus metrics and Server-Timing.
+
+    http  MetricsMiddleware: latency histogram per method / route / status
+          and the number of requests in flight.
+    db    every public DatabaseManager method (@timed_methods("db"))
+    parse QuestionExtractor.extract_from_file / extract_from_document
+    render PaperBuilder.build_paper / create_paper, DOCX saving, PaperHtml
+
+GET /metrics serves them in the Prometheus text format. Each response also
+carries a Server-Timing header with the db, parse and render time spent on
+it before its headers went out (work on other threads counts when it runs
+in a copy of the request's context, see in_request_context).
+
+Metrics are per process: with several server workers a scrape sees the
+worker that answered it.
+"""
+import time
+import threading
+import contextvars
+import functools
+from typing import Dict, Iterable, List, Optional, Tuple
+
+PREFIX = "mistake_reservoir"
+# Seconds; generation and imports of large papers take tens of seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Server-Timing entries, in header order
+TIMING_KINDS = ("db", "parse", "render")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {value:g}")
+        return lines
+
+
+class Gauge(Counter):
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, list] = {} # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    le = 'le="%g"' % bound
+                    lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {series[-1]}")
+        return lines
+
+
+HTTP_SECONDS = Histogram(f"{PREFIX}_http_request_duration_seconds",
+                         "Time from request to the end of the response body.", ("method", "route", "status"))
+HTTP_IN_FLIGHT = Gauge(f"{PREFIX}_http_requests_in_flight", "Requests being handled.")
+OP_SECONDS = {kind: Histogram(f"{PREFIX}_{kind}_seconds", f"Time per {kind} call.", ("op",))
+              for kind in TIMING_KINDS}
+OP_ERRORS = Counter(f"{PREFIX}_operation_errors_total", "db / parse / render calls that raised.", ("kind", "op"))
+
+REGISTRY = [HTTP_SECONDS, HTTP_IN_FLIGHT] + list(OP_SECONDS.values()) + [OP_ERRORS]
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Per-request timing (Server-Timing) ---
+
+# kind -> seconds for the current request; None outside requests
+_request_timings: contextvars.ContextVar = contextvars.ContextVar("request_timings", default=None)
+# Kinds being timed on this thread, so nested calls (a DB method calling another) count once
+_active = threading.local()
+# Request timings are also updated from worker threads (batch builds run in the request's context)
+_timings_lock = threading.Lock()
+
+
+def timed(kind: str, op: Optional[str] = None):
+    """Decorator: time calls into OP_SECONDS[kind] and the request's Server-Timing."""
+    histogram = OP_SECONDS[kind]
+
+    def decorate(fn):
+        name = op or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            active = getattr(_active, "kinds", None)
+            if active is None:
+                active = _active.kinds = set()
+            if kind in active:
+                return fn(*args, **kwargs)
+            active.add(kind)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                OP_ERRORS.inc(kind, name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                active.discard(kind)
+                histogram.observe(elapsed, name)
+                timings = _request_timings.get()
+                if timings is not None:
+                    with _timings_lock:
+                        timings[kind] = timings.get(kind, 0.0) + elapsed
+        return wrapper
+    return decorate
+
+
+def timed_methods(kind: str, exclude: Iterable[str] = ()):
+    """Class decorator: @timed(kind) on every public method."""
+    def decorate(cls):
+        for name, value in list(vars(cls).items()):
+            if callable(value) and not name.startswith("_") and name not in exclude:
+                setattr(cls, name, timed(kind, f"{cls.__name__}.{name}")(value))
+        return cls
+    return decorate
+
+
+def in_request_context(fn):
+    """fn wrapped to run in a copy of the caller's context (for thread pools), so its time reaches Server-Timing."""
+    ctx = contextvars.copy_context()
+    return functools.partial(ctx.run, fn)
+
+
+def server_timing(timings: Dict[str, float], app_seconds: float) -> str:
+    parts = [f"{kind};dur={timings[kind] * 1000:.1f}" for kind in TIMING_KINDS if kind in timings]
+    parts.append(f"app;dur={app_seconds * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware:
+    """Latency and in-flight metrics per request, and its Server-Timing header."""
+    def __init__(self, app, skip_paths: Tuple[str, ...] = ("/metrics",)):
+        self.app = app
+        self.skip_paths = skip_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(timings, time.perf_counter() - start).encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            _request_timings.reset(token)
+            route = scope.get("route")
+            # Route templates (/api/paper/{uuid}/download) keep the label set small
+            label = getattr(route, "path", None) or "<unmatched>"
+            HTTP_SECONDS.observe(time.perf_counter() - start, scope.get("method", ""), label, str(status[0]))
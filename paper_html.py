@@ -0,0 +1,143 @@
+"""
+A generated paper as one print-ready HTML page, for practising on screen.
+
+Same order, sections and material grouping as the DOCX paper
+(render_ir.paper_layout) and the same image placement, drawn straight from
+the render IR without python-docx. Images load lazily with their size
+reserved; the answer key starts on a new page when printed.
+"""
+import html
+from typing import Dict, List, Optional
+
+import metrics
+import render_ir
+from parsing import derivatives
+
+STYLE = """
+@page { size: A4; margin: 2cm 1.8cm; }
+* { box-sizing: border-box; }
+body { margin: 0; background: #f1f5f9; color: #111;
+       font: 10.5pt/1.6 "Microsoft YaHei", "PingFang SC", "Noto Sans CJK SC", sans-serif; }
+.sheet { max-width: 21cm; margin: 16px auto; padding: 2cm 1.8cm; background: #fff;
+         box-shadow: 0 1px 4px rgba(0,0,0,.15); }
+.paper-id { text-align: right; font-size: 8pt; color: #969696; margin: 0 0 1em; }
+h1 { text-align: center; font-size: 14pt; margin: 1.2em 0 .8em; break-after: avoid; }
+p { margin: 0; white-space: pre-wrap; }
+.material, .question, .answer { margin-bottom: 1.6em; }
+.material-lead, .stem { font-weight: bold; }
+.question, .answer-table tr, figure { break-inside: avoid; }
+figure { margin: .4em 0; text-align: center; }
+img { max-width: 100%; height: auto; }
+.img-inline { height: 1.05em; width: auto; vertical-align: middle; }
+.img-figure { height: 4cm; width: auto; vertical-align: middle; }
+.img-block { display: block; margin: .4em auto; }
+.answer-table { border-collapse: collapse; margin: 0 auto 1.6em; }
+.answer-table td { border: 1px solid #444; min-width: 3.2em; padding: .1em .6em; text-align: center; }
+.answer-table .num { color: #666; }
+@media print {
+  body { background: none; }
+  .sheet { max-width: none; margin: 0; padding: 0; box-shadow: none; }
+  .answers { break-before: page; }
+}
+"""
+
+def _esc(text: str) -> str:
+    return html.escape(text, quote=False)
+
+class PaperHtml:
+    def __init__(self, image_meta: Dict[str, dict] = None):
+        # filename -> {"width", "height", ...}, for images the IR has no size for
+        self.image_meta = image_meta or {}
+
+    @metrics.timed("render")
+    def render(self, questions: List[dict], paper_uuid: str = None, title: str = "试卷") -> str:
+        render_ir.sort_questions(questions)
+        irs = [render_ir.of_question(q) for q in questions]
+
+        out = ['<!DOCTYPE html>\n<html lang="zh-CN"><head><meta charset="utf-8">',
+               '<meta name="viewport" content="width=device-width, initial-scale=1">',
+               f'<title>{_esc(title)}</title><style>{STYLE}</style></head><body>',
+               '<main class="sheet questions">']
+        if paper_uuid:
+            out.append(f'<p class="paper-id">Paper ID: {_esc(paper_uuid)}</p>')
+
+        in_section = False
+        for item in render_ir.paper_layout(questions, irs):
+            kind = item[0]
+            if kind == "section":
+                if in_section: out.append('</section>')
+                out.append(f'<section><h1>{_esc(item[1])}</h1>')
+                in_section = True
+            elif kind == "material":
+                out.append('<div class="material"><p class="material-lead">根据以下材料，回答下列问题：</p>')
+                for block in item[1]:
+                    if "p" in block:
+                        out.append(f'<p>{_esc(block["p"])}</p>')
+                    else:
+                        out.append(f'<figure>{self._img(block)}</figure>')
+                out.append('</div>')
+            else:
+                _, number, q, ir = item
+                q_type = q.get('type')
+                out.append(f'<div class="question" id="q{number}">')
+                out.append(f'<p class="stem">{number}. {self._inline(ir["content"], q_type)}</p>')
+                for line in ir["options"] or []:
+                    out.append(f'<p class="option">{self._inline(line, q_type=None)}</p>')
+                out.append('</div>')
+        if in_section: out.append('</section>')
+        out.append('</main>')
+
+        # --- Answer Key ---
+        out.append('<main class="sheet answers"><h1>参考答案与解析</h1>')
+        out.append(self._answer_table([ir["letter"] for ir in irs]))
+        for i, ir in enumerate(irs):
+            body = self._inline(ir["answer"], q_type=None) if ir["answer"] is not None else "（暂无解析）"
+            out.append(f'<div class="answer" id="a{i + 1}"><p><b>{i + 1}. </b>{body}</p></div>')
+        out.append('</main></body></html>')
+        return "".join(out)
+
+    def _answer_table(self, letters: List[str]) -> str:
+        if not letters: return ''
+        rows = []
+        chunk_size = 5
+        for i in range(0, len(letters), chunk_size):
+            chunk = letters[i:i + chunk_size]
+            pad = '<td></td>' * (chunk_size - len(chunk))
+            rows.append('<tr class="num">' + ''.join(f'<td>{i + j + 1}</td>' for j in range(len(chunk))) + pad + '</tr>')
+            rows.append('<tr>' + ''.join(f'<td>{_esc(letter)}</td>' for letter in chunk) + pad + '</tr>')
+        return f'<table class="answer-table">{"".join(rows)}</table>'
+
+    def _inline(self, nodes, q_type: Optional[str]) -> str:
+        if not nodes: return ''
+        return ''.join(_esc(node) if isinstance(node, str) else self._img(node, q_type) for node in nodes)
+
+    def _size(self, node):
+        if "w" in node:
+            return (node["w"], node["h"])
+        meta = self.image_meta.get(node["img"].split('/')[-1])
+        if meta and meta.get('width') and meta.get('height'):
+            return (meta['width'], meta['height'])
+        return None
+
+    def _img(self, node, q_type: Optional[str] = None) -> str:
+        src = node.get("img")
+        if not src: return ''
+        size = self._size(node)
+        kind, width_in = render_ir.image_placement(size, q_type)
+        attrs = f'src="{html.escape(src)}" alt="" loading="lazy" decoding="async"'
+        if size:
+            attrs += f' width="{size[0]}" height="{size[1]}"'
+        if kind != "block":
+            return f'<img {attrs} class="img-{kind}">'
+
+        style = f' style="width:{width_in}in"' if width_in else ''
+        # Downscaled WebP variants made at import (missing ones fall back to the original)
+        fname = src.split('/')[-1]
+        widths = derivatives.PIPELINE.plan(fname, size[0]) if size and src.startswith('/media/') else []
+        if widths:
+            prefix = src[:len(src) - len(fname)]
+            candidates = [f"{prefix}{derivatives.derivative_name(fname, w)} {w}w" for w in widths]
+            candidates.append(f"{src} {size[0]}w")
+            display = int(width_in * 96) if width_in else size[0]
+            attrs += f' srcset="{html.escape(", ".join(candidates))}" sizes="(max-width: {display}px) 100vw, {display}px"'
+        return f'<img {attrs} class="img-block"{style}>'
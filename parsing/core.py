@@ -1,19 +1,15 @@
-import re
-from copy import deepcopy
 from docx.text.paragraph import Paragraph
 from docx.table import Table
 
-# Unified Answer Regex
-ANSWER_REGEX = re.compile(
-    r'(【\s*答案\s*】|【\s*解析\s*】|【\s*拓展\s*】|【\s*来源\s*】|正确\s*答案|参考\s*答案|答案\s*[:：]?|解析\s*[:：]?)'
-)
-# Option Pattern
-OPTION_PATTERN = re.compile(r'^\s*\(?[A-DＡ-Ｄ]\)?[\.．、\s]')
+from .preprocessor import ParagraphSlice
+from .rules import RULES
+from .profiling import NULL_PROFILE
 
-def process_buffer_as_question(doc, buffer, q_num, post_processor, current_type, material_content, skip_images=False, sub_dir=None):
+def process_buffer_as_question(doc, buffer, q_num, post_processor, current_type, material_content, skip_images=False, sub_dir=None, profile=NULL_PROFILE):
     """
     Convert a buffer of blocks into structured Question data.
     Separates Stem, Options, and Analysis.
+    Does not modify the blocks: mid-paragraph splits become ParagraphSlice views.
     """
     stem_blocks = []
     option_blocks = []
@@ -34,46 +30,39 @@ def process_buffer_as_question(doc, buffer, q_num, post_processor, current_type,
                     cell_texts.append(cell.text.strip())
             text = " ".join(cell_texts)
         
+        with profile.stage("classify"):
+            line = RULES.classify(text)
+
         if state < 2:
-            # Direct regex check for options
-            if OPTION_PATTERN.match(text):
+            # Direct check for options
+            if line.is_option:
                 state = 1
 
-        # Check Switch to Analysis using Regex
-        ans_match = ANSWER_REGEX.search(text)
-        
-        if ans_match:
-            start_idx = ans_match.start()
+        # Check Switch to Analysis
+        if line.answer_pos >= 0:
+            start_idx = line.answer_pos
             
             if start_idx == 0:
                 state = 2
             else:
                 if isinstance(block, Paragraph):
-                    part1_text = text[:start_idx].strip()
-                    part2_text = text[start_idx:].strip()
+                    # Split on a read-only view: the loaded Document is never
+                    # modified, so a parse can be cached and re-used.
+                    with profile.stage("split"):
+                        head, tail = ParagraphSlice(block).split(start_idx)
+                    profile.count("splits")
                     
-                    try:
-                        elem_copy = deepcopy(block._element)
-                        block_part2 = Paragraph(elem_copy, block._parent)
-                        block_part2.text = part2_text
-                        
-                        block.text = part1_text
+                    if state == 1:
+                        option_blocks.append(head)
+                    elif state == 2:
+                        analysis_blocks.append(head)
+                    else:
+                        stem_blocks.append(head)
                         
-                        if state == 1:
-                            option_blocks.append(block)
-                        elif state == 2:
-                            analysis_blocks.append(block)
-                        else:
-                            stem_blocks.append(block)
-                            
-                        state = 2
-                        analysis_blocks.append(block_part2)
-                        
-                        continue 
-                        
-                    except Exception as e:
-                        print(f"Wrapper Split Error: {e}")
-                        state = 2 
+                    state = 2
+                    analysis_blocks.append(tail)
+                    
+                    continue 
                 else:
                     state = 2 
         
@@ -0,0 +1,143 @@
+"""
+Import-time image derivatives.
+
+Each stored image gets downscaled WebP variants (e.g. abc.w480.webp,
+abc.w960.webp) next to the original, generated by a small background
+worker pool so extraction never waits on resampling.
+The original file is left untouched for PaperBuilder.
+"""
+import os
+import re
+import glob
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+# PIL, imported by load_pil() on first use: it is slow to load and the server does not need it to start
+Image = None
+features = None
+
+# Target widths (px). Only widths smaller than the original are produced.
+DERIVATIVE_WIDTHS = (480, 960)
+# Layout hint for srcset: images are shown at most ~480 CSS px wide
+SIZES_ATTR = "480px"
+# Formats PIL can resample and browsers can show (EMF/WMF are skipped)
+RASTER_EXTS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'webp'}
+
+DERIVATIVE_PATTERN = re.compile(r'^(?P<stem>.+)\.w(?P<width>\d+)\.webp$')
+
+
+def load_pil() -> bool:
+    """Import PIL (into Image / features) if needed; False when it is not installed."""
+    global Image, features
+    if Image is None:
+        try:
+            from PIL import Image, features
+        except ImportError:
+            return False
+    return True
+
+
+def derivative_name(filename: str, width: int) -> str:
+    stem = os.path.splitext(filename)[0]
+    return f"{stem}.w{width}.webp"
+
+
+def original_for(derivative_path: str) -> Optional[str]:
+    """Map a derivative path back to its original file, if it exists."""
+    folder, name = os.path.split(derivative_path)
+    m = DERIVATIVE_PATTERN.match(name)
+    if not m:
+        return None
+    for candidate in glob.glob(os.path.join(glob.escape(folder), glob.escape(m.group('stem')) + '.*')):
+        if not DERIVATIVE_PATTERN.match(os.path.basename(candidate)) and not candidate.endswith('.part'):
+            return candidate
+    return None
+
+
+class DerivativePipeline:
+    def __init__(self, widths=DERIVATIVE_WIDTHS, max_workers: int = 2, quality: int = 80):
+        self.widths = tuple(sorted(widths))
+        self.max_workers = max_workers
+        self.quality = quality
+        self._enabled = None # Decided on first use (needs PIL)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending: Dict[str, object] = {}  # original path -> Future
+
+    @property
+    def enabled(self) -> bool:
+        if self._enabled is None:
+            self._enabled = load_pil() and features.check('webp')
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value: bool):
+        self._enabled = value
+
+    def plan(self, filename: str, width: Optional[int]) -> List[int]:
+        """Widths that will be generated for an image of the given width."""
+        if not self.enabled or not width:
+            return []
+        ext = filename.rsplit('.', 1)[-1].lower()
+        if ext not in RASTER_EXTS:
+            return []
+        return [w for w in self.widths if w < width]
+
+    def related_files(self, filename: str) -> List[str]:
+        """All derivative names an original may have (for move / delete)."""
+        return [derivative_name(filename, w) for w in self.widths]
+
+    def submit(self, path: str, widths: List[int]):
+        if not widths:
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix="derivatives")
+            future = self._executor.submit(self._generate, path, widths)
+            self._pending[path] = future
+        future.add_done_callback(lambda f, p=path: self._done(p, f))
+        return future
+
+    def wait(self, path: str, timeout: Optional[float] = None):
+        """Block until derivatives of `path` are written (no-op if none pending)."""
+        with self._lock:
+            future = self._pending.get(path)
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+
+    def shutdown(self, wait: bool = False):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _done(self, path, future):
+        with self._lock:
+            if self._pending.get(path) is future:
+                del self._pending[path]
+
+    def _generate(self, path: str, widths: List[int]):
+        folder, filename = os.path.split(path)
+        try:
+            with Image.open(path) as img:
+                img.load()
+                if img.mode not in ('RGB', 'RGBA'):
+                    img = img.convert('RGBA' if 'transparency' in img.info or img.mode in ('LA', 'PA') else 'RGB')
+                for w in widths:
+                    h = max(1, round(img.height * w / img.width))
+                    target = os.path.join(folder, derivative_name(filename, w))
+                    tmp = target + '.part'
+                    img.resize((w, h), Image.LANCZOS).save(tmp, 'WEBP', quality=self.quality, method=4)
+                    # Atomic publish: readers see either nothing or the full file
+                    os.replace(tmp, target)
+        except Exception as e:
+            print(f"Error generating derivatives for {filename}: {e}")
+
+
+# Shared pool for all PostProcessors
+PIPELINE = DerivativePipeline()
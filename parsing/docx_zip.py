@@ -0,0 +1,91 @@
+"""
+Direct access to images inside a DOCX package.
+
+A .docx is a zip; document images are members under word/ referenced by
+relationship ids (rId) from word/_rels/document.xml.rels. Reading them
+straight from the zip lets previews serve images without python-docx
+loading the document or anything being written to disk.
+"""
+import os
+import hashlib
+import mimetypes
+import posixpath
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, Optional, Tuple
+
+RELS_MEMBER = "word/_rels/document.xml.rels"
+RELS_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+_lock = threading.Lock()
+_rels_cache: Dict[Tuple[str, float], Dict[str, str]] = {}
+_digest_cache: Dict[Tuple[str, float, int], str] = {}
+
+
+def file_digest(path: str) -> str:
+    """sha256 of a file, cached by (path, mtime, size)."""
+    st = os.stat(path)
+    key = (path, st.st_mtime, st.st_size)
+    with _lock:
+        if key in _digest_cache:
+            return _digest_cache[key]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _lock:
+        _digest_cache[key] = digest
+    return digest
+
+
+def image_rels(path: str) -> Dict[str, str]:
+    """rId -> zip member name for the internal relationships of the main document."""
+    key = (path, os.path.getmtime(path))
+    with _lock:
+        if key in _rels_cache:
+            return _rels_cache[key]
+    rels = {}
+    with zipfile.ZipFile(path) as zf:
+        root = ET.fromstring(zf.read(RELS_MEMBER))
+    for rel in root.iter(f"{RELS_NS}Relationship"):
+        if rel.get("TargetMode") == "External":
+            continue
+        target = rel.get("Target", "")
+        if target.startswith("/"):
+            member = target.lstrip("/")
+        else:
+            member = posixpath.normpath(posixpath.join("word", target))
+        rels[rel.get("Id")] = member
+    with _lock:
+        _rels_cache[key] = rels
+    return rels
+
+
+def image_member(path: str, rel_id: str) -> Optional[str]:
+    return image_rels(path).get(rel_id)
+
+
+def content_type_for(member: str) -> str:
+    return mimetypes.guess_type(member)[0] or "application/octet-stream"
+
+
+def read_image(path: str, rel_id: str) -> Optional[Tuple[str, bytes]]:
+    """(member name, bytes) for an image relationship, or None."""
+    member = image_member(path, rel_id)
+    if not member:
+        return None
+    with zipfile.ZipFile(path) as zf:
+        try:
+            return member, zf.read(member)
+        except KeyError:
+            return None
+
+
+def iter_image(path: str, member: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Stream a member's bytes without loading it whole."""
+    with zipfile.ZipFile(path) as zf:
+        with zf.open(member) as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                yield chunk
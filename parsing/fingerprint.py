@@ -0,0 +1,58 @@
+"""
+Content fingerprints for extracted questions.
+
+A question's fingerprint covers exactly what rendering reads: the text of
+each block in its buffer (table cells included), the bytes of every image
+those blocks reference, its module type and the material it hangs off.
+Relationship ids, run formatting and the preview upload hash are left out,
+so re-saving a document in Word does not make every question look changed.
+"""
+import hashlib
+from typing import Dict, Iterable, Optional
+
+from docx.text.paragraph import Paragraph
+from docx.table import Table
+
+from .preprocessor import run_image_rids
+
+
+class Fingerprinter:
+    """Per-document helper; image digests are computed once per rId."""
+    def __init__(self, doc):
+        self.doc = doc
+        self._image_digests: Dict[str, str] = {}
+
+    def _image_digest(self, rId: str) -> str:
+        digest = self._image_digests.get(rId)
+        if digest is None:
+            part = self.doc.part.related_parts.get(rId)
+            digest = hashlib.sha1(part.blob).hexdigest() if part is not None else "missing"
+            self._image_digests[rId] = digest
+        return digest
+
+    def _paragraph_sig(self, p) -> str:
+        images = ",".join(self._image_digest(rId) for rId in run_image_rids(p._element))
+        return f"p:{p.text.strip()}|{images}"
+
+    def block_sig(self, block) -> str:
+        if isinstance(block, Paragraph):
+            return self._paragraph_sig(block)
+        if isinstance(block, Table):
+            cells = []
+            for row in block.rows:
+                for cell in row.cells:
+                    cells.append("/".join(self._paragraph_sig(p) for p in cell.paragraphs))
+            return "t:" + "\t".join(cells)
+        return ""
+
+    def blocks(self, blocks: Iterable) -> str:
+        h = hashlib.sha1()
+        for block in blocks:
+            h.update(self.block_sig(block).encode("utf-8"))
+            h.update(b"\n")
+        return h.hexdigest()
+
+    def question(self, q_num: int, q_type: str, material_fp: Optional[str], buffer) -> str:
+        h = hashlib.sha1(f"{q_num}|{q_type}|{material_fp or ''}|".encode("utf-8"))
+        h.update(self.blocks(buffer).encode("ascii"))
+        return h.hexdigest()
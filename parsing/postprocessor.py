@@ -1,20 +1,42 @@
 import os
+import io
 import uuid
 import re
 from typing import List, Tuple, Optional
 from docx.text.paragraph import Paragraph
 from docx.table import Table
-from .preprocessor import Q_PATTERN
+from .preprocessor import Q_PATTERN, ParagraphSlice, run_image_rids
+from .derivatives import PIPELINE, SIZES_ATTR, derivative_name
+from . import docx_zip
+from .profiling import NULL_PROFILE
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
 
 FORCE_DELETE_LINES = {'故', '故。', '故本题选', '故正确答案'}
 
 class PostProcessor:
-    def __init__(self, media_dir: str):
+    def __init__(self, media_dir: str, derivatives=PIPELINE, preview_key: str = None, profile=NULL_PROFILE):
         self.media_dir = media_dir
+        self.derivatives = derivatives
+        self.profile = profile
+        # Preview mode: images are referenced as "<preview_key>/<rId>" and
+        # served from the uploaded DOCX by /preview; nothing is written.
+        self.preview_key = preview_key
+        # filename -> {"width", "height", "format", "bytes"}, captured on save
+        self.image_meta = {}
+        # filename -> (derivative widths, original width) (drives srcset)
+        self.image_variants = {}
         if not os.path.exists(media_dir):
             os.makedirs(media_dir)
 
     def _save_image_from_blip(self, doc, blip_rId, sub_dir=None) -> Optional[str]:
+        with self.profile.stage("image_extract"):
+            return self._save_image(doc, blip_rId, sub_dir)
+
+    def _save_image(self, doc, blip_rId, sub_dir=None) -> Optional[str]:
         try:
             if not blip_rId: return None
             
@@ -28,6 +50,11 @@ class PostProcessor:
             except:
                 ext = 'png'
             
+            if self.preview_key:
+                ref = f"{self.preview_key}/{blip_rId}"
+                self._probe_image(ref, ext, image_part.blob)
+                return ref
+            
             filename = f"{uuid.uuid4().hex}.{ext}"
             
             target_dir = self.media_dir
@@ -40,37 +67,98 @@ class PostProcessor:
             
             with open(filepath, "wb") as f:
                 f.write(image_part.blob)
+            self.profile.count("images_written")
+            self.profile.count("image_bytes", len(image_part.blob))
             
+            meta = self._probe_image(filename, ext, image_part.blob)
+            self._queue_derivatives(filepath, filename, meta["width"])
             return filename
         except Exception as e:
             print(f"Error saving image {blip_rId}: {e}")
             return None
 
+    def _probe_image(self, filename, ext, blob) -> dict:
+        """Record width/height/format/bytes once, from the in-memory blob."""
+        meta = {"width": None, "height": None, "format": ext.upper(), "bytes": len(blob)}
+        self.profile.count("images")
+        if Image is not None:
+            try:
+                # Header-only read; pixel data is never decoded here
+                with self.profile.stage("image_probe"), Image.open(io.BytesIO(blob)) as img:
+                    meta["width"], meta["height"] = img.size
+                    meta["format"] = img.format or meta["format"]
+            except Exception:
+                pass
+        self.image_meta[filename] = meta
+        return meta
+
+    def materialize(self, docx_path, rel_id) -> Optional[str]:
+        """
+        Write one preview image from the DOCX zip into media_dir.
+        Used when a previewed question is actually saved.
+        """
+        try:
+            found = docx_zip.read_image(docx_path, rel_id)
+            if not found: return None
+            member, blob = found
+            ext = os.path.splitext(member)[1].lstrip('.').lower() or 'png'
+            if ext == 'jpeg': ext = 'jpg'
+            
+            filename = f"{uuid.uuid4().hex}.{ext}"
+            filepath = os.path.join(self.media_dir, filename)
+            with open(filepath, "wb") as f:
+                f.write(blob)
+            
+            meta = self._probe_image(filename, ext, blob)
+            self._queue_derivatives(filepath, filename, meta["width"])
+            return filename
+        except Exception as e:
+            print(f"Error materializing image {rel_id}: {e}")
+            return None
+
+    def meta_for(self, filenames) -> dict:
+        return {f: self.image_meta[f] for f in filenames if f in self.image_meta}
+
+    def _queue_derivatives(self, filepath, filename, width):
+        if not self.derivatives or not self.derivatives.enabled:
+            return
+        widths = self.derivatives.plan(filename, width)
+        if widths:
+            self.image_variants[filename] = (widths, width)
+            self.derivatives.submit(filepath, widths)
+
+    def img_html(self, img, sub_dir=None) -> str:
+        if self.preview_key:
+            src = f"/preview/{img}"
+        else:
+            path = f"{sub_dir}/{img}" if sub_dir else img
+            src = f"/media/{path}"
+        srcset = ""
+        variants = self.image_variants.get(img)
+        if variants:
+            widths, full_width = variants
+            prefix = f"/media/{sub_dir}/" if sub_dir else "/media/"
+            candidates = [f"{prefix}{derivative_name(img, w)} {w}w" for w in widths]
+            candidates.append(f"{src} {full_width}w")
+            srcset = f' srcset="{", ".join(candidates)}" sizes="{SIZES_ATTR}"'
+        dims = ""
+        meta = self.image_meta.get(img)
+        if meta and meta["width"] and meta["height"]:
+            dims = f' width="{meta["width"]}" height="{meta["height"]}"'
+        return f'<div class="img-container"><img src="{src}"{srcset}{dims} class="question-img" loading="lazy" /></div>'
+
     def get_block_images(self, doc, block, sub_dir=None) -> List[str]:
         images = []
         try:
-            if isinstance(block, Paragraph):
-                ns = block._element.nsmap
-                if 'a' not in ns:
-                    ns['a'] = 'http://schemas.openxmlformats.org/drawingml/2006/main'
-                
-                try:
-                    blips = block._element.findall('.//a:blip', ns)
-                except KeyError:
-                    blips = []
-
-                for blip in blips:
-                    rId = blip.get('{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed')
-                    if rId:
-                        fname = self._save_image_from_blip(doc, rId, sub_dir=sub_dir)
-                        if fname: images.append(fname)
-                        
-                imagedatas = block._element.findall('.//v:imagedata', ns)
-                for idata in imagedatas:
-                    rId = idata.get('{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id')
-                    if rId:
-                        fname = self._save_image_from_blip(doc, rId, sub_dir=sub_dir)
-                        if fname: images.append(fname)
+            if isinstance(block, (Paragraph, ParagraphSlice)):
+                if isinstance(block, ParagraphSlice):
+                    rIds = block.image_rids()
+                else:
+                    rIds = run_image_rids(block._element)
+
+                for rId in rIds:
+                    fname = self._save_image_from_blip(doc, rId, sub_dir=sub_dir)
+                    if fname: images.append(fname)
                         
             elif isinstance(block, Table):
                 for row in block.rows:
@@ -82,11 +170,24 @@ class PostProcessor:
             
         return images
 
+    def has_images(self, doc, block) -> bool:
+        """Whether get_block_images would find anything, without saving."""
+        if isinstance(block, (Paragraph, ParagraphSlice)):
+            rIds = block.image_rids() if isinstance(block, ParagraphSlice) else run_image_rids(block._element)
+            return any(rId and rId in doc.part.related_parts for rId in rIds)
+        if isinstance(block, Table):
+            return any(self.has_images(doc, p) for row in block.rows for cell in row.cells for p in cell.paragraphs)
+        return False
+
     def block_to_html(self, doc, block, skip_images=False, sub_dir=None) -> Tuple[str, List[str]]:
+        with self.profile.stage("html"):
+            return self._block_to_html(doc, block, skip_images, sub_dir)
+
+    def _block_to_html(self, doc, block, skip_images=False, sub_dir=None) -> Tuple[str, List[str]]:
         images = [] if skip_images else self.get_block_images(doc, block, sub_dir=sub_dir)
         html = ""
         
-        if isinstance(block, Paragraph):
+        if isinstance(block, (Paragraph, ParagraphSlice)):
             text = block.text.strip()
             html = f"<p>{text}</p>" if text else ""
         elif isinstance(block, Table):
@@ -100,21 +201,24 @@ class PostProcessor:
             html = f"<table border='1' cellspacing='0' cellpadding='5'>{''.join(rows)}</table>"
         
         for img in images:
-            path = f"{sub_dir}/{img}" if sub_dir else img
-            html += f'<div class="img-container"><img src="/media/{path}" class="question-img" /></div>'
+            html += self.img_html(img, sub_dir)
                 
         return html, images
 
     def blocks_to_html_str(self, doc, blks, is_stem=False, skip_images=False, sub_dir=None):
+        with self.profile.stage("html"):
+            return self._blocks_to_html_str(doc, blks, is_stem, skip_images, sub_dir)
+
+    def _blocks_to_html_str(self, doc, blks, is_stem=False, skip_images=False, sub_dir=None):
         htmls = []
         imgs = []
         for i_idx, b in enumerate(blks):
-            if isinstance(b, Paragraph):
+            if isinstance(b, (Paragraph, ParagraphSlice)):
                 text = b.text.strip()
                 if text in FORCE_DELETE_LINES:
                     continue
             
-            if is_stem and i_idx == 0 and isinstance(b, Paragraph):
+            if is_stem and i_idx == 0 and isinstance(b, (Paragraph, ParagraphSlice)):
                 text = b.text.strip()
                 match = Q_PATTERN.match(text)
                 if match:
@@ -125,8 +229,7 @@ class PostProcessor:
                     h = f"<p>{cleaned_text}</p>" if cleaned_text else ""
                     
                     for img in block_imgs:
-                        path = f"{sub_dir}/{img}" if sub_dir else img
-                        h += f'<div class="img-container"><img src="/media/{path}" class="question-img" /></div>'
+                        h += self.img_html(img, sub_dir)
                     
                     htmls.append(h)
                     continue
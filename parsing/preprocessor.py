@@ -16,6 +16,13 @@ HEADER_PATTERN = re.compile(
 # Ignore Pattern (e.g. （共20题，参考时限10分钟）)
 IGNORE_PATTERN = re.compile(r'^\s*[\(（]共\d+题[，,]\s*参考时限\d+分钟[\)）]')
 
+# Unified Answer Regex
+ANSWER_REGEX = re.compile(
+    r'(【\s*答案\s*】|【\s*解析\s*】|【\s*拓展\s*】|【\s*来源\s*】|正确\s*答案|参考\s*答案|答案\s*[:：]?|解析\s*[:：]?)'
+)
+# Option Pattern
+OPTION_PATTERN = re.compile(r'^\s*\(?[A-DＡ-Ｄ]\)?[\.．、\s]')
+
 def iter_block_items(parent):
     """Iterate through docx blocks (Paragraphs and Tables)"""
     if isinstance(parent, _Document):
@@ -30,3 +37,87 @@ def iter_block_items(parent):
             yield Paragraph(child, parent)
         elif isinstance(child, CT_Tbl):
             yield Table(child, parent)
+
+# Image references inside a run (DrawingML blip / legacy VML imagedata)
+_BLIP_EMBED = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed'
+_VML_ID = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+
+def run_image_rids(r_elm) -> list:
+    rids = []
+    for blip in r_elm.iter('{http://schemas.openxmlformats.org/drawingml/2006/main}blip'):
+        rid = blip.get(_BLIP_EMBED)
+        if rid: rids.append(rid)
+    for idata in r_elm.iter('{urn:schemas-microsoft-com:vml}imagedata'):
+        rid = idata.get(_VML_ID)
+        if rid: rids.append(rid)
+    return rids
+
+class ParagraphSlice:
+    """
+    Read-only view of part of a Paragraph.
+    [start, end) are offsets into paragraph.text.strip(), the same text
+    the classifiers see. Runs are mapped to offsets once, so a split keeps
+    inline images on the correct side and never touches the source XML.
+    """
+    def __init__(self, paragraph, start=0, end=None):
+        self.paragraph = paragraph
+        self._runs = []  # (r_elm, raw_start, raw_end)
+        raw = []
+        pos = 0
+        for r in paragraph._element.xpath('./w:r | ./w:hyperlink/w:r'):
+            t = r.text
+            self._runs.append((r, pos, pos + len(t)))
+            raw.append(t)
+            pos += len(t)
+        raw_text = "".join(raw)
+        self._lead = len(raw_text) - len(raw_text.lstrip())
+        self._stripped = raw_text.strip()
+        self.start = start
+        self.end = len(self._stripped) if end is None else end
+
+    def split(self, offset):
+        """Split at an offset relative to this slice. Returns (head, tail)."""
+        cut = self.start + offset
+        return self._child(self.start, cut), self._child(cut, self.end)
+
+    def _child(self, start, end):
+        view = ParagraphSlice.__new__(ParagraphSlice)
+        view.paragraph = self.paragraph
+        view._runs, view._lead, view._stripped = self._runs, self._lead, self._stripped
+        view.start, view.end = start, end
+        return view
+
+    @property
+    def text(self):
+        return self._stripped[self.start:self.end]
+
+    def iter_runs(self):
+        """Yields (CT_R, text_fragment) for the runs overlapping this slice."""
+        lo, hi = self._lead + self.start, self._lead + self.end
+        for r, s, e in self._runs:
+            if e > lo and s < hi:
+                yield r, r.text[max(lo, s) - s:min(hi, e) - s]
+
+    def image_rids(self):
+        """
+        rIds of images in this slice, in document order.
+        An image belongs to the slice its run starts in; images before the
+        stripped text go to the head, images after it to the tail.
+        """
+        if self.start == 0 and self.end == len(self._stripped):
+            return run_image_rids(self.paragraph._element)
+
+        lo, hi = self._lead + self.start, self._lead + self.end
+        is_head = self.start == 0
+        is_tail = self.end == len(self._stripped)
+        rids = []
+        seen = set()
+        for r, s, _ in self._runs:
+            r_rids = run_image_rids(r)
+            seen.update(r_rids)
+            if (lo <= s < hi) or (is_head and s < lo) or (is_tail and s >= hi):
+                rids.extend(r_rids)
+        if is_head:
+            # Images outside plain runs (e.g. inside w:ins) stay with the head
+            rids.extend(rid for rid in run_image_rids(self.paragraph._element) if rid not in seen)
+        return rids
@@ -0,0 +1,151 @@
+"""
+Per-stage extraction profiling.
+
+QuestionExtractor, core and PostProcessor accept a profile and wrap their
+stages in `with profile.stage("html"):`. When profiling is off they get
+NULL_PROFILE, whose stage() hands back one shared no-op context manager,
+so the hooks cost a method call and nothing else.
+
+Finished profiles go to PROFILES, a small ring buffer read by the API.
+"""
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Off unless MISTAKE_RESERVOIR_PROFILE is set; the debug endpoint can flip it at runtime
+ENABLED = os.environ.get("MISTAKE_RESERVOIR_PROFILE", "") not in ("", "0")
+
+
+class _Stage:
+    __slots__ = ("profile", "name")
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile.start(self.name)
+
+    def __exit__(self, *exc):
+        self.profile.stop()
+        return False
+
+
+class Profile:
+    """
+    Exclusive (self) time per stage plus free-form counters.
+    Stages nest: time spent in an inner stage is not counted again in the
+    outer one, so the stage totals add up to the profiled wall time.
+    """
+    enabled = True
+
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.started = datetime.now()
+        self.totals: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.counts: Dict[str, int] = {}
+        self.wall: Optional[float] = None
+        self._t0 = time.perf_counter()
+        self._stack: List[list] = []  # [stage, start, child_time]
+
+    def start(self, stage: str):
+        self._stack.append([stage, time.perf_counter(), 0.0])
+
+    def stop(self):
+        stage, start, child = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        self.totals[stage] = self.totals.get(stage, 0.0) + elapsed - child
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self, name)
+
+    def count(self, name: str, n: int = 1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def finish(self) -> "Profile":
+        self.wall = time.perf_counter() - self._t0
+        return self
+
+    def to_dict(self) -> dict:
+        wall = self.wall if self.wall is not None else time.perf_counter() - self._t0
+        stages = dict(self.totals)
+        stages["other"] = max(0.0, wall - sum(self.totals.values()))
+        return {
+            "label": self.label,
+            "started": self.started.isoformat(timespec="seconds"),
+            "total_ms": round(wall * 1000, 3),
+            "stages_ms": {k: round(v * 1000, 3) for k, v in sorted(stages.items(), key=lambda kv: -kv[1])},
+            "calls": dict(self.calls),
+            "counts": dict(self.counts),
+        }
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullProfile:
+    """Stand-in used when profiling is off: every hook is a no-op."""
+    enabled = False
+    _stage = _NullStage()
+
+    def stage(self, name: str) -> _NullStage:
+        return self._stage
+
+    def count(self, name: str, n: int = 1):
+        pass
+
+    def finish(self):
+        return self
+
+
+NULL_PROFILE = NullProfile()
+
+
+class ProfileLog:
+    """Thread-safe ring buffer of finished profiles (as dicts)."""
+    def __init__(self, maxlen: int = 50):
+        self._items = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+    def add(self, profile: Profile) -> dict:
+        entry = profile.finish().to_dict()
+        with self._lock:
+            entry["id"] = self._next_id
+            self._next_id += 1
+            self._items.append(entry)
+        return entry
+
+    def recent(self, n: int) -> List[dict]:
+        with self._lock:
+            return list(self._items)[-n:] if n > 0 else []
+
+    def all(self) -> List[dict]:
+        with self._lock:
+            return list(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+PROFILES = ProfileLog()
+
+
+def new_profile(label: str = "", force: bool = False):
+    """A recording Profile when profiling is on (or forced), else NULL_PROFILE."""
+    return Profile(label) if (ENABLED or force) else NULL_PROFILE
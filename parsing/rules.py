@@ -0,0 +1,248 @@
+"""
+Unified line classifier.
+
+Question / header / answer detection used to be spread over preprocessor,
+core and util/converter_rules, each caller running its own chain of
+regexes and `in` checks per line. RuleEngine compiles all of them once:
+
+- One anchored regex alternation decides what a line *starts* with
+  (header, stop header, question number, ignore line, option).
+- One Aho-Corasick pass finds every keyword *inside* the line
+  (module names, material cues, force-delete phrases, answer cues).
+- The answer regexes only run when the keyword pass saw an answer cue.
+
+The result is a LineClass shared by QuestionExtractor, core and the
+converters in util/.
+"""
+import re
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .preprocessor import Q_PATTERN, HEADER_PATTERN, IGNORE_PATTERN, ANSWER_REGEX, OPTION_PATTERN
+from .postprocessor import FORCE_DELETE_LINES
+
+try:
+    from util.converter_rules import (
+        START_KEYWORD_REGEX,
+        END_KEYWORD_PATTERNS,
+        STRONG_DELETE_CONTAIN,
+        FORCE_DELETE_PREFIXES,
+        ANSWER_VAL_PATTERN
+    )
+except ImportError:
+    import os
+    import sys
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from util.converter_rules import (
+        START_KEYWORD_REGEX,
+        END_KEYWORD_PATTERNS,
+        STRONG_DELETE_CONTAIN,
+        FORCE_DELETE_PREFIXES,
+        ANSWER_VAL_PATTERN
+    )
+
+# Header keyword -> module. Order matters: first main module wins,
+# then a subtype (both keywords present) overrides it.
+MODULE_KEYWORDS = [
+    ("常识", "常识"),
+    ("言语", "言语"),
+    ("数量", "数量"),
+    ("资料", "资料"),
+    ("判断", "判断"),
+    ("政治", "政治理论"),
+]
+SUBTYPE_KEYWORDS = [
+    (("图形", "推理"), "图形"),
+    (("定义", "判断"), "定义"),
+    (("类比", "推理"), "类比"),
+    (("逻辑", "判断"), "逻辑"),
+]
+
+# Any line containing one of these may carry an answer marker.
+# Every alternative of ANSWER_REGEX / START_KEYWORD_REGEX contains one of them.
+ANSWER_CUES = ("答案", "解析", "拓展", "来源")
+
+# "根据 / 材料 / 阅读" under a header means the header opens a material block
+MATERIAL_CUES = ("根据", "材料", "阅读")
+
+
+class KeywordMatcher:
+    """
+    Minimal Aho-Corasick automaton.
+    Finds every (possibly overlapping) keyword occurrence in one pass.
+    """
+    def __init__(self, keywords):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._out: List[List[str]] = [[]]
+        for kw in keywords:
+            if kw:
+                self._add(kw)
+        self._fail = [0] * len(self._goto)
+        self._build()
+        # While at the root, jump straight to the next char that can start a keyword
+        self._skip = re.compile('[' + ''.join(re.escape(ch) for ch in self._goto[0]) + ']')
+
+    def _add(self, kw: str):
+        state = 0
+        for ch in kw:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._out.append([])
+            state = nxt
+        if kw not in self._out[state]:
+            self._out[state].append(kw)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def iter(self, text: str) -> Iterator[Tuple[int, str]]:
+        """Yields (start_index, keyword) for every occurrence."""
+        goto, fail, out, skip = self._goto, self._fail, self._out, self._skip
+        state = 0
+        i, n = 0, len(text)
+        while i < n:
+            if not state:
+                m = skip.search(text, i)
+                if not m:
+                    return
+                i = m.start()
+            ch = text[i]
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for kw in out[state]:
+                yield i - len(kw) + 1, kw
+            i += 1
+
+
+@dataclass
+class LineClass:
+    """Classification of one stripped line of text."""
+    text: str
+    q_num: Optional[int] = None       # Leading question number ("12." / "(12)")
+    q_end: int = 0                    # Offset where the question text starts
+    header: Optional[str] = None      # 'part' | 'section' | 'material' (extractor headers)
+    end_header: bool = False          # Header that stops converter deletion
+    module: Optional[str] = None      # Module named by a part/section header
+    material_cue: bool = False        # Mentions 根据/材料/阅读
+    is_option: bool = False
+    ignore: bool = False              # "（共20题，参考时限10分钟）"
+    answer_pos: int = -1              # Start of the first answer/analysis marker
+    delete_pos: int = -1              # Start of the converter's delete trigger
+    answer_letter: Optional[str] = None
+    force_delete: bool = False        # Converter single-line delete
+    drop_line: bool = False           # Filler line such as "故本题选"
+
+
+class RuleEngine:
+    def __init__(self):
+        # Leading-anchor alternation. Each config pattern keeps its own ^\s*,
+        # so wrapping them in named groups preserves their exact semantics.
+        # Extractor headers come first; they are stop headers only where the
+        # converter's own patterns agree (it stops at 第一..五部分, not 第六..十).
+        self.stop_regex = re.compile('|'.join(p.pattern for p in END_KEYWORD_PATTERNS[1:]))
+        leads = [
+            ("header", HEADER_PATTERN),
+            ("stop", self.stop_regex),
+            ("q", Q_PATTERN),
+            ("ignore", IGNORE_PATTERN),
+            ("option", OPTION_PATTERN),
+        ]
+        self.lead_regex = re.compile('|'.join(f'(?P<{name}>{p.pattern})' for name, p in leads))
+
+        self.module_keywords = MODULE_KEYWORDS
+        self.subtype_keywords = SUBTYPE_KEYWORDS
+        self.force_delete_prefixes = set(FORCE_DELETE_PREFIXES)
+        self.strong_delete = set(STRONG_DELETE_CONTAIN)
+        self.drop_lines = FORCE_DELETE_LINES
+
+        keywords = set(ANSWER_CUES) | set(MATERIAL_CUES)
+        keywords |= self.force_delete_prefixes | self.strong_delete
+        for kw, _ in self.module_keywords:
+            keywords.add(kw)
+        for kws, _ in self.subtype_keywords:
+            keywords.update(kws)
+        self.matcher = KeywordMatcher(sorted(keywords))
+
+    def classify(self, text: str) -> LineClass:
+        """Classify a stripped line. Safe to call with ''."""
+        cls = LineClass(text=text)
+        if not text:
+            return cls
+
+        m = self.lead_regex.match(text)
+        if m:
+            kind = m.lastgroup
+            if kind == "header":
+                cls.end_header = self.stop_regex.match(text) is not None
+                lead = text.lstrip()[:1]
+                if lead == "第":
+                    cls.header = "part"
+                elif lead in ("根", "阅"):
+                    cls.header = "material"
+                else:
+                    cls.header = "section"
+            elif kind == "stop":
+                cls.end_header = True
+            elif kind == "q":
+                cls.q_num = int(''.join(ch for ch in m.group("q") if ch.isdigit()))
+                cls.q_end = m.end()
+            elif kind == "ignore":
+                cls.ignore = True
+            elif kind == "option":
+                cls.is_option = True
+
+        hits = set()
+        for start, kw in self.matcher.iter(text):
+            hits.add(kw)
+            if start == 0 and kw in self.force_delete_prefixes:
+                cls.force_delete = True
+        if hits & self.strong_delete:
+            cls.force_delete = True
+        cls.material_cue = any(kw in hits for kw in MATERIAL_CUES)
+
+        if cls.header in ("part", "section"):
+            cls.module = self._module(hits)
+
+        if any(kw in hits for kw in ANSWER_CUES):
+            ans = ANSWER_REGEX.search(text)
+            if ans:
+                cls.answer_pos = ans.start()
+            start = START_KEYWORD_REGEX.search(text)
+            if start:
+                cls.delete_pos = start.start()
+                val = ANSWER_VAL_PATTERN.search(text)
+                if val:
+                    cls.answer_letter = val.group(1).upper()
+
+        cls.drop_line = text in self.drop_lines
+        return cls
+
+    def _module(self, hits) -> Optional[str]:
+        module = None
+        for kw, name in self.module_keywords:
+            if kw in hits:
+                module = name
+                break
+        for kws, name in self.subtype_keywords:
+            if all(kw in hits for kw in kws):
+                module = name
+                break
+        return module
+
+
+# Shared instance, compiled once at import
+RULES = RuleEngine()
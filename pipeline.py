@@ -0,0 +1,65 @@
+"""
+Single-parse pipeline for 解析 papers (questions followed by answers/analysis).
+
+One load of the source DOCX gives everything that used to take three
+separate parses (complete_converter, QuestionExtractor, extract_answers):
+the structured questions for the reservoir, the student-facing paper with
+answers removed and an answer table appended, and the answer key.
+
+Extraction runs first because it only reads the document; the cleaning
+pass then rewrites the same in-memory tree, which is saved once.
+"""
+import os
+from typing import Dict, Optional
+
+from docx import Document
+
+from parsing import profiling
+from util.complete_converter import clean_document
+
+PAPER_ID_PREFIX = "Paper ID: "
+
+
+def generated_paper_id(doc) -> Optional[str]:
+    """UUID of a paper this app generated (its first paragraph), else None."""
+    if len(doc.paragraphs) > 0:
+        first_para = doc.paragraphs[0].text.strip()
+        if first_para.startswith(PAPER_ID_PREFIX):
+            return first_para[len(PAPER_ID_PREFIX):].strip() or None
+    return None
+
+
+def convert_paper(source_path: str, output_path: Optional[str], extractor, preview_key: str = None,
+                  skip_images: bool = False, sub_dir: str = None, profile=None) -> Dict:
+    """
+    Returns {"questions": [...], "answers": {q_num: letter}, "deleted": n, "output": output_path,
+    "paper_id": uuid of a generated paper or None}.
+    Question options are those of QuestionExtractor.extract_from_file.
+    With output_path None the cleaned paper is not written.
+    """
+    label = f"{os.path.basename(source_path)} (convert)"
+    owns_profile = profile is None
+    if owns_profile:
+        profile = profiling.new_profile(label)
+    try:
+        with profile.stage("load"):
+            doc = Document(source_path)
+        paper_id = generated_paper_id(doc)
+        questions = extractor.extract_from_document(doc, label, preview_key=preview_key, skip_images=skip_images,
+                                                    sub_dir=sub_dir, profile=profile)
+        with profile.stage("clean"):
+            cleaned = clean_document(doc)
+        if output_path:
+            with profile.stage("save"):
+                doc.save(output_path)
+    finally:
+        if owns_profile and profile.enabled:
+            profiling.PROFILES.add(profile)
+
+    return {
+        "questions": questions,
+        "answers": cleaned["answers"],
+        "deleted": cleaned["deleted"],
+        "output": output_path,
+        "paper_id": paper_id,
+    }
@@ -0,0 +1,229 @@
+"""
+Render IR: the parts of a question's HTML that PaperBuilder draws, parsed once.
+
+Computed when a question is saved or edited and stored next to the HTML
+(questions.render_ir / materials.render_ir), so generating a paper does no
+HTML parsing. Rows without a current IR are converted on the fly with the
+same functions.
+
+    question: {"v", "content": inline|None, "options": [inline, ...]|None,
+               "answer": inline|None, "letter": "A".."H" or " "}
+    material: {"v", "blocks": [{"p": text} | {"img": src, "w", "h"}, ...]}
+    inline:   [text | {"img": src, "w", "h"}, ...]
+
+None marks an empty HTML field (nothing is drawn for it); image sizes are
+pixels and are left out when unknown, PaperBuilder then looks them up.
+The traversal mirrors what PaperBuilder did with the HTML, so papers come
+out the same either way.
+"""
+import re
+import json
+from typing import Dict, List, Optional
+
+# bs4 is imported where HTML is parsed: it is slow to load and the server does not need it to start
+# Bump when the IR format or its derivation changes; older stored IR is then ignored
+IR_VERSION = 1
+
+MATERIAL_INSTRUCTION = re.compile(r'根据以下材料[，,]*回答下列问题[：:]*(?:\s*\(共\d+题[，,]*限时\d+分钟\))?')
+MATERIAL_TIME_HEADER = re.compile(r'^\s*\(共\d+题[，,]*限时\d+分钟\)')
+ANSWER_LETTER = re.compile(r'(?:答案|Answer)[^\w]*([A-H])', re.IGNORECASE)
+TAG = re.compile(r'<[^>]+>')
+
+def img_tag_size(img):
+    """(w, h) from the width/height attributes written at extraction, else None."""
+    try:
+        w, h = int(img.get('width')), int(img.get('height'))
+        return (w, h) if w > 0 and h > 0 else None
+    except (TypeError, ValueError):
+        return None
+
+def _image_node(src, size, image_meta) -> dict:
+    node = {"img": src}
+    if not size and src and image_meta:
+        meta = image_meta.get(src.split('/')[-1])
+        if meta and meta.get('width') and meta.get('height'):
+            size = (meta['width'], meta['height'])
+    if size:
+        node["w"], node["h"] = size
+    return node
+
+def _flatten(element, image_meta, out: list):
+    if element.name == 'img':
+        out.append(_image_node(element.get('src'), img_tag_size(element), image_meta))
+        return
+    if isinstance(element, str): # NavigableString
+        out.append(str(element))
+        return
+    for child in element.children:
+        _flatten(child, image_meta, out)
+
+def _inline(element, image_meta) -> list:
+    nodes = []
+    _flatten(element, image_meta, nodes)
+    return nodes
+
+def inline_nodes(html: Optional[str], image_meta: Dict[str, dict] = None) -> Optional[list]:
+    if not html:
+        return None
+    from bs4 import BeautifulSoup
+    return _inline(BeautifulSoup(html, 'html.parser'), image_meta)
+
+def option_lines(html: Optional[str], image_meta: Dict[str, dict] = None) -> Optional[List[list]]:
+    """One inline list per option paragraph (<p>), or the whole blob as one line."""
+    if not html:
+        return None
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    ps = soup.find_all('p')
+    if ps:
+        return [_inline(p, image_meta) for p in ps]
+    return [_inline(soup, image_meta)]
+
+def answer_letter(answer_html: Optional[str]) -> str:
+    """Choice letter for the answer table, " " when there is none."""
+    txt = answer_html or ''
+    match = ANSWER_LETTER.search(txt)
+    if match:
+        return match.group(1).upper()
+    # Fallback: the answer may be just the letter
+    clean = TAG.sub('', txt).strip()
+    return clean if clean in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H'] else " "
+
+def question_ir(content_html: Optional[str], options_html: Optional[str], answer_html: Optional[str],
+                image_meta: Dict[str, dict] = None) -> dict:
+    return {
+        "v": IR_VERSION,
+        "content": inline_nodes(content_html, image_meta),
+        "options": option_lines(options_html, image_meta),
+        "answer": inline_nodes(answer_html, image_meta),
+        "letter": answer_letter(answer_html),
+    }
+
+def material_ir(content_html: Optional[str], image_meta: Dict[str, dict] = None) -> dict:
+    blocks = []
+    # The paper prints its own instruction line; drop the source's
+    clean = MATERIAL_INSTRUCTION.sub('', content_html or '').strip()
+    clean = MATERIAL_TIME_HEADER.sub('', clean).strip()
+    if clean:
+        from bs4 import BeautifulSoup
+        for elem in BeautifulSoup(clean, 'html.parser').find_all(['p', 'div', 'table']):
+            if elem.name == 'p':
+                text = elem.get_text().strip()
+                if text:
+                    blocks.append({"p": text})
+            elif elem.name == 'div' and 'img-container' in elem.get('class', []):
+                img = elem.find('img')
+                if img:
+                    blocks.append(_image_node(img.get('src'), img_tag_size(img), image_meta))
+            # Tables are not rendered
+    return {"v": IR_VERSION, "blocks": blocks}
+
+def unsized_images(ir: dict) -> List[str]:
+    """File names of images whose size the IR does not know."""
+    names = []
+    def walk(nodes):
+        for node in nodes or []:
+            if isinstance(node, dict) and node.get("img") and "w" not in node:
+                names.append(node["img"].split('/')[-1])
+    walk(ir.get("content"))
+    walk(ir.get("answer"))
+    walk(ir.get("blocks"))
+    for line in ir.get("options") or []:
+        walk(line)
+    return names
+
+def of_question(q: dict) -> dict:
+    """IR of a question row: the stored one, else converted from its HTML."""
+    return load(q.get('render_ir')) or question_ir(q.get('content_html'), q.get('options_html'), q.get('answer_html'))
+
+def of_material(q: dict) -> dict:
+    """IR of the material joined to a question row."""
+    return load(q.get('material_render_ir')) or material_ir(q.get('material_content'))
+
+# --- Paper layout, shared by the DOCX (generator.py) and HTML (paper_html.py) renderers ---
+
+# Sort Order
+TYPE_ORDER = {
+    '常识': 1,
+    '言语': 2,
+    '数量': 3,
+    '判断': 4, '图形': 4.1, '定义': 4.2, '类比': 4.3, '逻辑': 4.4,
+    '资料': 5
+}
+
+SECTION_TITLES = {
+    '常识': '第一部分 常识判断',
+    '言语': '第二部分 言语理解与表达',
+    '数量': '第三部分 数量关系',
+    '判断': '第四部分 判断推理',
+    '图形': '第四部分 判断推理', # Subtypes grouped under main
+    '定义': '第四部分 判断推理',
+    '类比': '第四部分 判断推理',
+    '逻辑': '第四部分 判断推理',
+    '资料': '第五部分 资料分析'
+}
+
+def sort_questions(questions: List[dict]):
+    """Paper order, in place: by section, then material, then source number."""
+    questions.sort(key=lambda q: (TYPE_ORDER.get(q.get('type', ''), 99), q.get('material_id') or 0, q.get('original_num')))
+
+def paper_layout(questions: List[dict], irs: List[dict]):
+    """
+    The question paper as a flat sequence, for sorted questions and their IRs:
+        ("section", title)          first question of a section
+        ("material", blocks)        first question of a material group
+        ("question", number, q, ir)
+    """
+    added_sections = set()
+    last_material_id = None
+    for number, (q, ir) in enumerate(zip(questions, irs), 1):
+        # Subtypes share their main type's section
+        title = SECTION_TITLES.get(q.get('type') or "其他", f"部分 {q.get('type') or '其他'}")
+        if title not in added_sections:
+            added_sections.add(title)
+            last_material_id = None
+            yield ("section", title)
+
+        mid = q.get('material_id')
+        if mid and mid != last_material_id:
+            if q.get('material_content'):
+                yield ("material", of_material(q)["blocks"])
+            last_material_id = mid
+        elif not mid:
+            last_material_id = None
+
+        yield ("question", number, q, ir)
+
+def image_placement(size, q_type: Optional[str] = None):
+    """
+    How a paper shows an image of pixel `size` ((w, h) or None):
+        ("figure", None)   图形 questions: fixed 4cm high, inline
+        ("inline", None)   small (< 250px high): a symbol/formula at text height
+        ("block", inches)  on its own line, at most `inches` wide (None: natural size)
+    """
+    if q_type and '图形' in str(q_type):
+        return ("figure", None)
+    if not size:
+        return ("block", 2.0) # Unknown size
+    w, h = size
+    if h < 250:
+        return ("inline", None)
+    if w > 400:
+        return ("block", 5.5) # Max Page Width
+    return ("block", 3.5 if w > 300 else None)
+
+def dumps(ir: dict) -> str:
+    return json.dumps(ir, ensure_ascii=False, separators=(',', ':'))
+
+def load(value) -> Optional[dict]:
+    """Stored IR (JSON text or dict), or None when missing, unreadable or outdated."""
+    if not value:
+        return None
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return None
+    if not isinstance(value, dict) or value.get("v") != IR_VERSION:
+        return None
+    return value
@@ -0,0 +1,99 @@
+"""
+Startup timing for `python main.py --profile-startup`.
+
+main.py imports this module first. With the flag, an import hook records
+how long every module takes to import (self time, summed per top-level
+package, plus the cumulative time of each import main.py makes itself),
+and main.py marks its init phases with `startup.mark("database")`. Once
+the server listens, report() prints both breakdowns and writes them to
+startup_profile.txt next to the data. Without the flag nothing is
+installed and mark() returns at once.
+"""
+import builtins
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+ENABLED = "--profile-startup" in sys.argv
+
+T0 = time.perf_counter()
+PHASES: List[tuple] = [] # (name, seconds since the previous mark)
+_last = T0
+
+
+class ImportTimer:
+    """Wraps builtins.__import__ and times first-time imports, like -X importtime."""
+    def __init__(self):
+        self.self_time: Dict[str, float] = {}   # top-level package -> seconds
+        self.direct: Dict[str, float] = {}      # module imported by main.py -> cumulative seconds
+        self._stack: List[list] = []            # [child seconds]
+        self._original = None
+
+    def install(self):
+        self._original = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._original or builtins.__import__
+        if level or name in sys.modules:
+            return original(name, globals, locals, fromlist, level)
+        self._stack.append([0.0])
+        start = time.perf_counter()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            child = self._stack.pop()[0]
+            package = name.split('.')[0]
+            self.self_time[package] = self.self_time.get(package, 0.0) + elapsed - child
+            if self._stack:
+                self._stack[-1][0] += elapsed
+            elif globals and globals.get('__name__') in ('__main__', 'main'):
+                self.direct[name] = self.direct.get(name, 0.0) + elapsed
+
+
+IMPORTS = ImportTimer()
+if ENABLED:
+    IMPORTS.install()
+
+
+def mark(phase: str):
+    """End of a startup phase: the time since the previous mark is booked to it."""
+    global _last
+    if not ENABLED:
+        return
+    now = time.perf_counter()
+    PHASES.append((phase, now - _last))
+    _last = now
+
+
+def _rows(items: Dict[str, float], top: int) -> List[str]:
+    ranked = sorted(items.items(), key=lambda kv: -kv[1])[:top]
+    return [f"  {name:<32} {seconds * 1000:9.1f} ms" for name, seconds in ranked]
+
+
+def report(data_dir: Optional[str] = None, top: int = 15) -> Optional[str]:
+    """Print the startup breakdown (and save it under data_dir); None when not profiling."""
+    if not ENABLED:
+        return None
+    IMPORTS.uninstall()
+    total = time.perf_counter() - T0
+    lines = [f"Startup: {total * 1000:.1f} ms to a listening server", "", "Phases:"]
+    lines += [f"  {name:<32} {seconds * 1000:9.1f} ms" for name, seconds in PHASES]
+    lines += ["", "Imports made by main.py (cumulative):"] + _rows(IMPORTS.direct, top)
+    lines += ["", "Import self time by package:"] + _rows(IMPORTS.self_time, top)
+    text = "\n".join(lines)
+    print(text)
+    if data_dir:
+        try:
+            with open(os.path.join(data_dir, "startup_profile.txt"), "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+        except Exception as e:
+            print(f"Failed to write startup profile: {e}")
+    return text
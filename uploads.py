@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from typing import Dict, Optional, Tuple
+
+from process_lock import file_lock
+
+# Bump when extraction output changes so cached analyses are recomputed
+ANALYSIS_VERSION = 3
+# Chunked sessions untouched this long (seconds) are abandoned and removed
+SESSION_TTL = 24 * 3600
+
+class UploadTooLarge(Exception):
+    pass
+
+class OffsetMismatch(Exception):
+    def __init__(self, offset: int):
+        super().__init__(f"Expected offset {offset}")
+        self.offset = offset
+
+class UploadSession:
+    def __init__(self, upload_id: str, filename: str, size: Optional[int], path: str):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.size = size
+        self.path = path
+        self.offset = os.path.getsize(path) if os.path.exists(path) else 0
+        self.hasher = None # Rebuilt lazily after a restart
+        self.lock = threading.Lock() # This process's threads; file_lock() for other processes
+        self.lock_path = path + ".lock"
+
+    def file_lock(self):
+        return file_lock(self.lock_path)
+
+    def sync(self):
+        """Catch up with chunks another server process appended to the partial file."""
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size != self.offset:
+            self.offset = size
+            self.hasher = None
+
+class UploadStore:
+    """
+    Content-addressed upload storage.
+    Files live at <root>/<sha256>.docx, so identical bytes are stored once and
+    a re-upload is recognised without parsing. Chunked sessions are written to
+    <root>/.partial/<upload_id> (with <upload_id>.json holding filename and
+    size, and <upload_id>.lock serializing appends across processes) and
+    can be resumed from their current offset, also by another
+    server process than the one that started them. Sessions untouched for
+    `session_ttl` seconds are removed at startup and whenever a new one
+    starts.
+    """
+    def __init__(self, root: str, max_bytes: int = 100 * 1024 * 1024, session_ttl: float = SESSION_TTL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.session_ttl = session_ttl
+        self.partial_dir = os.path.join(root, ".partial")
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.sessions: Dict[str, UploadSession] = {}
+        self._lock = threading.Lock()
+        with self._lock:
+            self._expire_sessions()
+
+    # --- Content-addressed files ---
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, f"{digest}.docx")
+
+    def exists(self, digest: str) -> bool:
+        return bool(digest) and os.path.exists(self.path_for(digest))
+
+    def _is_digest(self, value: str) -> bool:
+        return isinstance(value, str) and len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+    def resolve(self, file_id: Optional[str] = None, filename: Optional[str] = None) -> Optional[str]:
+        """Path of an upload by digest, falling back to a legacy by-name upload."""
+        if file_id and self._is_digest(file_id) and self.exists(file_id):
+            return self.path_for(file_id)
+        if filename:
+            path = os.path.join(self.root, os.path.basename(filename))
+            if os.path.exists(path):
+                return path
+        return None
+
+    def adopt(self, path: str, digest: str) -> str:
+        """
+        Make a file outside the content-addressed layout (a legacy by-name
+        upload) resolvable by its digest, as a hard link where possible.
+        """
+        target = self.path_for(digest)
+        if not os.path.exists(target):
+            tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.part"
+            try:
+                os.link(path, tmp)
+            except OSError:
+                import shutil
+                shutil.copyfile(path, tmp)
+            os.replace(tmp, target)
+        return target
+
+    # --- Chunked sessions ---
+
+    def start(self, filename: str, size: Optional[int] = None, upload_id: Optional[str] = None) -> UploadSession:
+        if size is not None and size > self.max_bytes:
+            raise UploadTooLarge(f"File exceeds {self.max_bytes} bytes")
+        with self._lock:
+            if upload_id and upload_id in self.sessions:
+                return self.sessions[upload_id]
+            self._expire_sessions()
+            # Resume a session whose partial file survived a restart
+            if not (upload_id and self._is_session_id(upload_id)):
+                upload_id = uuid.uuid4().hex
+            session = UploadSession(upload_id, filename, size, os.path.join(self.partial_dir, upload_id))
+            self._write_session_info(session)
+            self.sessions[upload_id] = session
+            return session
+
+    def _expire_sessions(self):
+        """Remove abandoned sessions: partial file, sidecar and in-memory entry (caller holds _lock)."""
+        now = time.time()
+        touched: Dict[str, float] = {} # upload_id -> latest mtime of its files
+        try:
+            names = os.listdir(self.partial_dir)
+        except OSError:
+            return
+        for name in names:
+            upload_id = name.split(".", 1)[0]
+            try:
+                mtime = os.path.getmtime(os.path.join(self.partial_dir, name))
+            except OSError:
+                continue
+            touched[upload_id] = max(mtime, touched.get(upload_id, 0.0))
+        for upload_id, mtime in touched.items():
+            if now - mtime <= self.session_ttl:
+                continue
+            for name in (upload_id, upload_id + ".json", upload_id + ".lock"):
+                try:
+                    os.remove(os.path.join(self.partial_dir, name))
+                except OSError:
+                    pass
+            self.sessions.pop(upload_id, None)
+
+    def _write_session_info(self, session: UploadSession):
+        tmp = f"{session.path}.json.{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"filename": session.filename, "size": session.size}, f, ensure_ascii=False)
+        os.replace(tmp, session.path + ".json")
+
+    def _is_session_id(self, value: str) -> bool:
+        return len(value) == 32 and all(c in "0123456789abcdef" for c in value)
+
+    def get(self, upload_id: str) -> Optional[UploadSession]:
+        with self._lock:
+            session = self.sessions.get(upload_id)
+            if session is None and self._is_session_id(upload_id):
+                # Started by another server process
+                session = self._load_session(upload_id)
+                if session:
+                    self.sessions[upload_id] = session
+        if session:
+            with session.lock:
+                session.sync()
+        return session
+
+    def _load_session(self, upload_id: str) -> Optional[UploadSession]:
+        path = os.path.join(self.partial_dir, upload_id)
+        try:
+            with open(path + ".json", "r", encoding="utf-8") as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return UploadSession(upload_id, info.get("filename"), info.get("size"), path)
+
+    def _ensure_hasher(self, session: UploadSession):
+        if session.hasher is None:
+            session.hasher = hashlib.sha256()
+            if os.path.exists(session.path):
+                with open(session.path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        session.hasher.update(chunk)
+
+    def append(self, session: UploadSession, offset: int, data: bytes) -> int:
+        """Append one chunk at `offset` (blocking; run in a worker thread)."""
+        with session.lock, session.file_lock():
+            session.sync()
+            if offset != session.offset:
+                raise OffsetMismatch(session.offset)
+            if session.offset + len(data) > self.max_bytes:
+                raise UploadTooLarge(f"File exceeds {self.max_bytes} bytes")
+            self._ensure_hasher(session)
+            with open(session.path, "ab") as f:
+                f.write(data)
+            session.hasher.update(data)
+            session.offset += len(data)
+            return session.offset
+
+    def complete(self, session: UploadSession) -> Tuple[str, bool]:
+        """Finalize a session into content-addressed storage. Returns (digest, already_stored)."""
+        # The .lock file stays (another process may be waiting on it); the expiry sweep removes it
+        with session.lock, session.file_lock():
+            session.sync()
+            if session.size is not None and session.offset != session.size:
+                raise OffsetMismatch(session.offset)
+            self._ensure_hasher(session)
+            digest = session.hasher.hexdigest()
+            if not os.path.exists(session.path):
+                open(session.path, "wb").close()
+            duplicate = self.exists(digest)
+            if duplicate:
+                os.remove(session.path) # Known bytes: keep the stored copy
+            else:
+                os.replace(session.path, self.path_for(digest))
+            if os.path.exists(session.path + ".json"):
+                os.remove(session.path + ".json")
+        with self._lock:
+            self.sessions.pop(session.upload_id, None)
+        return digest, duplicate
+
+    # --- Analysis cache ---
+
+    def _analysis_path(self, digest: str) -> str:
+        return os.path.join(self.root, f"{digest}.analysis.v{ANALYSIS_VERSION}.json")
+
+    def load_analysis(self, digest: str) -> Optional[dict]:
+        path = self._analysis_path(digest)
+        if not self._is_digest(digest) or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def save_analysis(self, digest: str, analysis: dict):
+        if not self._is_digest(digest): return
+        path = self._analysis_path(digest)
+        # Unique per process and thread: several server workers may analyze the same file
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(analysis, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"Failed to cache analysis {digest}: {e}")
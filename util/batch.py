@@ -0,0 +1,104 @@
+"""
+Batch helpers shared by the command line utilities.
+
+Inputs may be files, directories or glob patterns; files are processed
+across a process pool (python-docx work is CPU bound, so threads would
+serialize on the GIL) and every result carries its own timing.
+"""
+import csv
+import glob
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+def collect_files(inputs: Iterable[str], suffix: str = ".docx", recursive: bool = False,
+                  name_filter: Optional[Callable[[str], bool]] = None) -> List[str]:
+    """Expand files / directories / globs into a sorted, de-duplicated file list."""
+    found = []
+    for item in inputs:
+        if os.path.isdir(item):
+            if recursive:
+                candidates = [os.path.join(root, f) for root, _, files in os.walk(item) for f in files]
+            else:
+                candidates = [os.path.join(item, f) for f in os.listdir(item)]
+        elif glob.has_magic(item):
+            candidates = glob.glob(item, recursive=recursive)
+        else:
+            candidates = [item]
+        for path in candidates:
+            name = os.path.basename(path)
+            # Skip Word lock files (~$name.docx) and anything filtered out
+            if not name.endswith(suffix) or name.startswith("~$") or not os.path.isfile(path):
+                continue
+            if name_filter and not name_filter(name):
+                continue
+            found.append(os.path.normpath(path))
+    return sorted(set(found))
+
+
+def _timed(func: Callable[[str], dict], path: str) -> dict:
+    start = time.perf_counter()
+    try:
+        result = dict(func(path) or {})
+        result.setdefault("ok", True)
+    except Exception as e:
+        result = {"ok": False, "error": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc()}
+    result["file"] = path
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def run_batch(func: Callable[[str], dict], files: List[str], workers: Optional[int] = None,
+              on_result: Optional[Callable[[dict], None]] = None) -> List[dict]:
+    """
+    Run func(path) -> dict for every file, in a process pool when there is
+    more than one file and more than one worker. func must be a module-level
+    function so it can be pickled. Results keep the input order.
+    """
+    workers = workers or os.cpu_count() or 1
+    results: Dict[str, dict] = {}
+    if workers <= 1 or len(files) <= 1:
+        for path in files:
+            results[path] = _timed(func, path)
+            if on_result: on_result(results[path])
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(files))) as pool:
+            futures = {pool.submit(_timed, func, path): path for path in files}
+            for future in as_completed(futures):
+                r = future.result()
+                results[futures[future]] = r
+                if on_result: on_result(r)
+    return [results[path] for path in files]
+
+
+def summarize(results: List[dict], wall_seconds: float) -> dict:
+    ok = [r for r in results if r.get("ok")]
+    return {
+        "files": len(results),
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "wall_seconds": round(wall_seconds, 3),
+        "cpu_seconds": round(sum(r["seconds"] for r in results), 3),
+        "slowest": sorted(({"file": r["file"], "seconds": r["seconds"]} for r in results),
+                          key=lambda r: -r["seconds"])[:5],
+    }
+
+
+def write_json(path: str, payload: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+
+
+def write_answer_csv(path: str, results: List[dict]):
+    """One row per answer: file, question, answer."""
+    # utf-8-sig so Excel opens the Chinese file names correctly
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "question", "answer"])
+        for r in results:
+            for q_num, letter in r.get("answers", {}).items():
+                writer.writerow([r["file"], q_num, letter])
@@ -8,23 +8,12 @@ from docx.table import _Cell, Table
 from docx.text.paragraph import Paragraph
 
 try:
-    from util.converter_rules import (
-        START_KEYWORD_REGEX,
-        END_KEYWORD_PATTERNS,
-        STRONG_DELETE_CONTAIN,
-        FORCE_DELETE_PREFIXES,
-        ANSWER_VAL_PATTERN
-    )
+    from parsing.rules import RULES
 except ImportError:
     import sys
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from util.converter_rules import (
-        START_KEYWORD_REGEX,
-        END_KEYWORD_PATTERNS,
-        STRONG_DELETE_CONTAIN,
-        FORCE_DELETE_PREFIXES,
-        ANSWER_VAL_PATTERN
-    )
+    from parsing.rules import RULES
+from util import batch
 
 DEBUG_MODE = False
 
@@ -104,10 +93,26 @@ def has_image(paragraph):
     xml = paragraph._element.xml
     return 'w:drawing' in xml or 'w:pict' in xml
 
-def clean_docx_block(input_path, output_path):
-    print(f"Processing (Block Mode): {os.path.basename(input_path)}")
+def clean_docx_block(input_path, output_path, verbose=True):
+    """
+    Write the question-only version of input_path to output_path.
+    Returns {"answers": {q_num: letter}, "deleted": empty paragraphs removed}.
+    """
+    if verbose:
+        print(f"Processing (Block Mode): {os.path.basename(input_path)}")
     doc = Document(input_path)
-    
+    result = clean_document(doc)
+    doc.save(output_path)
+    if verbose:
+        print(f"  -> Done. Deleted empty paragraphs: {result['deleted']}. Extracted {len(result['answers'])} answers.")
+    return result
+
+def clean_document(doc):
+    """
+    Turn a loaded 解析 paper into the question-only version in place:
+    answers/analysis removed, answer table appended. Same return value as
+    clean_docx_block.
+    """
     if len(doc.paragraphs) > 0:
         title_p = doc.paragraphs[0]
         if "解析" in title_p.text:
@@ -132,13 +137,13 @@ def clean_docx_block(input_path, output_path):
         
         for p in paragraphs:
             text = p.text.strip()
+            line = RULES.classify(text)
             
             # --- EXTRACT ANSWER ---
             # Check for answer pattern even if deleting, because sometimes it's IN the deleted block
-            ans_match = ANSWER_VAL_PATTERN.search(text)
-            if ans_match and last_q_num > 0:
+            if line.answer_letter and last_q_num > 0:
                 # Only store if we haven't found an answer for this Q (or overwrite? usually first match is good)
-                extracted_answers[last_q_num] = ans_match.group(1).upper()
+                extracted_answers[last_q_num] = line.answer_letter
 
             # === STATE: DELETE ===
             if is_deleting:
@@ -147,28 +152,20 @@ def clean_docx_block(input_path, output_path):
                 stop_reason = ""
                 
                 # Check Question Number
-                q_pattern = END_KEYWORD_PATTERNS[0]
-                match = q_pattern.match(text)
-                if match:
-                    try:
-                        found_num = int(match.group(1))
-                        # Strictly increasing check with SMALL GAP
-                        if check_is_valid_next(found_num, last_q_num):
-                            stop_match = True
-                            stop_reason = f"End: Found Q{found_num}"
-                            last_q_num = found_num
-                            is_deleting = False
-                    except ValueError:
-                        pass
+                if line.q_num is not None:
+                    found_num = line.q_num
+                    # Strictly increasing check with SMALL GAP
+                    if check_is_valid_next(found_num, last_q_num):
+                        stop_match = True
+                        stop_reason = f"End: Found Q{found_num}"
+                        last_q_num = found_num
+                        is_deleting = False
                 
                 # Check Other Headers
-                if not stop_match:
-                    for pattern in END_KEYWORD_PATTERNS[1:]:
-                        if pattern.match(text):
-                            stop_match = True
-                            stop_reason = "End: Header"
-                            is_deleting = False
-                            break
+                if not stop_match and line.end_header:
+                    stop_match = True
+                    stop_reason = "End: Header"
+                    is_deleting = False
                 
                 if stop_match:
                     # Stopped deleting. Keep this line.
@@ -185,10 +182,9 @@ def clean_docx_block(input_path, output_path):
             # === STATE: KEEP ===
             if not is_deleting:
                 # 1. Check START Trigger
-                start_match = START_KEYWORD_REGEX.search(text)
-                if start_match:
+                if line.delete_pos >= 0:
                     is_deleting = True
-                    start_idx = start_match.start()
+                    start_idx = line.delete_pos
                     
                     if start_idx > 0:
                         keep = text[:start_idx].strip()
@@ -203,35 +199,18 @@ def clean_docx_block(input_path, output_path):
                     continue
                 
                 # 2. Check Force Delete (Single Line)
-                is_force = False
-                for kw in STRONG_DELETE_CONTAIN:
-                    if kw in text:
-                        # Also check if this line contains the answer before deleting!
-                        # (Already done at top of loop)
-                        is_force = True
-                        break
-                if not is_force:
-                    for prefix in FORCE_DELETE_PREFIXES:
-                        if text.startswith(prefix):
-                            is_force = True
-                            break
-                
-                if is_force:
+                # (Answer on this line was already captured at top of loop)
+                if line.force_delete:
                     apply_delete(p, reason="Force Delete")
                     continue
                 
                 # 3. Update Question Number Context (if strictly increasing)
-                q_pattern = END_KEYWORD_PATTERNS[0]
-                match = q_pattern.match(text)
-                if match:
-                    try:
-                        found_num = int(match.group(1))
-                        # ALSO APPLY STRICT CHECK HERE!
-                        # Prevents "14237" appearing in Material from corrupting last_q_num
-                        if check_is_valid_next(found_num, last_q_num):
-                            last_q_num = found_num
-                    except ValueError:
-                        pass
+                if line.q_num is not None:
+                    found_num = line.q_num
+                    # ALSO APPLY STRICT CHECK HERE!
+                    # Prevents "14237" appearing in Material from corrupting last_q_num
+                    if check_is_valid_next(found_num, last_q_num):
+                        last_q_num = found_num
 
     # Post Processing - Delete Empty Paragraphs
     count_deleted = 0
@@ -303,24 +282,71 @@ def clean_docx_block(input_path, output_path):
             # If chunk is smaller than chunk_size (last row), fill remaining with empty?
             # docx handles it fine, cells are already created blank.
 
-    doc.save(output_path)
-    print(f"  -> Done. Deleted empty paragraphs: {count_deleted}. Extracted {len(extracted_answers)} answers.")
+    return {"answers": extracted_answers, "deleted": count_deleted}
 
-if __name__ == "__main__":
-    folder = "."
-    files = [f for f in os.listdir(folder) if '解析' in f and f.endswith('.docx')]
+def output_path_for(in_path, out_dir=None):
+    folder, f = os.path.split(in_path)
+    out_name = f.replace("-解析", "").replace("解析", "")
+    if out_name == f: out_name = "题目版_" + f
+    return os.path.join(out_dir or folder, out_name)
+
+def convert_one(in_path, out_dir=None):
+    """Batch worker: convert one file, return its answers and output path."""
+    out_path = output_path_for(in_path, out_dir)
+    result = clean_docx_block(in_path, out_path, verbose=False)
+    # JSON object keys are strings anyway; keep question order numeric
+    result["answers"] = {str(k): v for k, v in sorted(result["answers"].items())}
+    result["output"] = out_path
+    return result
+
+def main(argv=None):
+    import argparse
+    import functools
+    import time
+    parser = argparse.ArgumentParser(description="Remove answers/analysis from 解析 papers and append an answer table.")
+    parser.add_argument("inputs", nargs="*", default=["."],
+                        help="Files, directories or glob patterns (default: current folder)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Descend into sub-directories")
+    parser.add_argument("-o", "--out-dir", help="Write converted files here (default: next to the input)")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--json", help="Write answer keys + per-file timings as JSON")
+    parser.add_argument("--csv", help="Write answer keys as CSV (file, question, answer)")
+    parser.add_argument("--all", action="store_true", help="Also take files without 解析 in the name")
+    args = parser.parse_args(argv)
+
+    # Converted outputs never contain 解析, so re-runs do not pick them up
+    name_filter = None if args.all else (lambda name: '解析' in name)
+    files = batch.collect_files(args.inputs, recursive=args.recursive, name_filter=name_filter)
     if not files:
         print("No matches found.")
-    else:
-        print(f"Found {len(files)} files.")
-        for f in files:
-            in_path = os.path.join(folder, f)
-            out_name = f.replace("-解析", "").replace("解析", "")
-            if out_name == f: out_name = "题目版_" + f
-            out_path = os.path.join(folder, out_name)
-            try:
-                clean_docx_block(in_path, out_path)
-            except Exception as e:
-                print(f"Error {f}: {e}")
-                import traceback
-                traceback.print_exc()
+        return 1
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+
+    print(f"Found {len(files)} files.")
+    def report(r):
+        if r["ok"]:
+            print(f"  {os.path.basename(r['file'])}: {len(r['answers'])} answers, {r['seconds']:.2f}s")
+        else:
+            print(f"  {os.path.basename(r['file'])}: FAILED {r['error']}")
+
+    start = time.perf_counter()
+    results = batch.run_batch(functools.partial(convert_one, out_dir=args.out_dir), files,
+                              workers=args.workers, on_result=report)
+    summary = batch.summarize(results, time.perf_counter() - start)
+    print(f"Done: {summary['succeeded']}/{summary['files']} files in {summary['wall_seconds']}s "
+          f"({summary['cpu_seconds']}s of work).")
+
+    if args.json:
+        batch.write_json(args.json, {"summary": summary, "files": [
+            {k: v for k, v in r.items() if k != "traceback"} for r in results]})
+    if args.csv:
+        batch.write_answer_csv(args.csv, [r for r in results if r["ok"]])
+    for r in results:
+        if not r["ok"]:
+            print(r["traceback"])
+    return 0 if summary["failed"] == 0 else 1
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -15,6 +15,12 @@ except ImportError:
     print("Error: 'python-docx' library is required. Please install it using 'pip install python-docx'.")
     sys.exit(1)
 
+try:
+    from util import batch
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from util import batch
+
 class SimpleAnswerExtractor:
     def __init__(self):
         # Regex Patterns (Adapted from extractor.py)
@@ -53,6 +59,9 @@ class SimpleAnswerExtractor:
             print(f"Error opening DOCX file: {e}")
             return []
 
+        return self.answers_from_document(doc)
+
+    def answers_from_document(self, doc) -> List[str]:
         answers = []
         blocks = self.iter_block_items(doc)
         
@@ -96,24 +105,61 @@ class SimpleAnswerExtractor:
 
         return answers
 
-def main():
-    parser = argparse.ArgumentParser(description="Extract just the answer keys (A/B/C/D) from a DOCX question file (Standalone).")
-    parser.add_argument("file", help="Path to the .docx file")
-    
-    args = parser.parse_args()
-    
-    extractor = SimpleAnswerExtractor()
-    print(f"Processing: {args.file} ...")
-    answers = extractor.extract_answers(args.file)
-    
-    print(f"\nFound {len(answers)} answers:\n")
-    
+def extract_one(path: str) -> dict:
+    """Batch worker: answers of one file, keyed by their 1-based position."""
+    # Open here rather than via extract_answers so a bad file fails the entry
+    answers = SimpleAnswerExtractor().answers_from_document(Document(path))
+    return {"answers": {str(i + 1): a for i, a in enumerate(answers)}}
+
+def print_answers(answers: List[str]):
     # Print in blocks of 5
     for i in range(0, len(answers), 5):
         chunk = answers[i:i+5]
         print(" ".join(chunk))
 
-    print("\nDone.")
+def main():
+    parser = argparse.ArgumentParser(description="Extract just the answer keys (A/B/C/D) from DOCX question files (Standalone).")
+    parser.add_argument("files", nargs="+", help="Paths to .docx files, directories or glob patterns")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Descend into sub-directories")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--json", help="Write answer keys + per-file timings as JSON")
+    parser.add_argument("--csv", help="Write answer keys as CSV (file, question, answer)")
+    
+    args = parser.parse_args()
+    
+    files = batch.collect_files(args.files, recursive=args.recursive)
+    if len(files) == 1 and not (args.json or args.csv):
+        extractor = SimpleAnswerExtractor()
+        print(f"Processing: {files[0]} ...")
+        answers = extractor.extract_answers(files[0])
+        print(f"\nFound {len(answers)} answers:\n")
+        print_answers(answers)
+        print("\nDone.")
+        return 0
+    if not files:
+        print("No .docx files found.")
+        return 1
+
+    import time
+    print(f"Processing {len(files)} files ...")
+    start = time.perf_counter()
+    results = batch.run_batch(extract_one, files, workers=args.workers)
+    summary = batch.summarize(results, time.perf_counter() - start)
+
+    for r in results:
+        if not r["ok"]:
+            print(f"\n{r['file']}: FAILED {r['error']}")
+        elif not (args.json or args.csv):
+            print(f"\n{r['file']} ({r['seconds']:.2f}s)")
+            print_answers(list(r["answers"].values()))
+    if args.json:
+        batch.write_json(args.json, {"summary": summary, "files": [
+            {k: v for k, v in r.items() if k != "traceback"} for r in results]})
+    if args.csv:
+        batch.write_answer_csv(args.csv, [r for r in results if r["ok"]])
+    print(f"\nDone: {summary['succeeded']}/{summary['files']} files in {summary['wall_seconds']}s "
+          f"({summary['cpu_seconds']}s of work).")
+    return 0 if summary["failed"] == 0 else 1
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())